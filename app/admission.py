@@ -0,0 +1,207 @@
+"""Admission control for expensive endpoints: per-client token buckets and concurrency caps.
+
+Requests are sorted into classes (stack listings, logs, single-stack actions,
+host-wide operations) by method and path; other requests pass untouched. Each
+client has a token bucket per class and a request takes as many tokens as it
+costs (large log tails and searches cost more), and each class has a cap on
+requests served at once across all clients (streamed responses count until
+they end). A request over either limit gets an immediate 429 with Retry-After
+instead of queueing on the Docker daemon.
+
+Limits are per process: with several uvicorn workers, each enforces them alone.
+"""
+from __future__ import annotations
+
+import math
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import ADMISSION_CLIENT_HEADER, ADMISSION_CONTROL, ADMISSION_LIMITS, AdmissionLimit
+from app.metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED
+
+# Token buckets kept (least recently used clients are forgotten, i.e. start with a full bucket)
+_MAX_BUCKETS = 4096
+# Clients whose rejections are counted for state()
+_MAX_REJECTED_CLIENTS = 1024
+
+
+def _query_int(query: dict[str, list[str]], name: str, default: int) -> int:
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        return default
+
+
+def _logs_cost(query: dict[str, list[str]]) -> float:
+    return 1 + min(max(_query_int(query, "lines", 100), 1), 10000) // 1000
+
+
+def _search_cost(query: dict[str, list[str]]) -> float:
+    return 1 + min(max(_query_int(query, "limit", 200), 1), 5000) // 500
+
+
+# (method, path regex, class, cost from the query string or None for 1 token); first match wins
+_ROUTES: list[tuple[str, re.Pattern, str, Callable[[dict[str, list[str]]], float] | None]] = [
+    ("GET", re.compile(r"^/api/stacks$"), "list", None),
+    ("GET", re.compile(r"^/api/v1/stacks(/[^/]+)?$"), "list", None),
+    ("GET", re.compile(r"^/api/status$"), "list", None),
+    ("GET", re.compile(r"^/api/containers/[^/]+/logs$"), "logs", _logs_cost),
+    ("GET", re.compile(r"^/api/logs/search$"), "logs", _search_cost),
+    ("GET", re.compile(r"^/api/tasks/(export|[^/]+/export)$"), "logs", None),
+    ("POST", re.compile(r"^/api/stacks/(upgrade|pull|bulk)$"), "heavy", None),
+    ("POST", re.compile(r"^/api/(cleanup|update|prefetch|disk-usage|preflight)$"), "heavy", None),
+    ("POST", re.compile(r"^/api/maintenance/[^/]+/run$"), "heavy", None),
+    ("POST", re.compile(r"^/api/stacks/[^/]+/(start|stop|restart|upgrade)$"), "action", None),
+    ("POST", re.compile(r"^/api/stacks/[^/]+/services/[^/]+/upgrade$"), "action", None),
+    ("POST", re.compile(r"^/api/pass/login$"), "action", None),
+]
+
+
+@dataclass
+class _ClassStats:
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    admitted: int = 0
+    rejected: Counter = field(default_factory=Counter)  # reason -> count
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float) -> None:
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, limit: AdmissionLimit, now: float) -> float:
+        """Take `cost` tokens; return 0 if admitted, else the seconds until they'd be available."""
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / limit.rate
+
+
+_buckets: OrderedDict[tuple[str, str], _Bucket] = OrderedDict()
+_stats: dict[str, _ClassStats] = {name: _ClassStats() for name in ADMISSION_LIMITS}
+_rejected_clients: Counter = Counter()
+
+
+def classify(method: str, path: str, query_string: bytes = b"") -> tuple[str, float] | None:
+    """(class, cost) of a request, or None if it isn't subject to admission control."""
+    for route_method, pattern, name, cost_fn in _ROUTES:
+        if method == route_method and pattern.match(path):
+            cost = cost_fn(parse_qs(query_string.decode("latin-1"))) if cost_fn else 1.0
+            return name, min(cost, ADMISSION_LIMITS[name].burst)
+    return None
+
+
+def _client(scope: Scope) -> str:
+    if ADMISSION_CLIENT_HEADER:
+        wanted = ADMISSION_CLIENT_HEADER.lower().encode("latin-1")
+        for key, value in scope.get("headers", []):
+            if key == wanted:
+                last = value.decode("latin-1").split(",")[-1].strip()
+                if last:
+                    return last
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _reject(name: str, reason: str, client: str, retry_after: float, detail: str) -> JSONResponse:
+    _stats[name].rejected[reason] += 1
+    ADMISSION_REJECTED.inc(name, reason)
+    if client in _rejected_clients or len(_rejected_clients) < _MAX_REJECTED_CLIENTS:
+        _rejected_clients[client] += 1
+    seconds = max(math.ceil(retry_after), 1)
+    return JSONResponse({"detail": detail}, status_code=429, headers={"Retry-After": str(seconds)})
+
+
+def admit(name: str, cost: float, client: str, now: float | None = None) -> JSONResponse | None:
+    """Check a request of class `name` against its limits; return a 429 response or None.
+
+    On None the request holds one of the class's slots until release(name).
+    """
+    limit = ADMISSION_LIMITS[name]
+    stats = _stats[name]
+    if limit.concurrency and stats.in_flight >= limit.concurrency:
+        return _reject(name, "concurrency", client, 1, f"Too many concurrent {name} requests, retry shortly")
+
+    now = time.monotonic() if now is None else now
+    key = (name, client)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = _Bucket(limit.burst, now)
+        while len(_buckets) > _MAX_BUCKETS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(key)
+    wait = bucket.take(cost, limit, now)
+    if wait:
+        return _reject(name, "rate", client, wait, f"Rate limit exceeded for {name} requests")
+
+    stats.admitted += 1
+    stats.in_flight += 1
+    stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+    ADMISSION_IN_FLIGHT.set(stats.in_flight, name)
+    return None
+
+
+def release(name: str) -> None:
+    stats = _stats[name]
+    stats.in_flight -= 1
+    ADMISSION_IN_FLIGHT.set(stats.in_flight, name)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying admit()/release() around the classified endpoints."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+        match = classify(scope["method"], scope["path"], scope.get("query_string", b""))
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+        name, cost = match
+        rejected = admit(name, cost, _client(scope))
+        if rejected is not None:
+            await rejected(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            release(name)
+
+
+def state() -> dict:
+    return {
+        "enabled": ADMISSION_CONTROL,
+        "client_header": ADMISSION_CLIENT_HEADER or None,
+        "classes": {
+            name: {
+                "rate": limit.rate,
+                "burst": limit.burst,
+                "concurrency": limit.concurrency,
+                "in_flight": _stats[name].in_flight,
+                "peak_in_flight": _stats[name].peak_in_flight,
+                "admitted": _stats[name].admitted,
+                "rejected": {"rate": _stats[name].rejected["rate"],
+                             "concurrency": _stats[name].rejected["concurrency"]},
+            }
+            for name, limit in ADMISSION_LIMITS.items()
+        },
+        "tracked_clients": len({client for _, client in _buckets}),
+        "top_rejected_clients": dict(_rejected_clients.most_common(10)),
+    }
@@ -1,21 +1,162 @@
 import os
 import re
-import shutil
-
-DOCKER_APPS_PATH = os.getenv("DOCKER_APPS_PATH", "/data/docker-apps")
-if not os.path.isdir(DOCKER_APPS_PATH):
-    raise SystemExit(
-        f"DOCKER_APPS_PATH={DOCKER_APPS_PATH!r} does not exist or is not a directory. "
-        "Mount your stacks directory and set DOCKER_APPS_PATH accordingly."
-    )
+from dataclasses import dataclass
+
 SELF_STACK_NAME = "stack-manager"
+DOCKER_HOST = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
 GIT_COMMIT = os.getenv("GIT_COMMIT", "dev")[:7]
 
+
+@dataclass(frozen=True)
+class DockerEndpoint:
+    name: str  # short host label shown in the UI
+    url: str  # Docker API endpoint (unix://, tcp:// or ssh://)
+    apps_path: str  # stacks tree managed on this host
+
+
+def _parse_endpoints(value: str) -> list[DockerEndpoint]:
+    """Parse DOCKER_ENDPOINTS: "name=url,path;name2=url2,path2"."""
+    endpoints = []
+    for entry in filter(None, (e.strip() for e in value.split(";"))):
+        name, sep, rest = entry.partition("=")
+        url, sep2, path = rest.rpartition(",")
+        if not sep or not sep2 or not name.strip() or not url.strip() or not path.strip():
+            raise SystemExit(f"Invalid DOCKER_ENDPOINTS entry {entry!r}, expected name=url,path")
+        endpoints.append(DockerEndpoint(name.strip(), url.strip(), path.strip()))
+    return endpoints
+
+
+# Docker hosts and their stacks trees; the first one is the primary (local) host.
+# Without DOCKER_ENDPOINTS there is a single "local" host: DOCKER_HOST + DOCKER_APPS_PATH.
+DOCKER_ENDPOINTS = _parse_endpoints(os.getenv("DOCKER_ENDPOINTS", "")) or [
+    DockerEndpoint("local", DOCKER_HOST, os.getenv("DOCKER_APPS_PATH", "/data/docker-apps")),
+]
+PRIMARY_HOST = DOCKER_ENDPOINTS[0].name
+# Stacks tree of the primary host (git checkout for "update configs", cwd for host-wide commands)
+DOCKER_APPS_PATH = DOCKER_ENDPOINTS[0].apps_path
+ENDPOINTS_BY_NAME = {e.name: e for e in DOCKER_ENDPOINTS}
+
+# Per-host timeout in seconds when collecting container statuses
+HOST_STATUS_TIMEOUT = float(os.getenv("HOST_STATUS_TIMEOUT", "5"))
+
 # Regex for validating stack/service/container names (no path traversal)
 SAFE_NAME_RE = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_.-]*$")
 
-# Auto-detect docker compose command
-if shutil.which("docker") and os.system("docker compose version >/dev/null 2>&1") == 0:
-    COMPOSE_CMD = ["docker", "compose"]
-else:
-    COMPOSE_CMD = ["docker-compose"]
+# Max number of rendered stack cards kept in the fragment cache
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "1024"))
+
+# Max age in seconds of the stack index used by /api/v1/stacks before it is rebuilt
+STACK_INDEX_TTL = float(os.getenv("STACK_INDEX_TTL", "5"))
+
+# Directory for task/lock state shared between uvicorn workers (SQLite + lock files);
+# unset keeps everything in process memory, which only works with a single worker
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "")
+
+# Rolling upgrades: default mode for stack/service upgrades (overridable per request with
+# ?rolling=) and how long each recreated service may take to become healthy before rollback
+ROLLING_UPGRADE = os.getenv("ROLLING_UPGRADE", "false").lower() in ("1", "true", "yes")
+ROLLING_HEALTH_TIMEOUT = float(os.getenv("ROLLING_HEALTH_TIMEOUT", "120"))
+
+# Stop/restart stacks through the Docker API (parallel, in depends_on order) instead of
+# `compose down`; compose then only runs when the project's networks can't be removed
+NATIVE_STOP = os.getenv("NATIVE_STOP", "false").lower() in ("1", "true", "yes")
+
+# YAML file with the maintenance windows for scheduled batched upgrades (empty disables
+# the scheduler; see app/services/maintenance.py for the format)
+MAINTENANCE_FILE = os.getenv("MAINTENANCE_FILE", "")
+
+# Image pre-fetch for active stacks: off-peak windows ("HH:MM-HH:MM,..." local time, empty
+# disables the scheduler), seconds between passes inside a window, parallel pulls, and the
+# max megabytes of newly pulled images per pass (0 = unlimited)
+PREFETCH_WINDOWS = os.getenv("PREFETCH_WINDOWS", "")
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "3600"))
+PREFETCH_CONCURRENCY = max(int(os.getenv("PREFETCH_CONCURRENCY", "2")), 1)
+PREFETCH_BUDGET_MB = float(os.getenv("PREFETCH_BUDGET_MB", "0"))
+
+# Seconds a registry digest lookup may take before the image's currency counts as unknown
+REGISTRY_TIMEOUT = max(int(os.getenv("REGISTRY_TIMEOUT", "30")), 1)
+
+# Per-stack disk usage accounting: seconds between passes (0 disables it), seconds between
+# full rescans of bind-mounted directories (in between, only directories whose mtime changed
+# are listed again), the I/O scheduling class of the walker (idle, best-effort or none), and
+# how long a host's `docker system df` may take (slow with many images and volumes)
+DISK_USAGE_INTERVAL = float(os.getenv("DISK_USAGE_INTERVAL", "0"))
+DISK_USAGE_FULL_INTERVAL = float(os.getenv("DISK_USAGE_FULL_INTERVAL", "86400"))
+DISK_USAGE_IO_CLASS = os.getenv("DISK_USAGE_IO_CLASS", "idle")
+DISK_USAGE_DF_TIMEOUT = max(int(os.getenv("DISK_USAGE_DF_TIMEOUT", "600")), 1)
+
+# Processes parsing compose files when many changed at once (cold scan, git pull);
+# below 2, files are parsed in the scanning thread
+COMPOSE_PARSE_WORKERS = int(os.getenv("COMPOSE_PARSE_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+# Max number of `compose config` pre-flight checks running at once
+PREFLIGHT_CONCURRENCY = max(int(os.getenv("PREFLIGHT_CONCURRENCY", "4")), 1)
+
+# Threads reading container logs for /api/logs/search, shared by all searches of a worker
+LOG_SEARCH_CONCURRENCY = max(int(os.getenv("LOG_SEARCH_CONCURRENCY", "4")), 1)
+
+# Directory finished tasks are archived to (one .log.gz each) so they can still be exported
+# after they leave the task history, and for how many days; unset keeps no archive
+TASK_ARCHIVE_DIR = os.getenv("TASK_ARCHIVE_DIR", "")
+TASK_ARCHIVE_DAYS = float(os.getenv("TASK_ARCHIVE_DAYS", "7"))
+
+
+@dataclass(frozen=True)
+class AdmissionLimit:
+    rate: float  # tokens refilled per second, per client
+    burst: float  # bucket size, per client
+    concurrency: int  # requests of the class served at once, all clients together (0 = no cap)
+
+
+def _parse_limits(value: str, defaults: dict[str, AdmissionLimit]) -> dict[str, AdmissionLimit]:
+    """Parse ADMISSION_LIMITS: "class=rate/burst/concurrency,..." over the default limits."""
+    limits = dict(defaults)
+    for entry in filter(None, (e.strip() for e in value.split(","))):
+        name, sep, spec = entry.partition("=")
+        parts = spec.split("/")
+        try:
+            if not sep or name.strip() not in defaults or len(parts) != 3:
+                raise ValueError
+            limit = AdmissionLimit(float(parts[0]), float(parts[1]), int(parts[2]))
+            if limit.rate <= 0 or limit.burst < 1 or limit.concurrency < 0:
+                raise ValueError
+        except ValueError:
+            raise SystemExit(
+                f"Invalid ADMISSION_LIMITS entry {entry!r}, expected class=rate/burst/concurrency "
+                f"with class one of {', '.join(defaults)}"
+            )
+        limits[name.strip()] = limit
+    return limits
+
+
+# Admission control for expensive endpoints: per-client token buckets and a concurrency cap
+# per endpoint class (429 + Retry-After when exceeded). ADMISSION_CLIENT_HEADER names the
+# header holding the client address set by a reverse proxy (last value wins); empty uses
+# the peer address
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+ADMISSION_LIMITS = _parse_limits(os.getenv("ADMISSION_LIMITS", ""), {
+    "list": AdmissionLimit(5, 20, 8),
+    "logs": AdmissionLimit(2, 20, 4),
+    "action": AdmissionLimit(1, 10, 8),
+    "heavy": AdmissionLimit(0.2, 3, 2),
+})
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+
+
+# Max number of stacks processed at once by /api/stacks/bulk
+BULK_CONCURRENCY = max(int(os.getenv("BULK_CONCURRENCY", "4")), 1)
+
+# pass-cli session monitor: probe interval while active, backoff cap while inactive,
+# and max age of a cached result before a status request triggers a re-probe
+PASS_CHECK_INTERVAL = float(os.getenv("PASS_CHECK_INTERVAL", "60"))
+PASS_CHECK_MAX_INTERVAL = float(os.getenv("PASS_CHECK_MAX_INTERVAL", "600"))
+PASS_STATE_TTL = float(os.getenv("PASS_STATE_TTL", "900"))
+
+
+def check_apps_path() -> None:
+    """Exit if the primary stacks tree is missing (run by the startup hook, not at import)."""
+    if not os.path.isdir(DOCKER_APPS_PATH):
+        raise SystemExit(
+            f"DOCKER_APPS_PATH={DOCKER_APPS_PATH!r} does not exist or is not a directory. "
+            "Mount your stacks directory and set DOCKER_APPS_PATH accordingly."
+        )
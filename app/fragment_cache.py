@@ -0,0 +1,88 @@
+"""LRU cache for rendered template fragments (one entry per stack card)."""
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from app import metrics
+from app.config import FRAGMENT_CACHE_SIZE
+from app.main_templates import templates
+from app.metrics import TEMPLATE_RENDER_SECONDS
+
+
+class FragmentCache:
+    """Map a hash of the render context to the rendered HTML, evicting least recently used."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(capacity, 0)
+        self._entries: OrderedDict[str, Markup] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(template_name: str, data: dict) -> str:
+        payload = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+        digest = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+        return f"{template_name}:{digest}"
+
+    def render(self, template_name: str, **context) -> Markup:
+        """Return the rendered fragment, rendering only if this exact context is not cached."""
+        key = self.key(template_name, context)
+        html = self._entries.get(key)
+        if html is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+        self.misses += 1
+        with TEMPLATE_RENDER_SECONDS.time(template_name):
+            html = Markup(templates.get_template(template_name).render(**context))
+        if self.capacity:
+            self._entries[key] = html
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return html
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+stack_cards = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+# Stack fields partials/stack_card.html renders: cards are rendered from (and keyed on) these
+# only, so a change to anything else (disk usage, config verdict...) keeps the cached card
+_CARD_FIELDS = ("name", "host", "remote", "mode", "is_self", "busy", "prefetched", "status")
+
+
+def _collect_cache_metrics():
+    stats = stack_cards.stats()
+    for key in ("hits", "misses", "evictions"):
+        yield (f"stack_manager_fragment_cache_{key}_total", "counter", f"Stack card fragment cache {key}.", {}, stats[key])
+    yield ("stack_manager_fragment_cache_size", "gauge", "Stack card fragment cache entries.", {}, stats["size"])
+
+
+metrics.register_collector(_collect_cache_metrics)
+
+
+def render_stack_cards(stacks: list[dict]) -> list[Markup]:
+    """Render one card per stack, reusing cached HTML for unchanged stacks."""
+    return [
+        stack_cards.render("partials/stack_card.html", stack={k: s[k] for k in _CARD_FIELDS})
+        for s in stacks
+    ]
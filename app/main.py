@@ -1,27 +1,65 @@
-from pathlib import Path
+import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, Response
+from starlette.middleware.gzip import GZipMiddleware
 
+from app import admission, metrics, static_assets
+from app.config import check_apps_path
 from app.main_templates import templates
-from app.routers import api, sse
+from app.routers import api, api_v1, sse
+from app.services import (
+    capabilities, disk_usage, log_search, maintenance, pass_monitor, prefetch, process_service, task_export,
+)
 
-BASE_DIR = Path(__file__).resolve().parent
 
-app = FastAPI(title="Stack Manager")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start = time.perf_counter()
+    check_apps_path()
+    await capabilities.probe_all()
+    capabilities.record_startup("capabilities", time.perf_counter() - start)
+    static_assets.build()
+    pass_monitor.start()
+    process_service.start()
+    prefetch.start()
+    disk_usage.start()
+    maintenance.start()
+    task_export.start()
+    capabilities.record_startup("total", time.perf_counter() - start)
+    yield
+    log_search.stop()
+    await maintenance.stop()
+    await disk_usage.stop()
+    await prefetch.stop()
+    await task_export.stop()
+    await process_service.stop()
+    await pass_monitor.stop()
 
-app.mount("/static", StaticFiles(directory=BASE_DIR / "static"), name="static")
+
+app = FastAPI(title="Stack Manager", lifespan=lifespan)
+app.add_middleware(admission.AdmissionMiddleware)
+# HTML partials and JSON, compressed as they stream (SSE is excluded; static assets come precompressed)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+app.mount("/static", static_assets.StaticAssets(), name="static")
 
 app.include_router(api.router)
+app.include_router(api_v1.router)
 app.include_router(sse.router)
 
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html")
 
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
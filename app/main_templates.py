@@ -3,8 +3,10 @@ from pathlib import Path
 
 from fastapi.templating import Jinja2Templates
 
+from app import static_assets
 from app.config import GIT_COMMIT
 
 BASE_DIR = Path(__file__).resolve().parent
 templates = Jinja2Templates(directory=BASE_DIR / "templates")
 templates.env.globals["git_commit"] = GIT_COMMIT
+templates.env.globals["static_url"] = static_assets.url
@@ -0,0 +1,205 @@
+"""Minimal Prometheus metrics (text exposition format 0.0.4), no external dependency.
+
+Metrics are updated from the event loop and from worker threads; plain attribute
+updates keep the hot-path cost to a perf_counter() call and a bisect.
+"""
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond Docker API calls to long pulls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0,
+)
+
+_registry: list["_Metric"] = []
+_collectors: list[Callable[[], Iterable[tuple[str, str, str, dict[str, str], float]]]] = []
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        out = self._header()
+        for labels, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(v)}")
+        return out
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {} if labelnames else {(): 0}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> list[str]:
+        out = self._header()
+        for labels, v in sorted(self._values.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, labels)} {_fmt_value(v)}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("_hist", "_labels", "_start")
+
+    def __init__(self, hist: Histogram, labels: tuple[str, ...]) -> None:
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self) -> _Timer:
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        out = self._header()
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_fmt_value(bound)}"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {cumulative}")
+            lbl = _fmt_labels(self.labelnames, labels)
+            out.append(f"{self.name}_sum{lbl} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{lbl} {cumulative}")
+        return out
+
+
+def register_collector(
+    fn: Callable[[], Iterable[tuple[str, str, str, dict[str, str], float]]],
+) -> None:
+    """Register a scrape-time callback yielding (name, type, help, labels, value) samples."""
+    _collectors.append(fn)
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    seen: set[str] = set()
+    for fn in _collectors:
+        for name, kind, help, labels, value in fn():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+            lbl = _fmt_labels(tuple(labels), tuple(labels.values()))
+            lines.append(f"{name}{lbl} {_fmt_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Shared metric definitions -------------------------------------------------
+
+LIST_STACKS_SECONDS = Histogram(
+    "stack_manager_list_stacks_seconds", "Time spent scanning the stacks directory.",
+)
+DOCKER_API_SECONDS = Histogram(
+    "stack_manager_docker_api_seconds", "Docker Engine API call latency.", ("operation",),
+)
+TEMPLATE_RENDER_SECONDS = Histogram(
+    "stack_manager_template_render_seconds", "Template render time.", ("template",),
+)
+SUBPROCESS_SECONDS = Histogram(
+    "stack_manager_subprocess_seconds", "Subprocess run time by command kind.", ("kind",),
+)
+STACK_BUSY_REJECTED = Counter(
+    "stack_manager_stack_busy_rejected_total", "Operations refused because their stack was busy.",
+)
+SHARED_STATE_ERRORS = Counter(
+    "stack_manager_shared_state_errors_total", "Failed shared state store operations.", ("operation",),
+)
+STARTUP_SECONDS = Gauge(
+    "stack_manager_startup_seconds", "Duration of the startup hook by phase.", ("phase",),
+)
+SSE_CONNECTIONS = Gauge(
+    "stack_manager_sse_connections", "Open SSE output streams.",
+)
+ADMISSION_REJECTED = Counter(
+    "stack_manager_admission_rejected_total", "Requests rejected with 429 by admission control.",
+    ("class", "reason"),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "stack_manager_admission_in_flight", "Requests being served per admission class.", ("class",),
+)
@@ -0,0 +1,3 @@
+def split_csv(value: str | None) -> list[str]:
+    """The non-empty items of a comma-separated query parameter."""
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
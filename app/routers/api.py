@@ -1,16 +1,27 @@
 from __future__ import annotations
 
+import asyncio
+import json
 import os
-import shutil
+import re
+from datetime import datetime, timezone
 from html import escape
 from pathlib import Path
 
-from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 
-from app.config import SAFE_NAME_RE
+from app import admission, fragment_cache, static_assets
+from app.config import (
+    ENDPOINTS_BY_NAME, GIT_COMMIT, HOST_STATUS_TIMEOUT, NATIVE_STOP, ROLLING_UPGRADE, SAFE_NAME_RE, TASK_ARCHIVE_DIR,
+)
 from app.main_templates import templates
-from app.services import docker_service, mgmt_service, process_service, stack_service
+from app.metrics import TEMPLATE_RENDER_SECONDS
+from app.routers import split_csv
+from app.services import (
+    capabilities, disk_usage, docker_service, log_search, maintenance, mgmt_service, pass_monitor, prefetch,
+    preflight, process_service, stack_index, stack_service, task_export,
+)
 
 router = APIRouter()
 
@@ -22,38 +33,25 @@ def _validate_name(name: str) -> str | None:
     return None
 
 
-def _build_stack_data() -> list[dict]:
-    """Build enriched stack data with container statuses."""
-    stacks = stack_service.list_stacks()
-    all_statuses = docker_service.get_all_container_statuses()
-
-    result = []
-    for s in stacks:
-        status = docker_service.get_stack_status(s.services, all_statuses)
-        result.append({
-            "name": s.name,
-            "mode": s.mode,
-            "active": s.active,
-            "is_self": s.is_self,
-            "busy": process_service.is_stack_busy(s.name),
-            "services": s.services,
-            "service_map": s.service_map,
-            "status": status,
+@router.get("/api/stacks", response_class=HTMLResponse)
+async def get_stacks(request: Request):
+    stacks = await stack_index.build_stack_data()
+    cards = fragment_cache.render_stack_cards(stacks)
+    with TEMPLATE_RENDER_SECONDS.time("partials/stack_list.html"):
+        return templates.TemplateResponse(request, "partials/stack_list.html", {
+            "stacks": stacks,
+            "cards": cards,
         })
 
-    # Sort: running first, then partial, then stopped, then alphabetical
-    state_order = {"running": 0, "partial": 1, "stopped": 2, "unknown": 3}
-    result.sort(key=lambda x: (state_order.get(x["status"]["state"], 9), x["name"]))
-    return result
 
+@router.get("/api/cache")
+async def cache_stats():
+    return {"stack_cards": fragment_cache.stack_cards.stats(), "static_assets": static_assets.state()}
 
-@router.get("/api/stacks", response_class=HTMLResponse)
-async def get_stacks(request: Request):
-    stacks = _build_stack_data()
-    return templates.TemplateResponse("partials/stack_list.html", {
-        "request": request,
-        "stacks": stacks,
-    })
+
+@router.get("/api/admission")
+async def admission_state():
+    return admission.state()
 
 
 @router.post("/api/stacks/{name}/start", response_class=HTMLResponse)
@@ -70,15 +68,14 @@ async def start_stack(name: str, request: Request):
         return HTMLResponse('<div class="output-error">Cannot start stack-manager from within itself.</div>')
 
     task = await mgmt_service.start_stack(name)
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": f"start {name}",
     })
 
 
 @router.post("/api/stacks/{name}/stop", response_class=HTMLResponse)
-async def stop_stack(name: str, request: Request):
+async def stop_stack(name: str, request: Request, native: bool = NATIVE_STOP):
     err = _validate_name(name)
     if err:
         return HTMLResponse(err, status_code=400)
@@ -90,16 +87,35 @@ async def stop_stack(name: str, request: Request):
     if stack.is_self:
         return HTMLResponse('<div class="output-error">Cannot stop stack-manager from within itself.</div>')
 
-    task = await mgmt_service.stop_stack(name)
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    task = await mgmt_service.stop_stack(name, native=native)
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": f"stop {name}",
     })
 
 
+@router.post("/api/stacks/{name}/restart", response_class=HTMLResponse)
+async def restart_stack(name: str, request: Request, native: bool = NATIVE_STOP):
+    err = _validate_name(name)
+    if err:
+        return HTMLResponse(err, status_code=400)
+
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        return HTMLResponse(f'<div class="output-error">Stack "{escape(name)}" not found.</div>', status_code=404)
+
+    if stack.is_self:
+        return HTMLResponse('<div class="output-error">Cannot restart stack-manager from within itself.</div>')
+
+    task = await mgmt_service.restart_stack(name, native=native)
+    return templates.TemplateResponse(request, "partials/output.html", {
+        "task_id": task.task_id,
+        "command": f"restart {name}",
+    })
+
+
 @router.post("/api/stacks/{stack_name}/services/{service_name}/upgrade", response_class=HTMLResponse)
-async def upgrade_service(stack_name: str, service_name: str, request: Request):
+async def upgrade_service(stack_name: str, service_name: str, request: Request, rolling: bool = ROLLING_UPGRADE):
     for n in (stack_name, service_name):
         err = _validate_name(n)
         if err:
@@ -118,16 +134,15 @@ async def upgrade_service(stack_name: str, service_name: str, request: Request):
             status_code=404,
         )
 
-    task = await mgmt_service.upgrade_service(stack_name, service_name)
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    task = await mgmt_service.upgrade_service(stack_name, service_name, rolling=rolling)
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": f"upgrade {stack_name}/{service_name}",
     })
 
 
 @router.post("/api/stacks/{name}/upgrade", response_class=HTMLResponse)
-async def upgrade_stack(name: str, request: Request):
+async def upgrade_stack(name: str, request: Request, rolling: bool = ROLLING_UPGRADE):
     err = _validate_name(name)
     if err:
         return HTMLResponse(err, status_code=400)
@@ -139,9 +154,8 @@ async def upgrade_stack(name: str, request: Request):
     if stack.is_self:
         return HTMLResponse('<div class="output-error">Cannot modify stack-manager from within itself.</div>')
 
-    task = await mgmt_service.upgrade_stack(name)
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    task = await mgmt_service.upgrade_stack(name, rolling=rolling)
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": f"upgrade {name}",
     })
@@ -150,8 +164,7 @@ async def upgrade_stack(name: str, request: Request):
 @router.post("/api/stacks/upgrade", response_class=HTMLResponse)
 async def upgrade_all(request: Request):
     task = await mgmt_service.upgrade_all()
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": "upgrade all",
     })
@@ -160,18 +173,61 @@ async def upgrade_all(request: Request):
 @router.post("/api/stacks/pull", response_class=HTMLResponse)
 async def pull_all(request: Request):
     task = await mgmt_service.pull_images()
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": "pull images",
     })
 
 
+@router.post("/api/stacks/bulk", response_class=HTMLResponse)
+async def bulk_action(request: Request):
+    """Run start/stop/upgrade on several stacks (form fields: action, stacks)."""
+    form = await request.form()
+    action = str(form.get("action", "")).strip()
+    if action not in mgmt_service.BULK_ACTIONS:
+        return HTMLResponse(
+            f'<div class="output-error">Invalid action: "{escape(action)}". '
+            f'Expected one of: {", ".join(mgmt_service.BULK_ACTIONS)}.</div>',
+            status_code=400,
+        )
+
+    # Accept repeated "stacks" fields and/or comma-separated values; keep order, drop duplicates
+    names: list[str] = []
+    for value in form.getlist("stacks"):
+        for n in str(value).split(","):
+            n = n.strip()
+            if n and n not in names:
+                names.append(n)
+    if not names:
+        return HTMLResponse('<div class="output-error">No stacks given.</div>', status_code=400)
+
+    for n in names:
+        err = _validate_name(n)
+        if err:
+            return HTMLResponse(err, status_code=400)
+
+    # Validate everything against a single inventory scan
+    known = {s.name: s for s in stack_service.list_stacks()}
+    missing = [n for n in names if n not in known]
+    if missing:
+        return HTMLResponse(
+            f'<div class="output-error">Stack(s) not found: {escape(", ".join(missing))}.</div>',
+            status_code=404,
+        )
+    if any(known[n].is_self for n in names):
+        return HTMLResponse('<div class="output-error">Cannot modify stack-manager from within itself.</div>')
+
+    task = await mgmt_service.bulk_action(action, [known[n] for n in names])
+    return templates.TemplateResponse(request, "partials/output.html", {
+        "task_id": task.task_id,
+        "command": f"{action} {' '.join(names)}",
+    })
+
+
 @router.post("/api/cleanup", response_class=HTMLResponse)
 async def cleanup(request: Request):
     task = await mgmt_service.cleanup()
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": "docker system prune",
     })
@@ -180,8 +236,7 @@ async def cleanup(request: Request):
 @router.post("/api/update", response_class=HTMLResponse)
 async def update_configs(request: Request):
     task = await mgmt_service.update_configs()
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": "git pull",
     })
@@ -190,7 +245,7 @@ async def update_configs(request: Request):
 @router.post("/api/pass/login", response_class=HTMLResponse)
 async def pass_login(request: Request):
     # Check pass-cli is installed
-    if not shutil.which("pass-cli"):
+    if not capabilities.available("pass-cli"):
         return HTMLResponse(
             '<div class="output-error">pass-cli is not installed in this container.</div>'
         )
@@ -240,31 +295,211 @@ async def pass_login(request: Request):
         stack_name="__pass_login__",
         cwd=str(data_dir),
         label=f"pass-cli login {email}",
+        on_done=lambda _: pass_monitor.request_refresh(),
     )
-    return templates.TemplateResponse("partials/output.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "partials/output.html", {
         "task_id": task.task_id,
         "command": f"pass-cli login {email}",
     })
 
 
 @router.get("/api/containers/{name}/logs")
-async def container_logs(name: str, lines: int = 100):
+async def container_logs(name: str, lines: int = 100, host: str | None = None):
     err = _validate_name(name)
     if err:
         return {"container": name, "logs": "Invalid container name."}
+    if host is not None and host not in ENDPOINTS_BY_NAME:
+        return {"container": name, "logs": f"Unknown host: {host}"}
 
     # Clamp lines to prevent DoS
     lines = min(max(lines, 1), 10000)
 
-    logs = docker_service.get_container_logs(name, tail=lines)
+    logs = await asyncio.to_thread(docker_service.get_container_logs, name, lines, host)
     return {"container": name, "logs": logs}
 
 
+@router.get("/api/logs/search")
+async def search_logs(
+    q: str,
+    regex: bool = False,
+    stack: str | None = None,
+    container: str | None = None,
+    host: str | None = None,
+    since: str = "1h",
+    until: str | None = None,
+    limit: int = 200,
+):
+    """Stream matching log lines of the given stacks' and containers' logs as NDJSON."""
+    if not q:
+        raise HTTPException(400, "Empty query")
+    try:
+        match = log_search.matcher(q, regex)
+    except re.error as e:
+        raise HTTPException(400, f"Invalid regex: {e}")
+    try:
+        since_dt = log_search.parse_time(since)
+        until_dt = log_search.parse_time(until) if until else None
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid time: {e}")
+    if host is not None and host not in ENDPOINTS_BY_NAME:
+        raise HTTPException(400, f"Unknown host: {host}")
+    limit = min(max(limit, 1), 5000)
+
+    stacks = split_csv(stack)
+    containers = split_csv(container)
+    if not stacks and not containers:
+        raise HTTPException(400, "Give at least one stack or container")
+    for n in stacks + containers:
+        if not SAFE_NAME_RE.match(n):
+            raise HTTPException(400, f"Invalid name: {n}")
+
+    targets = [log_search.Target(host, n) for n in containers]
+    for n in stacks:
+        s = stack_service.get_stack(n)
+        if s is None:
+            raise HTTPException(404, f"Stack {n} not found")
+        try:
+            index = await asyncio.wait_for(
+                asyncio.to_thread(docker_service.get_project_containers, s.host, s.project),
+                HOST_STATUS_TIMEOUT,
+            )
+        except Exception as e:
+            raise HTTPException(502, f"Could not list the containers of {n}: {e or 'timed out'}")
+        targets.extend(log_search.Target(s.host, c, s.name) for c in sorted(index.by_name))
+
+    async def _generate():
+        async for item in log_search.search(targets, match, since_dt, until_dt, limit):
+            yield json.dumps(item, separators=(",", ":")) + "\n"
+
+    return StreamingResponse(_generate(), media_type="application/x-ndjson")
+
+
+@router.get("/api/prefetch")
+async def prefetch_state():
+    """Image pre-fetch windows, last pass and per-stack readiness."""
+    await prefetch.refresh()
+    return prefetch.state()
+
+
+@router.post("/api/prefetch")
+async def prefetch_now():
+    """Run a pre-fetch pass now, regardless of the configured windows."""
+    started = prefetch.request_pass()
+    if not started:
+        raise HTTPException(409, "A pre-fetch pass is already running (possibly in another worker)")
+    return {"started": True}
+
+
+@router.get("/api/maintenance")
+async def maintenance_state():
+    """Maintenance windows, deferred stacks and recent runs."""
+    maintenance.reload()
+    await maintenance.refresh()
+    return maintenance.state()
+
+
+@router.post("/api/maintenance/{name}/run")
+async def maintenance_run(name: str):
+    """Run a maintenance window now, with its time budget counted from now."""
+    maintenance.reload()
+    window = maintenance.get_window(name)
+    if window is None:
+        raise HTTPException(404, "Maintenance window not found")
+    task = await maintenance.run_window(window)
+    if task is None:
+        raise HTTPException(409, "This maintenance window is already running")
+    return {"task_id": task.task_id}
+
+
+@router.get("/api/disk-usage")
+async def disk_usage_state():
+    """Per-stack disk usage from the last accounting pass."""
+    await disk_usage.refresh()
+    return disk_usage.state()
+
+
+@router.post("/api/disk-usage")
+async def disk_usage_now():
+    """Run a disk usage pass now."""
+    if not disk_usage.request_pass():
+        raise HTTPException(409, "A disk usage pass is already running")
+    return {"started": True}
+
+
+@router.get("/api/preflight")
+async def preflight_state():
+    """Cached compose config verdicts per stack."""
+    return preflight.state()
+
+
+@router.post("/api/preflight")
+async def preflight_now():
+    """Validate every stack now; only stacks whose files changed run compose config."""
+    stacks = await asyncio.to_thread(stack_service.list_stacks)
+    verdicts, ran = await preflight.validate_all(stacks, prune=True)
+    return {"validated": ran, "stacks": {n: v.to_dict() for n, v in sorted(verdicts.items())}}
+
+
+@router.get("/api/capabilities")
+async def capabilities_state(refresh: bool = False):
+    """Detected tools with versions, and startup timings."""
+    await capabilities.probe_all(refresh=refresh)
+    return capabilities.state()
+
+
+@router.get("/api/hosts")
+async def hosts():
+    """Docker hosts with reachability, timing of the last status collection and shadowed stacks."""
+    await asyncio.to_thread(stack_service.list_stacks)
+    shadowed = stack_service.shadowed_stacks()
+    return {"hosts": [
+        {**h, "shadowed_stacks": shadowed.get(h["name"], [])} for h in docker_service.host_statuses()
+    ]}
+
+
+def _gzip_download(chunks, filename: str) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type="application/gzip", headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    })
+
+
+@router.get("/api/tasks/export")
+async def export_tasks(since: str | None = None, until: str | None = None, stack: str | None = None):
+    """Download the output of every task created in a time range, as one gzip file.
+
+    `since` defaults to what is kept: 24h with a task archive, else the 1h task history.
+    """
+    try:
+        since_dt = log_search.parse_time(since or ("24h" if TASK_ARCHIVE_DIR else "1h"))
+        until_dt = log_search.parse_time(until) if until else datetime.now(timezone.utc)
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid time: {e}")
+    tasks = await task_export.between(since_dt.timestamp(), until_dt.timestamp(), stack)
+    since_s, until_s = (dt.astimezone().strftime("%Y%m%d-%H%M") for dt in (since_dt, until_dt))
+    return _gzip_download(task_export.stream(tasks), f"tasks-{since_s}-{until_s}.log.gz")
+
+
+@router.get("/api/tasks/{task_id}/export")
+async def export_task(task_id: str):
+    """Download a task's output, metadata and step timings as a gzip file."""
+    found = await task_export.find(task_id)
+    if found is None:
+        raise HTTPException(404, "Task not found")
+    return _gzip_download(task_export.stream([found]), f"task-{task_id[:8]}.log.gz")
+
+
+@router.get("/api/tasks/{task_id}")
+async def task_info(task_id: str):
+    task = await process_service.find_task(task_id)
+    if task is None:
+        raise HTTPException(404, "Task not found")
+    return {**task.to_dict(), "version": GIT_COMMIT}
+
+
 @router.get("/api/status")
 async def status():
     stacks = stack_service.list_stacks()
-    pass_ok = await docker_service.check_pass_cli()
+    pass_ok = pass_monitor.is_active()
     active = sum(1 for s in stacks if s.active)
     return {
         "pass_cli": "ok" if pass_ok else "inactive",
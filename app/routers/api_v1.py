@@ -0,0 +1,66 @@
+"""Versioned JSON API for automation (stable field names, no HTML)."""
+from __future__ import annotations
+
+import json
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.routers import split_csv
+from app.services import stack_index, stack_service
+
+router = APIRouter(prefix="/api/v1")
+
+_MAX_LIMIT = 1000
+
+
+@router.get("/stacks")
+async def list_stacks(
+    state: str | None = Query(None, description="Comma-separated states (running, partial, unhealthy, stopped, unknown)"),
+    mode: str | None = Query(None, description="Comma-separated modes (pass, legacy, none)"),
+    active: bool | None = Query(None, description="Only stacks with (true) or without (false) a .inuse marker"),
+    prefix: str | None = Query(None, description="Name prefix"),
+    host: str | None = Query(None, description="Comma-separated host names (see /api/hosts)"),
+    sort: str = Query("state", description="state (dashboard order) or name"),
+    fields: str | None = Query(None, description="Comma-separated fields to include"),
+    cursor: str | None = Query(None, description="next_cursor from a previous page"),
+    limit: int = Query(100, ge=1, le=_MAX_LIMIT),
+):
+    if sort not in stack_index.SORT_KEYS:
+        raise HTTPException(400, f"Invalid sort {sort!r}, expected one of {', '.join(stack_index.SORT_KEYS)}")
+
+    selected = split_csv(fields) or list(stack_index.FIELDS)
+    unknown = [f for f in selected if f not in stack_index.FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Unknown field(s): {', '.join(unknown)}")
+
+    after = None
+    if cursor:
+        after = stack_index.decode_cursor(cursor, sort)
+        if after is None:
+            raise HTTPException(400, "Invalid cursor")
+
+    idx = await stack_index.get_index()
+    candidates = idx.match(
+        states=split_csv(state), modes=split_csv(mode), active=active, prefix=prefix, hosts=split_csv(host),
+    )
+    items, total, last_key = idx.page(candidates, sort=sort, after=after, limit=limit)
+    next_cursor = stack_index.encode_cursor(sort, last_key) if last_key else None
+
+    def _generate():
+        yield '{"items":['
+        for i, item in enumerate(items):
+            yield ("," if i else "") + json.dumps({f: item[f] for f in selected}, separators=(",", ":"))
+        yield "],"
+        yield json.dumps({"total": total, "next_cursor": next_cursor}, separators=(",", ":"))[1:]
+
+    return StreamingResponse(_generate(), media_type="application/json")
+
+
+@router.get("/stacks/{name}")
+async def get_stack(name: str):
+    """One stack, with a status from a query filtered to its compose project."""
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        raise HTTPException(404, f"Stack {name!r} not found")
+    return await stack_index.stack_data(stack)
@@ -1,35 +1,126 @@
 from __future__ import annotations
 
 import asyncio
+import json
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from sse_starlette.sse import EventSourceResponse
 
-from app.services.process_service import get_task
+from app import metrics
+from app.metrics import SSE_CONNECTIONS
+from app.services import process_service, shared_state
+from app.services.process_service import TaskState, get_task
+
+_POLL_INTERVAL = 0.1
 
 router = APIRouter()
 
 
+class _Stream:
+    """Position of one connected client within a task's output."""
+
+    __slots__ = ("task", "idx")
+
+    def __init__(self, task: TaskState, idx: int = 0) -> None:
+        self.task = task
+        self.idx = idx
+
+
+_streams: set[_Stream] = set()
+
+
+def _collect_stream_metrics():
+    depths = [len(s.task.lines) - s.idx for s in _streams]
+    yield ("stack_manager_sse_queue_depth_lines", "gauge",
+           "Output lines not yet sent to SSE clients.", {"agg": "sum"}, sum(depths))
+    yield ("stack_manager_sse_queue_depth_lines", "gauge",
+           "Output lines not yet sent to SSE clients.", {"agg": "max"}, max(depths, default=0))
+
+
+metrics.register_collector(_collect_stream_metrics)
+
+
+def _resume_offset(request: Request) -> int:
+    """Output lines the client already has, from the Last-Event-ID of a reconnect."""
+    try:
+        return max(int(request.headers.get("last-event-id", "0")), 0)
+    except ValueError:
+        return 0
+
+
+def _not_found():
+    async def _gen():
+        yield {"event": "error", "data": "Task not found"}
+        yield {"event": "done", "data": "1"}
+    return EventSourceResponse(_gen())
+
+
+def _finish(task: TaskState):
+    if task.spans:
+        yield {"event": "summary", "data": json.dumps([sp.to_dict() for sp in task.spans])}
+    yield {"event": "done", "data": str(task.exit_code or 0)}
+
+
 @router.get("/api/stream/{task_id}")
-async def stream_output(task_id: str):
+async def stream_output(task_id: str, request: Request):
+    """Stream a task's output. Output events carry their line number as id, so an
+    EventSource reconnect (to this or any other worker) resumes where it left off."""
+    start = _resume_offset(request)
     task = get_task(task_id)
     if task is None:
-        async def _not_found():
-            yield {"event": "error", "data": "Task not found"}
-            yield {"event": "done", "data": "1"}
-        return EventSourceResponse(_not_found())
+        if shared_state.enabled():
+            rec = await asyncio.to_thread(shared_state.load_task, task_id)
+            if rec is not None:
+                return EventSourceResponse(_generate_shared(task_id, start))
+        return _not_found()
 
     async def _generate():
-        idx = 0
+        stream = _Stream(task, min(start, len(task.lines)))
+        _streams.add(stream)
+        SSE_CONNECTIONS.inc()
+        try:
+            while True:
+                while stream.idx < len(task.lines):
+                    yield {"event": "output", "id": str(stream.idx + 1),
+                           "data": task.lines[stream.idx].rstrip("\n")}
+                    stream.idx += 1
+
+                if task.done:
+                    for event in _finish(task):
+                        yield event
+                    return
+
+                await asyncio.sleep(_POLL_INTERVAL)
+        finally:
+            _streams.discard(stream)
+            SSE_CONNECTIONS.dec()
+
+    return EventSourceResponse(_generate())
+
+
+async def _generate_shared(task_id: str, idx: int):
+    """Follow a task owned by another worker through the shared state store."""
+    SSE_CONNECTIONS.inc()
+    try:
         while True:
-            while idx < len(task.lines):
-                yield {"event": "output", "data": task.lines[idx].rstrip("\n")}
+            rec, lines = await asyncio.to_thread(shared_state.read_since, task_id, idx)
+            if rec is None:
+                yield {"event": "error", "data": "Task expired"}
+                yield {"event": "done", "data": "1"}
+                return
+            for text in lines:
                 idx += 1
+                yield {"event": "output", "id": str(idx), "data": text.rstrip("\n")}
 
-            if task.done:
-                yield {"event": "done", "data": str(task.exit_code or 0)}
+            if rec["done"]:
+                for event in _finish(process_service.task_from_record(rec, [])):
+                    yield event
+                return
+            if not lines and not shared_state.owner_alive(rec):
+                yield {"event": "error", "data": "The worker running this task exited"}
+                yield {"event": "done", "data": "1"}
                 return
 
-            await asyncio.sleep(0.1)
-
-    return EventSourceResponse(_generate())
+            await asyncio.sleep(_POLL_INTERVAL)
+    finally:
+        SSE_CONNECTIONS.dec()
@@ -0,0 +1,138 @@
+"""Detection of the external tools the app shells out to (docker, compose, git, pass-cli).
+
+Nothing runs at import time: the tools are probed concurrently in the startup
+hook (or on first use), and the results, with versions, are cached until
+``probe_all(refresh=True)``. Until a probe has run, lookups fall back to a
+PATH check that doesn't spawn anything.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import shutil
+import time
+from dataclasses import asdict, dataclass, field
+
+from app.metrics import STARTUP_SECONDS, SUBPROCESS_SECONDS
+
+# Seconds a single version probe may take
+_PROBE_TIMEOUT = 5.0
+
+_VERSION_RE = re.compile(r"\d+\.\d+(?:\.\d+)?[\w.+-]*")
+
+# name -> candidate commands (first one that works wins) and the arguments printing its version
+_PROBES: dict[str, list[tuple[list[str], list[str]]]] = {
+    "docker": [(["docker"], ["--version"])],
+    "compose": [(["docker", "compose"], ["version", "--short"]), (["docker-compose"], ["version", "--short"])],
+    "git": [(["git"], ["--version"])],
+    "pass-cli": [(["pass-cli"], ["--version"])],
+}
+# Tools that count as available when found on PATH even if their version can't be read
+_VERSION_OPTIONAL = {"pass-cli", "git"}
+
+
+@dataclass
+class Capability:
+    name: str
+    available: bool
+    command: list[str] = field(default_factory=list)  # argv prefix to invoke the tool
+    version: str | None = None
+    probe_seconds: float = 0.0
+    error: str = ""
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+_cache: dict[str, Capability] = {}
+_probing: asyncio.Task | None = None
+
+
+async def _run_version(argv: list[str]) -> tuple[bool, str]:
+    try:
+        with SUBPROCESS_SECONDS.time("probe"):
+            proc = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            )
+            try:
+                out, _ = await asyncio.wait_for(proc.communicate(), _PROBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return False, f"timed out after {_PROBE_TIMEOUT:g}s"
+    except OSError as e:
+        return False, str(e)
+    text = out.decode("utf-8", errors="replace").strip()
+    return proc.returncode == 0, text
+
+
+async def _probe(name: str) -> Capability:
+    start = time.perf_counter()
+    error = "not found on PATH"
+    for command, version_args in _PROBES[name]:
+        if not shutil.which(command[0]):
+            continue
+        ok, output = await _run_version([*command, *version_args])
+        if ok:
+            match = _VERSION_RE.search(output)
+            return Capability(
+                name, True, command, match.group(0) if match else None,
+                time.perf_counter() - start,
+            )
+        error = output.splitlines()[-1] if output else "version check failed"
+        if name in _VERSION_OPTIONAL:
+            return Capability(name, True, command, None, time.perf_counter() - start, error)
+    return Capability(name, False, probe_seconds=time.perf_counter() - start, error=error)
+
+
+async def _probe_all() -> None:
+    results = await asyncio.gather(*(_probe(name) for name in _PROBES))
+    _cache.update((c.name, c) for c in results)
+
+
+async def probe_all(refresh: bool = False) -> dict[str, Capability]:
+    """Probe every tool concurrently (once; concurrent callers share the same probe)."""
+    global _probing
+    if refresh or _probing is None or (_probing.done() and len(_cache) < len(_PROBES)):
+        _probing = asyncio.create_task(_probe_all())
+    await asyncio.shield(_probing)
+    return dict(_cache)
+
+
+def get(name: str) -> Capability | None:
+    """Cached probe result, or None if the tool wasn't probed yet."""
+    return _cache.get(name)
+
+
+def available(name: str) -> bool:
+    cap = _cache.get(name)
+    if cap is not None:
+        return cap.available
+    return shutil.which(_PROBES[name][0][0][0]) is not None
+
+
+def compose_cmd() -> list[str]:
+    """The compose command: ``docker compose`` if the plugin works, else ``docker-compose``."""
+    cap = _cache.get("compose")
+    if cap is not None and cap.available:
+        return cap.command
+    if cap is None and shutil.which("docker"):
+        return ["docker", "compose"]
+    return ["docker-compose"]
+
+
+# --- Startup timing ---------------------------------------------------------------
+
+_startup: dict[str, float] = {}
+
+
+def record_startup(phase: str, seconds: float) -> None:
+    _startup[phase] = seconds
+    STARTUP_SECONDS.set(seconds, phase)
+
+
+def state() -> dict:
+    return {
+        "tools": {name: cap.to_dict() for name, cap in sorted(_cache.items())},
+        "startup_seconds": dict(_startup),
+    }
@@ -0,0 +1,77 @@
+"""Compose file parsing for stack scans.
+
+Uses libyaml's CSafeLoader when PyYAML was built with it, and only composes
+the node graph: the parts a scan needs (top-level ``name``, service names and
+their ``container_name``) are read from the nodes without constructing Python
+objects for the rest of the file.
+
+Imports nothing from the app, so parser pool workers start quickly.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import yaml
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_STR_TAG = "tag:yaml.org,2002:str"
+_MERGE_TAG = "tag:yaml.org,2002:merge"
+
+# (container_names, {container_name: service_name}, top-level compose name)
+ParsedServices = tuple[list[str], dict[str, str], str]
+
+
+def _mapping(node: yaml.MappingNode) -> dict[str, yaml.Node]:
+    """Key -> value node of a mapping, with ``<<`` merge keys applied (explicit keys win)."""
+    result: dict[str, yaml.Node] = {}
+    for key, value in node.value:
+        if key.tag == _MERGE_TAG:
+            sources = value.value if isinstance(value, yaml.SequenceNode) else [value]
+            for src in sources:
+                if isinstance(src, yaml.MappingNode):
+                    for k, v in _mapping(src).items():
+                        result.setdefault(k, v)
+    for key, value in node.value:
+        if key.tag != _MERGE_TAG and isinstance(key, yaml.ScalarNode):
+            result[key.value] = value
+    return result
+
+
+def _string(node: yaml.Node | None) -> str:
+    return node.value if isinstance(node, yaml.ScalarNode) and node.tag == _STR_TAG else ""
+
+
+def parse_services(compose_path: str | Path) -> ParsedServices:
+    """Parse a compose file, return (container_names, {container_name: service_name}, project name).
+
+    Services without container_name are keyed by service name; their real
+    containers are found through the compose labels.
+    """
+    try:
+        root = yaml.compose(Path(compose_path).read_text(), Loader=Loader)
+    except Exception:
+        return [], {}, ""
+    if not isinstance(root, yaml.MappingNode):
+        return [], {}, ""
+
+    top = _mapping(root)
+    name = _string(top.get("name"))
+    services_node = top.get("services")
+    if not isinstance(services_node, yaml.MappingNode):
+        return [], {}, name
+
+    services = []
+    service_map = {}
+    for svc_name, conf in _mapping(services_node).items():
+        container_name = svc_name
+        if isinstance(conf, yaml.MappingNode):
+            container_name = _string(_mapping(conf).get("container_name")) or svc_name
+        services.append(container_name)
+        service_map[container_name] = svc_name
+    return services, service_map, name
+
+
+def parse_many(paths: list[str]) -> list[ParsedServices]:
+    """parse_services over a batch of files (one pool task)."""
+    return [parse_services(p) for p in paths]
@@ -0,0 +1,391 @@
+"""Background per-stack disk usage accounting.
+
+Every DISK_USAGE_INTERVAL seconds, a pass combines one ``docker system df -v``
+query per host (image, writable layer and named volume sizes by compose
+project) with the size of the directories each stack bind-mounts.
+
+Bind-mounted data directories can be large, so they are sized incrementally:
+a directory whose mtime is unchanged since the last pass reuses its cached
+file total instead of being listed and stat'ed again; only its subdirectories
+are checked. A file growing in place doesn't change its directory's mtime, so
+every DISK_USAGE_FULL_INTERVAL a pass lists everything again. The walk runs in
+its own thread with the I/O class DISK_USAGE_IO_CLASS so it yields to the
+stacks' own disk access.
+
+With SHARED_STATE_DIR, one worker at a time runs a pass and stores its results
+in the shared state database; the other workers load them from there, and a
+scheduled pass is skipped if another worker started one less than half an
+interval ago.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import stat
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from app import metrics
+from app.metrics import SHARED_STATE_ERRORS
+from app.config import (
+    DISK_USAGE_FULL_INTERVAL,
+    DISK_USAGE_INTERVAL,
+    DISK_USAGE_IO_CLASS,
+    PRIMARY_HOST,
+)
+from app.services import docker_service, shared_state, stack_service
+
+# ionice arguments per DISK_USAGE_IO_CLASS
+_IO_CLASSES = {"idle": ["-c", "3"], "best-effort": ["-c", "2", "-n", "7"], "none": []}
+
+if DISK_USAGE_IO_CLASS not in _IO_CLASSES:
+    raise SystemExit(
+        f"Invalid DISK_USAGE_IO_CLASS {DISK_USAGE_IO_CLASS!r}, expected one of {', '.join(_IO_CLASSES)}"
+    )
+
+
+@dataclass
+class _Dir:
+    mtime_ns: int
+    files: int  # bytes of the files directly inside
+    subdirs: tuple[str, ...]
+
+
+class DirSizer:
+    """Directory tree sizes (allocated bytes, like ``du -x``) with a per-directory cache."""
+
+    def __init__(self) -> None:
+        self._dirs: dict[str, _Dir] = {}
+        self._seen: set[str] = set()
+        self.listed = 0  # directories listed since begin_pass()
+        self.reused = 0  # directories answered from the cache
+
+    def begin_pass(self) -> None:
+        self._seen = set()
+        self.listed = self.reused = 0
+
+    def end_pass(self) -> None:
+        """Forget directories that weren't reached during the pass."""
+        for path in self._dirs.keys() - self._seen:
+            del self._dirs[path]
+
+    def size(self, path: str, full: bool = False) -> int:
+        """Size of a file or directory tree; `full` ignores the cache. Stays on one filesystem."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 0
+        if not stat.S_ISDIR(st.st_mode):
+            return st.st_blocks * 512
+
+        total = 0
+        pending = [(path, st)]
+        while pending:
+            current, st = pending.pop()
+            self._seen.add(current)
+            entry = self._dirs.get(current)
+            if full or entry is None or entry.mtime_ns != st.st_mtime_ns:
+                entry = self._list(current, st)
+            else:
+                self.reused += 1
+            total += st.st_blocks * 512 + entry.files
+            for name in entry.subdirs:
+                child = os.path.join(current, name)
+                try:
+                    cst = os.lstat(child)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(cst.st_mode) and cst.st_dev == st.st_dev:
+                    pending.append((child, cst))
+        return total
+
+    def _list(self, path: str, st: os.stat_result) -> _Dir:
+        files, subdirs = 0, []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            subdirs.append(e.name)
+                        else:
+                            files += e.stat(follow_symlinks=False).st_blocks * 512
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        entry = _Dir(st.st_mtime_ns, files, tuple(subdirs))
+        self._dirs[path] = entry
+        self.listed += 1
+        return entry
+
+
+@dataclass
+class StackUsage:
+    measured_at: float
+    images: int | None = None  # None: the host's df query failed
+    containers: int | None = None
+    volumes: int | None = None
+    binds: int | None = None  # None: stack runs on a remote host
+
+    @property
+    def total(self) -> int:
+        return sum(v or 0 for v in (self.images, self.containers, self.volumes, self.binds))
+
+    def to_dict(self) -> dict:
+        return {
+            "images": self.images,
+            "containers": self.containers,
+            "volumes": self.volumes,
+            "binds": self.binds,
+            "total": self.total,
+            "measured_at": self.measured_at,
+        }
+
+
+@dataclass
+class PassState:
+    started_at: float | None = None
+    finished_at: float | None = None
+    running: bool = False
+    full: bool = False
+    dirs_listed: int = 0
+    dirs_reused: int = 0
+    errors: dict[str, str] = field(default_factory=dict)  # host -> df error
+
+
+_LOCK = "__disk_usage__"
+_RESULT = "disk_usage"
+# Seconds between checks for results of a pass another worker ran
+_REFRESH_INTERVAL = 2.0
+
+_sizer = DirSizer()
+_stacks: dict[str, StackUsage] = {}
+_pass = PassState()
+_last_full = 0.0
+_measuring = False  # this worker is running a pass
+_synced_at = 0.0  # updated_at of the shared results last stored or loaded
+_checked_at = 0.0
+_executor: ThreadPoolExecutor | None = None
+_loop_task: asyncio.Task | None = None
+_pass_task: asyncio.Task | None = None
+
+
+def _set_io_priority() -> None:
+    """Lower the walker thread's I/O priority (on Linux ionice accepts a thread ID)."""
+    args = _IO_CLASSES[DISK_USAGE_IO_CLASS]
+    if args and shutil.which("ionice"):
+        subprocess.run(["ionice", *args, "-p", str(threading.get_native_id())], capture_output=True)
+
+
+def _walker() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="disk-usage", initializer=_set_io_priority,
+        )
+    return _executor
+
+
+def _size_binds(stacks: list[stack_service.StackInfo], full: bool) -> dict[str, int]:
+    """Bind mount totals of the local host's stacks; runs in the walker thread."""
+    _sizer.begin_pass()
+    result = {
+        s.name: sum(_sizer.size(str(p), full) for p in stack_service.bind_mounts(s))
+        for s in stacks if s.host == PRIMARY_HOST
+    }
+    _sizer.end_pass()
+    return result
+
+
+async def _publish() -> None:
+    """Store this worker's pass state and results for the other workers."""
+    global _synced_at
+    if not shared_state.enabled():
+        return
+    now = time.time()
+    data = {
+        "pass": asdict(_pass),
+        "last_full": _last_full,
+        "stacks": {name: asdict(rec) for name, rec in _stacks.items()},
+    }
+    try:
+        await asyncio.to_thread(shared_state.save_result, _RESULT, now, data)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("write")
+        return
+    _synced_at = now
+
+
+async def refresh(force: bool = False) -> None:
+    """Load the results of a pass another worker ran, checking at most every _REFRESH_INTERVAL."""
+    global _pass, _stacks, _last_full, _synced_at, _checked_at
+    if not shared_state.enabled() or _measuring:
+        return
+    now = time.monotonic()
+    if not force and now - _checked_at < _REFRESH_INTERVAL:
+        return
+    _checked_at = now
+    try:
+        stored = await asyncio.to_thread(shared_state.load_result, _RESULT, _synced_at)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("read")
+        return
+    if stored is None or _measuring:
+        return
+    _synced_at, data = stored
+    _pass = PassState(**data["pass"])
+    _last_full = max(_last_full, data["last_full"])
+    _stacks = {name: StackUsage(**rec) for name, rec in data["stacks"].items()}
+
+
+def _running() -> bool:
+    # a pass stored as running whose worker died no longer holds the lock
+    return _measuring or (_pass.running and shared_state.is_locked(_LOCK))
+
+
+async def run_pass(scheduled: bool = False) -> None:
+    """Measure every stack's images, containers, volumes and bind mounts.
+
+    A `scheduled` pass is skipped if another worker started one less than half
+    of DISK_USAGE_INTERVAL ago.
+    """
+    global _pass, _last_full, _measuring
+    # With several workers only one of them runs a pass at a time
+    claim = shared_state.try_lock(_LOCK)
+    if claim is None or _measuring:
+        if claim is not None:
+            claim.release()
+        return
+    try:
+        await refresh(force=True)
+        if scheduled and _pass.started_at and time.time() - _pass.started_at < DISK_USAGE_INTERVAL / 2:
+            return
+        _measuring = True
+        full = time.time() - _last_full >= DISK_USAGE_FULL_INTERVAL
+        _pass = PassState(started_at=time.time(), running=True, full=full)
+        await _publish()
+        await _measure(full)
+    finally:
+        if _measuring:
+            _pass.running = False
+            _pass.finished_at = time.time()
+            _measuring = False
+            await _publish()
+        claim.release()
+
+
+async def _measure(full: bool) -> None:
+    """One pass; runs with the pass lock held."""
+    global _stacks, _last_full
+    stacks = await asyncio.to_thread(stack_service.list_stacks)
+    hosts = sorted({s.host for s in stacks})
+    df, binds = await asyncio.gather(
+        asyncio.gather(
+            *(asyncio.to_thread(docker_service.disk_usage, h) for h in hosts),
+            return_exceptions=True,
+        ),
+        asyncio.get_running_loop().run_in_executor(_walker(), _size_binds, stacks, full),
+    )
+    by_host = {}
+    for host, result in zip(hosts, df):
+        if isinstance(result, Exception):
+            _pass.errors[host] = str(result)
+        else:
+            by_host[host] = result
+
+    now = time.time()
+    usages = {}
+    for s in stacks:
+        usage = StackUsage(measured_at=now, binds=binds.get(s.name))
+        if s.host in by_host:
+            project = by_host[s.host].get(s.project, docker_service.ProjectDiskUsage())
+            usage.images, usage.containers, usage.volumes = (
+                project.images, project.containers, project.volumes,
+            )
+        usages[s.name] = usage
+    _stacks = usages
+    if full:
+        _last_full = now
+    _pass.dirs_listed, _pass.dirs_reused = _sizer.listed, _sizer.reused
+
+
+def stack_usage(name: str) -> dict | None:
+    """The stack's usage from the last pass, or None if it wasn't measured."""
+    rec = _stacks.get(name)
+    return rec.to_dict() if rec else None
+
+
+def request_pass() -> bool:
+    """Start a pass now; False if one is already running (in any worker)."""
+    global _pass_task
+    if _running() or (_pass_task is not None and not _pass_task.done()):
+        return False
+    _pass_task = asyncio.create_task(run_pass())
+    return True
+
+
+def state() -> dict:
+    return {
+        "enabled": DISK_USAGE_INTERVAL > 0,
+        "io_class": DISK_USAGE_IO_CLASS,
+        "running": _running(),
+        "last_pass": {
+            "started_at": _pass.started_at,
+            "finished_at": _pass.finished_at,
+            "full": _pass.full,
+            "dirs_listed": _pass.dirs_listed,
+            "dirs_reused": _pass.dirs_reused,
+            "errors": _pass.errors,
+        },
+        "stacks": {name: rec.to_dict() for name, rec in sorted(_stacks.items())},
+    }
+
+
+def _collect_metrics():
+    for name, rec in _stacks.items():
+        for kind in ("images", "containers", "volumes", "binds"):
+            value = getattr(rec, kind)
+            if value is not None:
+                yield ("stack_manager_stack_disk_bytes", "gauge",
+                       "Disk used by a stack at the last accounting pass.",
+                       {"stack": name, "kind": kind}, value)
+    if _pass.finished_at and _pass.started_at:
+        yield ("stack_manager_disk_usage_pass_seconds", "gauge",
+               "Duration of the last disk usage pass.", {}, _pass.finished_at - _pass.started_at)
+
+
+metrics.register_collector(_collect_metrics)
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await run_pass(scheduled=True)
+        except Exception:
+            pass
+        await asyncio.sleep(DISK_USAGE_INTERVAL)
+
+
+def start() -> None:
+    global _loop_task
+    if DISK_USAGE_INTERVAL > 0:
+        _loop_task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _loop_task, _pass_task, _executor
+    for task in (_loop_task, _pass_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+    _loop_task = _pass_task = None
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
 import asyncio
-import shutil
+import time
 from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator
 
 import docker
 
+from app.config import (
+    DISK_USAGE_DF_TIMEOUT, DOCKER_ENDPOINTS, ENDPOINTS_BY_NAME, HOST_STATUS_TIMEOUT, PRIMARY_HOST, REGISTRY_TIMEOUT,
+)
+from app.metrics import DOCKER_API_SECONDS, SUBPROCESS_SECONDS, register_collector
+from app.services import capabilities
+
 
 @dataclass
 class ContainerStatus:
@@ -15,32 +23,126 @@ class ContainerStatus:
     image: str
     started_at: str
     update_available: bool = False
+    project: str = ""  # com.docker.compose.project label
+    service: str = ""  # com.docker.compose.service label
+
+
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+
+
+class ContainerIndex:
+    """Container statuses of one host, by name and by compose project -> service."""
+
+    def __init__(self, statuses: list[ContainerStatus]) -> None:
+        self.by_name = {c.name: c for c in statuses}
+        self.by_project: dict[str, dict[str, list[ContainerStatus]]] = {}
+        for c in statuses:
+            if c.project:
+                self.by_project.setdefault(c.project, {}).setdefault(c.service, []).append(c)
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+    def stack_containers(
+        self, project: str, service_map: dict[str, str],
+    ) -> list[tuple[str, ContainerStatus | None]]:
+        """(name, status) for each container of a stack.
+
+        Containers are matched by their compose labels, so every replica of a
+        service is found whatever its generated name. A service with no labelled
+        container falls back to its container_name (None if that is missing too).
+        """
+        services = self.by_project.get(project, {})
+        result = []
+        for container_name, service in service_map.items():
+            found = services.get(service)
+            if found:
+                result.extend((c.name, c) for c in sorted(found, key=lambda c: c.name))
+            else:
+                result.append((container_name, self.by_name.get(container_name)))
+        return result
+
+
+@dataclass
+class HostStatus:
+    name: str
+    url: str
+    reachable: bool = False
+    containers: int = 0
+    duration: float = 0.0  # seconds spent collecting statuses
+    error: str = ""
+    checked_at: float = 0.0  # wall-clock time of the last collection
 
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "primary": self.name == PRIMARY_HOST,
+            "reachable": self.reachable,
+            "containers": self.containers,
+            "duration_ms": round(self.duration * 1000, 1),
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
 
-_client: docker.DockerClient | None = None
 
+# (host, HTTP read timeout or None for docker's default) -> client
+_clients: dict[tuple[str, int | None], docker.DockerClient] = {}
+_host_status: dict[str, HostStatus] = {
+    e.name: HostStatus(name=e.name, url=e.url) for e in DOCKER_ENDPOINTS
+}
 
-def _get_client() -> docker.DockerClient:
-    global _client
-    if _client is None:
-        _client = docker.DockerClient(base_url="unix:///var/run/docker.sock")
-    return _client
 
+def _get_client(host: str | None = None, timeout: int | None = None) -> docker.DockerClient:
+    """The host's client; `timeout` (seconds per API call) defaults to docker's own."""
+    host = host or PRIMARY_HOST
+    client = _clients.get((host, timeout))
+    if client is None:
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        client = _clients[(host, timeout)] = docker.DockerClient(base_url=ENDPOINTS_BY_NAME[host].url, **kwargs)
+    return client
 
-def get_all_container_statuses() -> dict[str, ContainerStatus]:
-    """Return {container_name: ContainerStatus} for all containers."""
+
+def _status_client(host: str | None) -> docker.DockerClient:
+    """Client for status collection, whose calls give up after HOST_STATUS_TIMEOUT."""
+    return _get_client(host, max(int(HOST_STATUS_TIMEOUT), 1))
+
+
+def get_all_container_statuses(host: str | None = None) -> ContainerIndex:
+    """Return the statuses of all containers on a host (empty if it can't be reached)."""
     try:
-        client = _get_client()
-        containers = client.containers.list(all=True)
+        return ContainerIndex(_fetch_statuses(host))
     except Exception:
-        return {}
+        return ContainerIndex([])
+
+
+def get_project_containers(host: str | None, project: str) -> ContainerIndex:
+    """Statuses of one compose project's containers, fetched with a label-filtered query.
+
+    Cheaper than listing the whole host for single-stack views; containers not
+    created by compose (no project label) are not included.
+    """
+    return ContainerIndex(_fetch_statuses(host, {"label": f"{PROJECT_LABEL}={project}"}))
 
-    result = {}
+
+def _fetch_statuses(host: str | None, filters: dict | None = None) -> list[ContainerStatus]:
+    client = _status_client(host)
+    with DOCKER_API_SECONDS.time("containers_list"):
+        containers = client.containers.list(all=True, filters=filters)
+
+    result = []
     for c in containers:
         health_data = c.attrs.get("State", {}).get("Health", {})
         health = health_data.get("Status", "n/a") if health_data else "n/a"
 
-        tags = c.image.tags if c.image.tags else []
+        # c.image is fetched from the API on every access, so read it once
+        try:
+            with DOCKER_API_SECONDS.time("image_inspect"):
+                c_image = c.image
+        except Exception:
+            c_image = None
+        tags = c_image.tags if c_image is not None and c_image.tags else []
         image = tags[0] if tags else c.attrs.get("Config", {}).get("Image", "unknown")
 
         # Check if a newer image exists locally for this container
@@ -49,42 +151,104 @@ def get_all_container_statuses() -> dict[str, ContainerStatus]:
             image_ref = c.attrs.get("Config", {}).get("Image", "")
             if image_ref:
                 try:
-                    current = client.images.get(image_ref)
-                    update_available = current.id != c.image.id
+                    with DOCKER_API_SECONDS.time("image_inspect"):
+                        current = client.images.get(image_ref)
+                    update_available = c_image is not None and current.id != c_image.id
                 except Exception:
                     pass
 
-        result[c.name] = ContainerStatus(
+        labels = c.attrs.get("Config", {}).get("Labels") or {}
+        result.append(ContainerStatus(
             name=c.name,
             status=c.status,
             health=health,
             image=image,
             started_at=c.attrs.get("State", {}).get("StartedAt", ""),
             update_available=update_available,
-        )
+            project=labels.get(PROJECT_LABEL, ""),
+            service=labels.get(SERVICE_LABEL, ""),
+        ))
     return result
 
 
-def get_stack_status(service_names: list[str], all_statuses: dict[str, ContainerStatus]) -> dict:
-    """Determine overall stack status from its service container names."""
-    if not service_names:
+async def _collect_host(host: str) -> ContainerIndex | None:
+    hs = _host_status[host]
+    start = time.perf_counter()
+    try:
+        statuses = ContainerIndex(await asyncio.wait_for(
+            asyncio.to_thread(_fetch_statuses, host), HOST_STATUS_TIMEOUT,
+        ))
+    except asyncio.TimeoutError:
+        hs.reachable, hs.error = False, f"timed out after {HOST_STATUS_TIMEOUT:g}s"
+        statuses = None
+    except Exception as e:
+        hs.reachable, hs.error = False, str(e) or type(e).__name__
+        statuses = None
+    else:
+        hs.reachable, hs.error, hs.containers = True, "", len(statuses)
+    hs.duration = time.perf_counter() - start
+    hs.checked_at = time.time()
+    return statuses
+
+
+async def collect_statuses() -> dict[str, ContainerIndex | None]:
+    """Collect container statuses from every host concurrently.
+
+    Each host gets HOST_STATUS_TIMEOUT seconds; an unreachable or slow host maps
+    to None instead of holding up the others. A timed-out worker thread is left
+    to finish on its own.
+    """
+    hosts = list(ENDPOINTS_BY_NAME)
+    results = await asyncio.gather(*(_collect_host(h) for h in hosts))
+    return dict(zip(hosts, results))
+
+
+def host_statuses() -> list[dict]:
+    """Result of the last status collection for each host."""
+    return [_host_status[e.name].to_dict() for e in DOCKER_ENDPOINTS]
+
+
+def _collect_host_metrics():
+    for hs in _host_status.values():
+        labels = {"host": hs.name}
+        yield ("stack_manager_host_up", "gauge",
+               "Whether the last status collection reached the host.", labels, int(hs.reachable))
+        yield ("stack_manager_host_collect_seconds", "gauge",
+               "Duration of the last status collection per host.", labels, hs.duration)
+
+
+register_collector(_collect_host_metrics)
+
+
+def get_stack_status(project: str, service_map: dict[str, str], index: ContainerIndex | None) -> dict:
+    """Determine overall stack status from the containers of its compose project.
+
+    ``index`` is None when the stack's host could not be reached.
+    """
+    if index is None:
+        return {
+            "state": "unknown", "running": 0, "total": len(service_map),
+            "containers": [], "updates": 0, "unreachable": True,
+        }
+    if not service_map:
         return {"state": "unknown", "running": 0, "total": 0, "containers": []}
 
     containers = []
     running = 0
-    for name in service_names:
-        cs = all_statuses.get(name)
+    for name, cs in index.stack_containers(project, service_map):
         if cs and cs.status == "running":
             running += 1
         containers.append({
             "name": name,
+            # label-matched replicas are named by compose, not by container_name
+            "service": (cs.service if cs else "") or service_map.get(name, ""),
             "status": cs.status if cs else "not found",
             "health": cs.health if cs else "n/a",
             "image": cs.image if cs else "unknown",
             "update_available": cs.update_available if cs else False,
         })
 
-    total = len(service_names)
+    total = len(containers)
     if running == total:
         state = "running"
     elif running > 0:
@@ -104,12 +268,256 @@ def get_stack_status(service_names: list[str], all_statuses: dict[str, Container
     return {"state": state, "running": running, "total": total, "containers": containers, "updates": updates}
 
 
-def get_container_logs(name: str, tail: int = 100) -> str:
-    """Return the last N lines of logs for a container."""
+@dataclass
+class ServiceContainer:
+    id: str
+    name: str
+    image_id: str  # image the container runs, to roll back to
+    image_ref: str  # image reference from the compose file
+
+
+def _service_filters(project: str, service: str) -> dict:
+    # oneoff=False leaves out `compose run` containers of the service
+    return {"label": [
+        f"com.docker.compose.project={project}", f"com.docker.compose.service={service}",
+        "com.docker.compose.oneoff=False",
+    ]}
+
+
+# Restart policies under which a container that exited with code 0 stays down
+_NO_RESTART_ON_SUCCESS = ("", "no", "on-failure")
+
+
+def _completes(attrs: dict) -> bool:
+    """Whether the container is a one-shot job: not restarted after a successful exit."""
+    policy = ((attrs.get("HostConfig") or {}).get("RestartPolicy") or {}).get("Name") or ""
+    return policy in _NO_RESTART_ON_SUCCESS
+
+
+def service_containers(host: str | None, project: str, service: str) -> list[ServiceContainer]:
+    """Containers of one compose service, with the image each one runs."""
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("containers_list"):
+        containers = client.containers.list(all=True, filters=_service_filters(project, service))
+    return [
+        ServiceContainer(
+            id=c.id, name=c.name,
+            image_id=c.attrs.get("Image", ""),
+            image_ref=c.attrs.get("Config", {}).get("Image", ""),
+        )
+        for c in containers
+    ]
+
+
+@dataclass
+class ProjectContainer:
+    id: str
+    name: str
+    service: str
+    running: bool
+    stop_timeout: int  # seconds: the service's stop_grace_period, or the Docker default
+
+
+def project_containers(host: str | None, project: str) -> list[ProjectContainer]:
+    """All containers of a compose project (label-filtered), running or not."""
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("containers_list"):
+        containers = client.containers.list(all=True, filters={"label": f"{PROJECT_LABEL}={project}"})
+    result = []
+    for c in containers:
+        config = c.attrs.get("Config", {})
+        stop_timeout = config.get("StopTimeout")
+        result.append(ProjectContainer(
+            id=c.id, name=c.name,
+            service=(config.get("Labels") or {}).get(SERVICE_LABEL, ""),
+            running=c.status in ("running", "restarting", "paused"),
+            stop_timeout=10 if stop_timeout is None else int(stop_timeout),
+        ))
+    return result
+
+
+def stop_container(host: str | None, container_id: str, timeout: int) -> None:
+    """Stop a container, sending SIGKILL after `timeout` seconds."""
+    with DOCKER_API_SECONDS.time("container_stop"):
+        _get_client(host).api.stop(container_id, timeout=timeout)
+
+
+def start_container(host: str | None, container_id: str) -> None:
+    with DOCKER_API_SECONDS.time("container_start"):
+        _get_client(host).api.start(container_id)
+
+
+def remove_container(host: str | None, container_id: str) -> None:
+    """Remove a stopped container (its anonymous volumes are kept, as with compose down)."""
+    with DOCKER_API_SECONDS.time("container_remove"):
+        _get_client(host).api.remove_container(container_id)
+
+
+def remove_project_networks(host: str | None, project: str) -> list[str]:
+    """Remove the networks compose created for a project; returns the names that couldn't be."""
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("networks_list"):
+        networks = client.networks.list(filters={"label": f"{PROJECT_LABEL}={project}"})
+    failed = []
+    for net in networks:
+        try:
+            with DOCKER_API_SECONDS.time("network_remove"):
+                net.remove()
+        except docker.errors.NotFound:
+            pass
+        except docker.errors.APIError:
+            failed.append(net.name)
+    return failed
+
+
+def wait_healthy(host: str | None, project: str, service: str, since: float, timeout: float) -> tuple[bool, str]:
+    """Wait until every container of a compose service is healthy (or running, without a healthcheck).
+
+    Follows the Docker event stream instead of polling: health_status events decide,
+    a die/oom event fails immediately. One-shot containers (migrations, init jobs)
+    that exit with code 0 and aren't restarted count as done. Events since `since`
+    are replayed, so transitions between the state check and the subscription are
+    not missed. Returns (ok, detail).
+    """
+    client = _get_client(host)
+    filters = _service_filters(project, service)
+    deadline = time.time() + timeout
+    with DOCKER_API_SECONDS.time("containers_list"):
+        containers = client.containers.list(all=True, filters=filters)
+    if not containers:
+        return False, "no container was created"
+
+    pending: dict[str, str] = {}
+    completed = []
+    one_shot = {c.id for c in containers if _completes(c.attrs)}
+    for c in containers:
+        state = c.attrs.get("State", {})
+        if state.get("Status") == "exited" and state.get("ExitCode") == 0 and c.id in one_shot:
+            completed.append(c.name)
+            continue
+        if state.get("Status") != "running":
+            return False, f"{c.name} is {state.get('Status', 'unknown')}"
+        health = (state.get("Health") or {}).get("Status")
+        if health == "unhealthy":
+            return False, f"{c.name} is unhealthy"
+        if health and health != "healthy":
+            pending[c.id] = c.name
+    if not pending:
+        if completed and len(completed) == len(containers):
+            return True, "completed (exit 0)"
+        checked = any((c.attrs.get("State", {}).get("Health") or {}) for c in containers)
+        return True, "healthy" if checked else "running (no healthcheck)"
+
+    events = client.events(
+        since=int(since), until=int(deadline) + 1,
+        filters={"type": "container", **filters}, decode=True,
+    )
     try:
-        client = _get_client()
-        container = client.containers.get(name)
-        logs = container.logs(tail=tail, timestamps=True).decode("utf-8", errors="replace")
+        for ev in events:
+            name = pending.get(ev.get("id", ""))
+            if name is None:
+                continue
+            action = ev.get("Action") or ev.get("status", "")
+            exit_code = ((ev.get("Actor") or {}).get("Attributes") or {}).get("exitCode")
+            if action == "health_status: healthy":
+                del pending[ev["id"]]
+                if not pending:
+                    return True, "healthy"
+            elif action == "health_status: unhealthy":
+                return False, f"{name} is unhealthy"
+            elif action == "die" and ev["id"] in one_shot and exit_code == "0":
+                del pending[ev["id"]]
+                if not pending:
+                    return True, "completed (exit 0)"
+            elif action in ("die", "oom"):
+                return False, f"{name} exited"
+            if time.time() > deadline:
+                break
+    finally:
+        events.close()
+    return False, f"{', '.join(sorted(pending.values()))} not healthy after {timeout:g}s"
+
+
+def tag_image(host: str | None, image_id: str, ref: str) -> None:
+    """Point an image reference (e.g. nginx:1.27) back at an image ID."""
+    repo, tag = docker.utils.parse_repository_tag(ref)
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("image_tag"):
+        client.images.get(image_id).tag(repo, tag or "latest")
+
+
+def image_status(host: str | None, ref: str) -> tuple[str | None, bool | None]:
+    """Return (local image ID or None, whether it matches the registry's current digest).
+
+    Only the registry manifest is fetched, nothing is pulled. Currency is None
+    when the registry could not be asked within REGISTRY_TIMEOUT.
+    """
+    client = _get_client(host)
+    try:
+        with DOCKER_API_SECONDS.time("image_inspect"):
+            local = client.images.get(ref)
+    except docker.errors.ImageNotFound:
+        return None, False
+    try:
+        with DOCKER_API_SECONDS.time("registry_data"):
+            digest = _get_client(host, REGISTRY_TIMEOUT).images.get_registry_data(ref).id
+    except Exception:
+        return local.id, None
+    return local.id, any(d.endswith("@" + digest) for d in local.attrs.get("RepoDigests") or [])
+
+
+def pull_image(host: str | None, ref: str) -> tuple[str, int]:
+    """Pull an image reference; returns (image ID, image size in bytes)."""
+    repo, tag = docker.utils.parse_repository_tag(ref)
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("image_pull"):
+        image = client.images.pull(repo, tag=tag or "latest")
+    return image.id, int(image.attrs.get("Size") or 0)
+
+
+@dataclass
+class ProjectDiskUsage:
+    images: int = 0  # images its containers run (an image shared by projects counts for each)
+    containers: int = 0  # writable container layers
+    volumes: int = 0  # named volumes created by the project
+
+
+def disk_usage(host: str | None) -> dict[str, ProjectDiskUsage]:
+    """Disk usage per compose project on a host, from one ``docker system df -v`` query.
+
+    The query can take minutes on hosts with many images and volumes, so it
+    gets DISK_USAGE_DF_TIMEOUT instead of the client's usual timeout.
+    """
+    client = _get_client(host, DISK_USAGE_DF_TIMEOUT)
+    with DOCKER_API_SECONDS.time("system_df"):
+        df = client.df()
+    image_sizes = {i["Id"]: int(i.get("Size") or 0) for i in df.get("Images") or []}
+
+    usage: dict[str, ProjectDiskUsage] = {}
+    images: dict[str, set[str]] = {}
+    for c in df.get("Containers") or []:
+        project = (c.get("Labels") or {}).get(PROJECT_LABEL)
+        if project:
+            usage.setdefault(project, ProjectDiskUsage()).containers += int(c.get("SizeRw") or 0)
+            images.setdefault(project, set()).add(c.get("ImageID", ""))
+    for project, ids in images.items():
+        usage[project].images = sum(image_sizes.get(i, 0) for i in ids)
+    for v in df.get("Volumes") or []:
+        project = (v.get("Labels") or {}).get(PROJECT_LABEL)
+        if project:
+            size = int((v.get("UsageData") or {}).get("Size", -1))  # -1: not computed
+            usage.setdefault(project, ProjectDiskUsage()).volumes += max(size, 0)
+    return usage
+
+
+def get_container_logs(name: str, tail: int = 100, host: str | None = None) -> str:
+    """Return the last N lines of logs for a container on a host."""
+    try:
+        client = _get_client(host)
+        with DOCKER_API_SECONDS.time("container_inspect"):
+            container = client.containers.get(name)
+        with DOCKER_API_SECONDS.time("container_logs"):
+            logs = container.logs(tail=tail, timestamps=True).decode("utf-8", errors="replace")
         return logs
     except docker.errors.NotFound:
         return f"Container '{name}' not found."
@@ -117,17 +525,55 @@ def get_container_logs(name: str, tail: int = 100) -> str:
         return f"Error fetching logs: {e}"
 
 
+# Longest log line kept by iter_container_logs; the rest of a longer line is dropped
+MAX_LOG_LINE = 8192
+
+
+def iter_container_logs(
+    host: str | None, name: str, since: datetime | None = None, until: datetime | None = None,
+) -> Iterator[str]:
+    """Yield a container's log lines ("<RFC3339 timestamp> <text>") without loading the whole log.
+
+    Closing the generator closes the log stream.
+    """
+    client = _get_client(host)
+    with DOCKER_API_SECONDS.time("container_inspect"):
+        container = client.containers.get(name)
+    stream = container.logs(stream=True, follow=False, timestamps=True, since=since, until=until)
+    buf = b""
+    skipping = False  # inside an overlong line whose start was already yielded
+    try:
+        for chunk in stream:
+            if skipping:
+                nl = chunk.find(b"\n")
+                if nl < 0:
+                    continue
+                chunk, skipping = chunk[nl + 1:], False
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                yield line[:MAX_LOG_LINE].decode("utf-8", errors="replace")
+            if len(buf) > MAX_LOG_LINE:
+                yield buf[:MAX_LOG_LINE].decode("utf-8", errors="replace")
+                buf, skipping = b"", True
+        if buf:
+            yield buf[:MAX_LOG_LINE].decode("utf-8", errors="replace")
+    finally:
+        stream.close()
+
+
 async def check_pass_cli() -> bool:
     """Check if pass-cli session is active."""
-    if not shutil.which("pass-cli"):
+    if not capabilities.available("pass-cli"):
         return False
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "pass-cli", "test",
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL,
-        )
-        await proc.wait()
+        with SUBPROCESS_SECONDS.time("pass-cli"):
+            proc = await asyncio.create_subprocess_exec(
+                "pass-cli", "test",
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            await proc.wait()
         return proc.returncode == 0
     except Exception:
         return False
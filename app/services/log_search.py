@@ -0,0 +1,177 @@
+"""Search the logs of several containers at once, streaming matches as they are found.
+
+Each container's log is read as a stream and matched line by line in a
+dedicated pool of LOG_SEARCH_CONCURRENCY threads shared by all searches, so
+searches never tie up the default executor other blocking calls use. Matches
+go through a small bounded queue, so a slow client slows the readers down
+instead of piling matches up in memory; a reader that can't hand over a match
+for _PUT_TIMEOUT seconds gives up. Lines are capped at
+docker_service.MAX_LOG_LINE. Once `limit` matches were sent, or the client
+disconnects, every reader stops and closes its log stream.
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable
+
+from app.config import LOG_SEARCH_CONCURRENCY
+from app.services import docker_service
+
+# Matches waiting to be sent to the client, per query
+_QUEUE_SIZE = 256
+# Seconds a reader waits for room in a full queue before giving up
+_PUT_TIMEOUT = 30.0
+
+_RELATIVE_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@dataclass(frozen=True)
+class Target:
+    host: str | None
+    container: str
+    stack: str | None = None
+
+
+def parse_time(value: str, now: datetime | None = None) -> datetime:
+    """Parse a relative age ("15m", "2h", "1d"), an ISO 8601 time or a unix timestamp."""
+    now = now or datetime.now(timezone.utc)
+    value = value.strip()
+    m = _RELATIVE_RE.match(value)
+    if m:
+        return now - timedelta(seconds=float(m.group(1)) * _UNITS[m.group(2)])
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def matcher(pattern: str, regex: bool = False) -> Callable[[str], bool]:
+    """Case-insensitive substring match, or a regular expression (re.error if invalid)."""
+    if regex:
+        return re.compile(pattern).search
+    needle = pattern.lower()
+    return lambda text: needle in text.lower()
+
+
+_DONE = object()
+
+_executor: ThreadPoolExecutor | None = None
+_active: set[threading.Event] = set()  # stop flags of running searches
+_background: set[asyncio.Task] = set()
+
+
+def _readers() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LOG_SEARCH_CONCURRENCY, thread_name_prefix="log-search")
+    return _executor
+
+
+def _keep(task: asyncio.Task) -> asyncio.Task:
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def search(
+    targets: list[Target],
+    match: Callable[[str], bool],
+    since: datetime | None,
+    until: datetime | None,
+    limit: int,
+) -> AsyncIterator[dict]:
+    """Yield {"container", "stack", "host", "ts", "line"} per match, then one summary dict."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(_QUEUE_SIZE)
+    halt = threading.Event()
+    _active.add(halt)
+    scanned: dict[str, int] = {}
+    errors: dict[str, str] = {}
+    started = time.perf_counter()
+
+    def _scan(t: Target) -> None:
+        if halt.is_set():
+            return
+        lines = docker_service.iter_container_logs(t.host, t.container, since, until)
+        try:
+            for line in lines:
+                if halt.is_set():
+                    break
+                scanned[t.container] = scanned.get(t.container, 0) + 1
+                ts, _, text = line.partition(" ")
+                if match(text):
+                    item = {"container": t.container, "stack": t.stack, "host": t.host, "ts": ts, "line": text}
+                    # blocks while the queue is full: the client's pace bounds memory
+                    put = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+                    try:
+                        put.result(_PUT_TIMEOUT)
+                    except concurrent.futures.TimeoutError:
+                        put.cancel()
+                        raise TimeoutError(f"client didn't read matches for {_PUT_TIMEOUT:g}s")
+        finally:
+            lines.close()
+
+    async def _one(t: Target) -> None:
+        try:
+            await loop.run_in_executor(_readers(), _scan, t)
+        except Exception as e:
+            errors[t.container] = str(e)
+
+    async def _all() -> None:
+        await asyncio.gather(*(_one(t) for t in targets))
+        await queue.put(_DONE)
+
+    async def _drain() -> None:
+        # release readers blocked on a full queue until all of them have stopped
+        while not runner.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+    runner = _keep(asyncio.create_task(_all()))
+    matches = 0
+    truncated = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            yield item
+            matches += 1
+            if matches >= limit:
+                truncated = True
+                break
+    finally:
+        halt.set()
+        _active.discard(halt)
+        _keep(asyncio.create_task(_drain()))
+
+    yield {
+        "done": True,
+        "matches": matches,
+        "truncated": truncated,
+        "containers": len(targets),
+        "scanned_lines": sum(scanned.values()),
+        "errors": errors,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def stop() -> None:
+    """Stop every running search's readers and release the reader threads."""
+    global _executor
+    for flag in list(_active):
+        flag.set()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
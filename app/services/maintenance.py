@@ -0,0 +1,526 @@
+"""Scheduled maintenance windows: batched upgrades of selected stacks.
+
+Windows are read from the YAML file MAINTENANCE_FILE (re-read when it changes):
+
+    windows:
+      - name: nightly
+        cron: "0 3 * * *"       # minute hour day-of-month month day-of-week
+        duration: 2h            # how long the window stays open
+        stacks: ["web", "media-*"]   # names or glob patterns ("*": every stack)
+        hosts: [local]          # optional: only stacks on these hosts
+        batch_size: 2           # stacks upgraded at once
+        budget: 90m             # optional: max run time (default: the window's duration)
+        rolling: false          # optional: rolling upgrades (default: ROLLING_UPGRADE)
+
+When a window opens, its active stacks are upgraded batch by batch through
+mgmt_service.upgrade_locked, into one task per run. No batch starts after the
+time budget or the window ran out, and a stack whose last upgrade took longer
+than the time left is not started; those stacks are deferred and go first in
+the window's next run.
+
+With SHARED_STATE_DIR, the scheduler state (occurrences already run,
+deferrals, upgrade durations and runs) is kept in the shared state database,
+one worker at a time checks for opening windows, and a window only runs in
+one worker at a time, so no occurrence runs twice and any worker can report
+or resume the schedule.
+
+All timing goes through a Clock, so a SimulatedClock can drive the scheduler
+(and the budget) without waiting in real time.
+"""
+from __future__ import annotations
+
+import asyncio
+import fnmatch
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+import yaml
+
+from app import metrics
+from app.metrics import SHARED_STATE_ERRORS
+from app.config import MAINTENANCE_FILE, ROLLING_UPGRADE, SAFE_NAME_RE
+from app.services import mgmt_service, process_service, shared_state, stack_service
+
+# How often the scheduler checks for opening windows and re-reads the file
+_TICK = 30
+# Finished runs kept for state(), per window
+_HISTORY = 20
+# Prefix of the scheduler state's keys in the shared state database
+_KEY = "maintenance:"
+
+
+class Clock:
+    """Wall-clock time and sleeping; replaced by SimulatedClock to test schedules."""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """A clock that only moves when slept on or advanced."""
+
+    def __init__(self, start: datetime) -> None:
+        self.current = start
+
+    def now(self) -> datetime:
+        return self.current
+
+    def advance(self, seconds: float) -> None:
+        self.current += timedelta(seconds=seconds)
+
+    async def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+
+# --- Schedule parsing -------------------------------------------------------------
+
+_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7))
+_DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smhd]?)$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_field(text: str, name: str, lo: int, hi: int) -> set[int]:
+    values: set[int] = set()
+    for part in text.split(","):
+        spec, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if spec == "*":
+            start, end = lo, hi
+        elif "-" in spec:
+            start, end = (int(v) for v in spec.split("-", 1))
+        else:
+            start = int(spec)
+            end = hi if step_text else start
+        if not (lo <= start <= end <= hi) or step < 1:
+            raise ValueError(f"{name} out of range in {text!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+@dataclass(frozen=True)
+class Cron:
+    """A five-field cron expression (no names or @-macros); day of week 0 and 7 are Sunday."""
+    minutes: frozenset[int]
+    hours: frozenset[int]
+    days: frozenset[int]
+    months: frozenset[int]
+    weekdays: frozenset[int]
+    any_day: bool
+    any_weekday: bool
+
+    @classmethod
+    def parse(cls, expr: str) -> Cron:
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"expected 5 fields in cron expression {expr!r}")
+        try:
+            sets = [_parse_field(p, *f) for p, f in zip(parts, _FIELDS)]
+        except ValueError as e:
+            raise ValueError(f"invalid cron expression {expr!r}: {e}") from None
+        weekdays = {d % 7 for d in sets[4]}
+        return cls(*(frozenset(s) for s in sets[:4]), frozenset(weekdays), parts[2] == "*", parts[4] == "*")
+
+    def matches(self, dt: datetime) -> bool:
+        if dt.minute not in self.minutes or dt.hour not in self.hours or dt.month not in self.months:
+            return False
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        # as in cron: with both day fields restricted, either one matching is enough
+        if not self.any_day and not self.any_weekday:
+            return day or weekday
+        return day and weekday
+
+
+def parse_duration(value: str | int | float) -> float:
+    """Seconds from a number or "30s" / "90m" / "2h" / "1d"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(str(value).strip())
+    if not m:
+        raise ValueError(f"invalid duration {value!r}")
+    return float(m.group(1)) * _UNITS[m.group(2)]
+
+
+@dataclass(frozen=True)
+class Window:
+    name: str
+    cron: Cron
+    cron_expr: str
+    duration: float
+    stacks: tuple[str, ...]
+    hosts: tuple[str, ...] = ()
+    batch_size: int = 1
+    budget: float = 0.0  # 0: the window's duration
+    rolling: bool = ROLLING_UPGRADE
+
+    def opened_at(self, now: datetime) -> datetime | None:
+        """Start of the occurrence of this window that is open at `now`, if any."""
+        minute = now.replace(second=0, microsecond=0)
+        for back in range(int(self.duration // 60) + 1):
+            t = minute - timedelta(minutes=back)
+            if self.cron.matches(t) and (now - t).total_seconds() < self.duration:
+                return t
+        return None
+
+    def selects(self, stack: stack_service.StackInfo) -> bool:
+        if self.hosts and stack.host not in self.hosts:
+            return False
+        return any(fnmatch.fnmatchcase(stack.name, p) for p in self.stacks)
+
+    def to_dict(self) -> dict:
+        return {
+            "cron": self.cron_expr,
+            "duration": self.duration,
+            "stacks": list(self.stacks),
+            "hosts": list(self.hosts),
+            "batch_size": self.batch_size,
+            "budget": self.budget or self.duration,
+            "rolling": self.rolling,
+        }
+
+
+def parse_windows(data: object) -> dict[str, Window]:
+    """Windows from the parsed YAML document; ValueError on anything invalid."""
+    if data is None:
+        return {}
+    if not isinstance(data, dict) or not isinstance(data.get("windows", []), list):
+        raise ValueError('expected a mapping with a "windows" list')
+    windows: dict[str, Window] = {}
+    for i, entry in enumerate(data.get("windows") or []):
+        if not isinstance(entry, dict):
+            raise ValueError(f"window #{i + 1} is not a mapping")
+        name = str(entry.get("name") or "")
+        if not SAFE_NAME_RE.match(name) or name in windows:
+            raise ValueError(f"window #{i + 1} needs a unique name (letters, digits, _ . -)")
+        stacks = entry.get("stacks")
+        if isinstance(stacks, str):
+            stacks = [stacks]
+        hosts = entry.get("hosts") or []
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        if not stacks or not isinstance(stacks, list):
+            raise ValueError(f"window {name!r} selects no stacks")
+        try:
+            duration = parse_duration(entry.get("duration", "1h"))
+            window = Window(
+                name=name,
+                cron=Cron.parse(str(entry.get("cron", ""))),
+                cron_expr=str(entry.get("cron")),
+                duration=duration,
+                stacks=tuple(str(s) for s in stacks),
+                hosts=tuple(str(h) for h in hosts),
+                batch_size=int(entry.get("batch_size", 1)),
+                budget=parse_duration(entry.get("budget", 0)),
+                rolling=bool(entry.get("rolling", ROLLING_UPGRADE)),
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"window {name!r}: {e}") from None
+        if duration < 60 or window.batch_size < 1 or window.budget < 0:
+            raise ValueError(f"window {name!r}: duration must be at least 1m and batch_size at least 1")
+        windows[name] = window
+    return windows
+
+
+# --- State --------------------------------------------------------------------------
+
+@dataclass
+class Run:
+    window: str
+    opened_at: datetime
+    started_at: datetime
+    deadline: datetime
+    task_id: str = ""
+    running: bool = True
+    finished_at: datetime | None = None
+    upgraded: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    deferred: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "window": self.window,
+            "opened_at": self.opened_at.isoformat(timespec="seconds"),
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "deadline": self.deadline.isoformat(timespec="seconds"),
+            "finished_at": self.finished_at.isoformat(timespec="seconds") if self.finished_at else None,
+            "task_id": self.task_id or None,
+            "running": self.running,
+            "upgraded": self.upgraded,
+            "failed": self.failed,
+            "deferred": self.deferred,
+        }
+
+
+_windows: dict[str, Window] = {}
+_file_mtime: float | None = None
+_file_error = ""
+_deferred: dict[str, list[str]] = {}  # window -> stack names, oldest first
+_durations: dict[str, float] = {}  # stack -> seconds its last scheduled upgrade took
+_last_opened: dict[str, datetime] = {}  # window -> occurrence already run
+_runs: dict[str, Run] = {}  # window -> run in progress in this worker
+_history: dict[str, list[dict]] = {}  # window -> its latest runs (Run.to_dict()), oldest first
+_loop_task: asyncio.Task | None = None
+
+UpgradeFn = Callable[[stack_service.StackInfo, process_service.TaskState, bool], Awaitable[int]]
+
+
+def reload(path: str = MAINTENANCE_FILE) -> None:
+    """Re-read the schedule file if it changed; an invalid file keeps the previous windows."""
+    global _windows, _file_mtime, _file_error
+    if not path:
+        _windows, _file_mtime, _file_error = {}, None, ""
+        return
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        _windows, _file_mtime, _file_error = {}, None, f"{path} not found"
+        return
+    if mtime == _file_mtime:
+        return
+    _file_mtime = mtime
+    try:
+        with open(path) as f:
+            _windows = parse_windows(yaml.safe_load(f))
+        _file_error = ""
+    except (OSError, yaml.YAMLError, ValueError) as e:
+        _file_error = str(e)
+    for name in set(_deferred) - set(_windows):
+        del _deferred[name]
+
+
+async def _save(key: str, data: dict) -> None:
+    if not shared_state.enabled():
+        return
+    try:
+        await asyncio.to_thread(shared_state.save_result, _KEY + key, time.time(), data)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("write")
+
+
+async def refresh() -> None:
+    """Load the scheduler state other workers stored (no-op without SHARED_STATE_DIR)."""
+    if not shared_state.enabled():
+        return
+    try:
+        rows = await asyncio.to_thread(shared_state.load_results, _KEY)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("read")
+        return
+    for name, data in rows.items():
+        kind, _, key = name[len(_KEY):].partition(":")
+        if kind == "opened":
+            _last_opened[key] = datetime.fromisoformat(data["at"])
+        elif kind == "deferred":
+            _deferred[key] = data["stacks"]
+        elif kind == "duration":
+            _durations[key] = data["seconds"]
+        elif kind == "runs" and key not in _runs:
+            _history[key] = data["runs"]
+
+
+async def _save_runs(window: str, run: Run) -> None:
+    """Record the run (in progress or finished) as the window's latest."""
+    record = run.to_dict()
+    runs = [r for r in _history.get(window, []) if r["started_at"] != record["started_at"]]
+    _history[window] = (runs + [record])[-_HISTORY:]
+    await _save(f"runs:{window}", {"runs": _history[window]})
+
+
+def _queue(window: Window, stacks: list[stack_service.StackInfo]) -> list[stack_service.StackInfo]:
+    """The window's active stacks, the ones deferred by its last run first."""
+    selected = {s.name: s for s in stacks if s.active and not s.is_self and window.selects(s)}
+    first = [selected.pop(n) for n in _deferred.get(window.name, []) if n in selected]
+    return first + [selected[n] for n in sorted(selected)]
+
+
+async def _run_window(
+    window: Window, run: Run, clock: Clock, upgrade: UpgradeFn, task: process_service.TaskState,
+) -> int:
+    await refresh()
+    stacks = _queue(window, await asyncio.to_thread(stack_service.list_stacks))
+    task.lines.append(
+        f"Maintenance window '{window.name}': {len(stacks)} stack(s), {window.batch_size} at a time, "
+        f"until {run.deadline:%Y-%m-%d %H:%M}\n\n"
+    )
+    pending = list(stacks)
+    batch_no = 0
+    while pending:
+        left = (run.deadline - clock.now()).total_seconds()
+        if left <= 0:
+            task.lines.append("Time budget used up.\n")
+            break
+        # the next stacks whose last upgrade fits in the time left
+        batch = [s for s in pending if _durations.get(s.name, 0.0) < left][:window.batch_size]
+        if not batch:
+            task.lines.append(f"No remaining stack fits in the {left:.0f}s left.\n")
+            break
+        batch_no += 1
+        task.lines.append(f"Batch {batch_no}: {', '.join(s.name for s in batch)}\n")
+        with task.span(f"batch {batch_no}", "__maintenance__") as sp:
+
+            async def _one(stack: stack_service.StackInfo) -> int:
+                started = clock.now()
+                code = await upgrade(stack, task, window.rolling)
+                _durations[stack.name] = (clock.now() - started).total_seconds()
+                await _save(f"duration:{stack.name}", {"seconds": _durations[stack.name]})
+                return code
+
+            codes = await asyncio.gather(*(_one(s) for s in batch))
+            sp.end("ok" if not any(codes) else "failed", f"{len(batch)} stack(s)")
+        for s, code in zip(batch, codes):
+            pending.remove(s)
+            (run.upgraded if code == 0 else run.failed).append(s.name)
+        task.lines.append("\n")
+
+    run.deferred = [s.name for s in pending]
+    _deferred[window.name] = list(run.deferred)
+    await _save(f"deferred:{window.name}", {"stacks": run.deferred})
+    task.lines.append("=========================\n")
+    task.lines.append(
+        f"Maintenance summary: {len(run.upgraded)} upgraded, {len(run.failed)} failed, "
+        f"{len(run.deferred)} deferred to the next window\n"
+    )
+    for n in run.failed:
+        task.lines.append(f"  Failed: {n}\n")
+    for n in run.deferred:
+        task.lines.append(f"  Deferred: {n}\n")
+    return 1 if run.failed else 0
+
+
+async def run_window(
+    window: Window,
+    opened_at: datetime | None = None,
+    clock: Clock | None = None,
+    upgrade: UpgradeFn = mgmt_service.upgrade_locked,
+) -> process_service.TaskState | None:
+    """Start a run of the window (as one task); None if it is already running.
+
+    The run ends by the window's close (opened_at + duration) or its budget,
+    whichever comes first; without opened_at the window is taken to open now.
+    """
+    if window.name in _runs:
+        return None
+    clock = clock or Clock()
+    now = clock.now()
+    opened_at = opened_at or now
+    deadline = min(opened_at + timedelta(seconds=window.duration),
+                   now + timedelta(seconds=window.budget or window.duration))
+    run = Run(window.name, opened_at, now, deadline)
+    _runs[window.name] = run
+
+    async def _script(task: process_service.TaskState) -> int:
+        run.task_id = task.task_id
+        await _save_runs(window.name, run)
+        try:
+            return await _run_window(window, run, clock, upgrade, task)
+        finally:
+            run.running = False
+            run.finished_at = clock.now()
+            _runs.pop(window.name, None)
+            await _save_runs(window.name, run)
+
+    task = await process_service.run_script(_script, f"__maintenance__{window.name}", f"maintenance {window.name}")
+    if task.done and _runs.get(window.name) is run:
+        # the script never ran: the window is already running in another worker
+        del _runs[window.name]
+        return None
+    return task
+
+
+async def tick(clock: Clock, upgrade: UpgradeFn = mgmt_service.upgrade_locked) -> list[str]:
+    """Start the windows that are open and weren't run in this occurrence; return their names.
+
+    Skipped while another worker is ticking.
+    """
+    claim = shared_state.try_lock("__maintenance_tick__")
+    if claim is None:
+        return []
+    try:
+        await refresh()
+        now = clock.now()
+        started = []
+        for window in _windows.values():
+            opened = window.opened_at(now)
+            if opened is None or _last_opened.get(window.name) == opened or window.name in _runs:
+                continue
+            _last_opened[window.name] = opened
+            await _save(f"opened:{window.name}", {"at": opened.isoformat()})
+            if await run_window(window, opened, clock, upgrade) is not None:
+                started.append(window.name)
+        return started
+    finally:
+        claim.release()
+
+
+def get_window(name: str) -> Window | None:
+    return _windows.get(name)
+
+
+def _running(window: str) -> bool:
+    return window in _runs or process_service.is_stack_busy(f"__maintenance__{window}")
+
+
+def state() -> dict:
+    """Windows, runs in progress (in any worker) and the latest finished runs, newest first."""
+    runs = sorted((r for rs in _history.values() for r in rs), key=lambda r: r["started_at"], reverse=True)
+    running = [r for r in runs if r["running"] and _running(r["window"])]
+    # a run recorded as in progress whose worker died is shown as finished
+    finished = [{**r, "running": False} for r in runs if r not in running]
+    return {
+        "enabled": bool(MAINTENANCE_FILE),
+        "file": MAINTENANCE_FILE or None,
+        "error": _file_error or None,
+        "windows": {
+            name: {**w.to_dict(), "deferred": _deferred.get(name, []), "running": _running(name)}
+            for name, w in sorted(_windows.items())
+        },
+        "running": running,
+        "history": finished[:_HISTORY],
+    }
+
+
+def _collect_metrics():
+    for name in _windows:
+        yield (
+            "stack_manager_maintenance_deferred_stacks", "gauge",
+            "Stacks deferred to the next run of a maintenance window.",
+            {"window": name}, len(_deferred.get(name, [])),
+        )
+
+
+metrics.register_collector(_collect_metrics)
+
+
+async def _run(clock: Clock) -> None:
+    while True:
+        try:
+            reload()
+            await tick(clock)
+        except Exception:
+            pass
+        await clock.sleep(_TICK)
+
+
+def start(clock: Clock | None = None) -> None:
+    global _loop_task
+    if MAINTENANCE_FILE:
+        _loop_task = asyncio.create_task(_run(clock or Clock()))
+
+
+async def stop() -> None:
+    global _loop_task
+    if _loop_task is not None:
+        _loop_task.cancel()
+        try:
+            await _loop_task
+        except asyncio.CancelledError:
+            pass
+        _loop_task = None
@@ -3,101 +3,194 @@ from __future__ import annotations
 
 import asyncio
 import re
+import time
 import uuid
+from functools import partial
 from pathlib import Path
+from typing import Awaitable, Callable
 
-from app.config import COMPOSE_CMD, DOCKER_APPS_PATH
-from app.services import process_service, stack_service
+from app.config import (
+    BULK_CONCURRENCY, DOCKER_APPS_PATH, DOCKER_ENDPOINTS, DOCKER_HOST, ENDPOINTS_BY_NAME, NATIVE_STOP,
+    ROLLING_HEALTH_TIMEOUT, ROLLING_UPGRADE,
+)
+from app.metrics import SUBPROCESS_SECONDS
+from app.services import capabilities, docker_service, pass_monitor, preflight, process_service, stack_service
 
 _PASS_URI_RE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)=pass://(.+)$")
 
 
-def _stack_dir(name: str) -> str:
-    return str(Path(DOCKER_APPS_PATH) / name)
+def _host_flags(host: str | None) -> list[str]:
+    """``-H <url>`` targeting a stack's Docker host, unless it is the CLI's default DOCKER_HOST."""
+    url = ENDPOINTS_BY_NAME[host].url if host else DOCKER_HOST
+    return [] if url == DOCKER_HOST else ["-H", url]
 
 
-def _compose_args(*extra: str) -> list[str]:
-    return [*COMPOSE_CMD, *extra]
+def _compose_cmd(host: str | None) -> list[str]:
+    # -H is a global flag: "docker -H url compose ..." / "docker-compose -H url ..."
+    compose = capabilities.compose_cmd()
+    return [compose[0], *_host_flags(host), *compose[1:]]
 
 
-def _pass_compose_args(*extra: str) -> list[str]:
+def _compose_args(*extra: str, host: str | None = None) -> list[str]:
+    return [*_compose_cmd(host), *extra]
+
+
+def _pass_compose_args(*extra: str, host: str | None = None) -> list[str]:
     """Build a pass-cli wrapped compose command."""
     return [
         "pass-cli", "run", "--env-file", ".env.template", "--",
-        *COMPOSE_CMD, "--env-file", ".env.template",
+        *_compose_cmd(host), "--env-file", ".env.template",
         *extra,
     ]
 
 
+def _prune_args(host: str | None) -> list[str]:
+    return ["docker", *_host_flags(host), "image", "prune", "-f"]
+
+
 async def _check_secret(uri: str, cwd: str) -> bool:
     """Silently check if a pass-cli secret exists (no output)."""
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "pass-cli", "item", "view", uri,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL,
-            cwd=cwd,
-        )
-        await proc.wait()
+        with SUBPROCESS_SECONDS.time("pass-cli"):
+            proc = await asyncio.create_subprocess_exec(
+                "pass-cli", "item", "view", uri,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                cwd=cwd,
+            )
+            await proc.wait()
         return proc.returncode == 0
     except Exception:
         return False
 
 
+async def _check_pass_session(cwd: str, task: process_service.TaskState) -> bool:
+    """Run ``pass-cli test``, or re-check once if the session monitor just saw it inactive.
+
+    A failed check asks the monitor to re-probe, so /api/status follows along.
+    """
+    task.lines.append("Checking pass-cli session...\n")
+    if pass_monitor.known_inactive():
+        with task.span("pass-cli test") as sp:
+            if not await pass_monitor.recheck():
+                task.lines.append("  No active session, also on a re-check (log in first).\n")
+                sp.end("failed", "re-checked: no active session")
+                return False
+            task.lines.append("  Session active again.\n")
+            sp.end("ok", "re-checked after a cached inactive verdict")
+        return True
+    code = await process_service.run_subprocess(["pass-cli", "test"], cwd, task)
+    if code != 0:
+        pass_monitor.request_refresh()
+        return False
+    pass_monitor.record_success()
+    return True
+
+
 async def _validate_secrets(
-    template_path: Path, cwd: str, task: process_service.TaskState
+    template_path: Path, cwd: str, task: process_service.TaskState, scope: str | None = None,
 ) -> bool:
     """Parse .env.template for pass:// refs and verify each secret exists.
 
     Returns True if all secrets are valid, False otherwise.
     """
-    task.lines.append("Validating secrets...\n")
-    checked = 0
-    errors = 0
-
-    for line in template_path.read_text().splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        m = _PASS_URI_RE.match(line)
-        if not m:
-            continue
-
-        var_name = m.group(1)
-        uri = f"pass://{m.group(2)}"
-        checked += 1
-
-        if await _check_secret(uri, cwd):
-            task.lines.append(f"  ✓ {var_name}\n")
+    with task.span("validate secrets", scope=scope) as sp:
+        task.lines.append("Validating secrets...\n")
+        checked = 0
+        errors = 0
+
+        for line in template_path.read_text().splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            m = _PASS_URI_RE.match(line)
+            if not m:
+                continue
+
+            var_name = m.group(1)
+            uri = f"pass://{m.group(2)}"
+            checked += 1
+
+            if await _check_secret(uri, cwd):
+                task.lines.append(f"  ✓ {var_name}\n")
+            else:
+                task.lines.append(f"  ✗ {var_name} — secret not found: {uri}\n")
+                errors += 1
+
+        if checked == 0:
+            task.lines.append("  No pass:// references found in template.\n")
         else:
-            task.lines.append(f"  ✗ {var_name} — secret not found: {uri}\n")
-            errors += 1
+            task.lines.append(f"  {checked} secret(s) checked, {errors} error(s).\n")
 
-    if checked == 0:
-        task.lines.append("  No pass:// references found in template.\n")
-    else:
-        task.lines.append(f"  {checked} secret(s) checked, {errors} error(s).\n")
+        if errors:
+            sp.end("failed", f"{errors} of {checked} secret(s) missing")
+        else:
+            sp.end("ok", f"{checked} secret(s)")
 
     return errors == 0
 
 
-async def start_stack(name: str) -> process_service.TaskState:
-    """Start a stack (equivalent to mgmt.sh use <name>)."""
-    stack = stack_service.get_stack(name)
-    if stack is None:
-        return await _error_task(f'Stack "{name}" not found.')
+async def _preflight(
+    stack: stack_service.StackInfo, task: process_service.TaskState, scope: str | None = None,
+) -> bool:
+    """Check the stack's compose config (cached by content hash); False if it is invalid."""
+    with task.span("preflight", scope=scope) as sp:
+        verdict, cached = await preflight.validate(stack)
+        if verdict.valid is False:
+            task.lines.append(f"Invalid compose config: {verdict.error}\n")
+            sp.end("failed", verdict.error)
+            return False
+        if verdict.valid is None:
+            sp.end("ok", f"not checked: {verdict.error}")
+        else:
+            sp.end("ok", "cached" if cached else None)
+    return True
+
+
+async def _skip_invalid(
+    stacks: list[stack_service.StackInfo], task: process_service.TaskState,
+) -> tuple[list[stack_service.StackInfo], list[str]]:
+    """Pre-flight several stacks at once; returns (valid stacks, names of invalid ones)."""
+    with task.span("preflight", scope="__all__") as sp:
+        verdicts, ran = await preflight.validate_all(stacks)
+        invalid = [s.name for s in stacks if verdicts[s.name].valid is False]
+        sp.end("failed" if invalid else "ok", f"{ran} validated, {len(stacks) - ran} cached, {len(invalid)} invalid")
+    if invalid:
+        task.lines.append(f"Skipping {len(invalid)} stack(s) with an invalid compose config:\n")
+        for name in invalid:
+            task.lines.append(f"  {name}: {verdicts[name].error}\n")
+        task.lines.append("\n")
+    return [s for s in stacks if s.name not in invalid], invalid
+
+
+ScriptFn = Callable[[process_service.TaskState], Awaitable[int]]
+
+
+async def _pull(
+    stack: stack_service.StackInfo, task: process_service.TaskState, *services: str, scope: str | None = None,
+) -> int:
+    """Pull the stack's images (quick when the pre-fetch scheduler already pulled them)."""
+    task.lines.append(f"Pulling image for {services[0]}...\n" if len(services) == 1 else "Pulling images...\n")
+    compose = _pass_compose_args if stack.mode == "pass" else _compose_args
+    return await process_service.run_subprocess(
+        compose("pull", *services, host=stack.host), stack.path, task,
+        suppress_env_warnings=True, scope=scope,
+    )
+
 
-    cwd = _stack_dir(name)
+def _start_script(stack: stack_service.StackInfo) -> ScriptFn:
+    """Build the script that starts a stack (equivalent to mgmt.sh use <name>)."""
+    name = stack.name
+    cwd = stack.path
 
     if stack.mode == "pass":
         async def _script(task: process_service.TaskState) -> int:
             task.lines.append(f"[{name}] Using Proton Pass secret injection\n")
 
-            task.lines.append("Checking pass-cli session...\n")
-            code = await process_service.run_subprocess(
-                ["pass-cli", "test"], cwd, task,
-            )
-            if code != 0:
+            if not await _preflight(stack, task):
+                return 1
+
+            if not await _check_pass_session(cwd, task):
                 task.lines.append("Error: pass-cli session not active.\n")
                 return 1
 
@@ -108,7 +201,7 @@ async def start_stack(name: str) -> process_service.TaskState:
 
             task.lines.append(f"Starting {name}...\n")
             code = await process_service.run_subprocess(
-                _pass_compose_args("up", "-d", "--remove-orphans"),
+                _pass_compose_args("up", "-d", "--remove-orphans", host=stack.host),
                 cwd, task,
             )
             if code == 0:
@@ -116,53 +209,188 @@ async def start_stack(name: str) -> process_service.TaskState:
                 task.lines.append(f"{name} started successfully.\n")
             return code
 
-        return await process_service.run_script(_script, name, f"start {name}")
+        return _script
     else:
         async def _script(task: process_service.TaskState) -> int:
+            if not await _preflight(stack, task):
+                return 1
             task.lines.append(f"Starting {name}...\n")
             code = await process_service.run_subprocess(
-                _compose_args("up", "-d", "--remove-orphans"), cwd, task,
+                _compose_args("up", "-d", "--remove-orphans", host=stack.host), cwd, task,
             )
             if code == 0:
                 Path(cwd, ".inuse").touch()
                 task.lines.append(f"{name} started successfully.\n")
             return code
 
-        return await process_service.run_script(_script, name, f"start {name}")
+        return _script
 
 
-async def stop_stack(name: str) -> process_service.TaskState:
-    """Stop a stack (equivalent to mgmt.sh stop <name>)."""
-    stack = stack_service.get_stack(name)
-    if stack is None:
-        return await _error_task(f'Stack "{name}" not found.')
-
-    cwd = _stack_dir(name)
+def _stop_script(stack: stack_service.StackInfo) -> ScriptFn:
+    """Build the script that stops a stack (equivalent to mgmt.sh stop <name>)."""
+    name = stack.name
+    cwd = stack.path
 
     async def _script(task: process_service.TaskState) -> int:
         task.lines.append(f"Stopping {name}...\n")
         env_args = ["--env-file", ".env.template"] if stack.mode == "pass" else []
         code = await process_service.run_subprocess(
-            _compose_args(*env_args, "down", "--remove-orphans"), cwd, task,
+            _compose_args(*env_args, "down", "--remove-orphans", host=stack.host), cwd, task,
         )
         Path(cwd, ".inuse").unlink(missing_ok=True)
         task.lines.append(f"{name} stopped.\n")
         return code
 
-    return await process_service.run_script(_script, name, f"stop {name}")
+    return _script
+
+
+async def _container_op(
+    stack: stack_service.StackInfo, task: process_service.TaskState,
+    op: str, c: docker_service.ProjectContainer,
+) -> bool:
+    """Stop or start one container through the Docker API, with a timed span and output line."""
+    with task.span(f"{op} {c.name}", scope=stack.name) as sp:
+        start = time.perf_counter()
+        try:
+            if op == "stop":
+                await asyncio.to_thread(docker_service.stop_container, stack.host, c.id, c.stop_timeout)
+            else:
+                await asyncio.to_thread(docker_service.start_container, stack.host, c.id)
+        except Exception as e:
+            task.lines.append(f"  ✗ {c.name}: {op} failed: {e}\n")
+            sp.end("failed", str(e))
+            return False
+        task.lines.append(f"  {c.name} {'stopped' if op == 'stop' else 'started'} in {time.perf_counter() - start:.2f}s\n")
+    return True
+
+
+def _native_stop_script(stack: stack_service.StackInfo, restart: bool = False) -> ScriptFn:
+    """Build the script that stops (or restarts) a stack through the Docker API.
+
+    Containers are found by their compose project label. Services are stopped level
+    by level in reverse depends_on order (dependents first), the containers of a level
+    in parallel, each with its own stop grace period; a restart then starts the
+    previously running ones level by level in depends_on order. A stop removes the
+    containers and the project's networks, falling back to compose down if a network
+    can't be removed.
+    """
+    name = stack.name
+    cwd = stack.path
+
+    async def _script(task: process_service.TaskState) -> int:
+        task.lines.append(f"{'Restarting' if restart else 'Stopping'} {name} through the Docker API...\n")
+        started = time.perf_counter()
+        try:
+            containers = await asyncio.to_thread(docker_service.project_containers, stack.host, stack.project)
+        except Exception as e:
+            task.lines.append(f"Error: {e}\n")
+            return 1
+
+        levels = stack_service.service_levels(stack)
+        by_service: dict[str, list[docker_service.ProjectContainer]] = {}
+        for c in containers:
+            by_service.setdefault(c.service, []).append(c)
+        known = {svc for level in levels for svc in level}
+        batches = [[c for svc in level for c in by_service.get(svc, [])] for level in reversed(levels)] or [[]]
+        # Orphans (services no longer in the compose file) stop first, nothing depends on them
+        batches[0] += [c for c in containers if c.service not in known]
+        running = [[c for c in batch if c.running] for batch in batches]
+
+        for batch in running:
+            results = await asyncio.gather(*(_container_op(stack, task, "stop", c) for c in batch))
+            if not all(results):
+                task.lines.append(f"[{name}] Stop failed; later services were left running.\n")
+                return 1
+
+        if restart:
+            running[0] = [c for c in running[0] if c.service in known]
+            for batch in reversed(running):
+                results = await asyncio.gather(*(_container_op(stack, task, "start", c) for c in batch))
+                if not all(results):
+                    task.lines.append(f"[{name}] Restart failed.\n")
+                    return 1
+            task.lines.append(
+                f"{name} restarted in {time.perf_counter() - started:.2f}s "
+                f"({sum(map(len, running))} container(s)).\n"
+            )
+            return 0
+
+        with task.span("remove containers") as sp:
+            try:
+                await asyncio.gather(*(
+                    asyncio.to_thread(docker_service.remove_container, stack.host, c.id) for c in containers
+                ))
+                leftover = await asyncio.to_thread(docker_service.remove_project_networks, stack.host, stack.project)
+            except Exception as e:
+                sp.end("failed", str(e))
+                leftover = [str(e)]
+        if leftover:
+            task.lines.append(f"Could not remove {', '.join(leftover)}; falling back to compose down.\n")
+            return await _stop_script(stack)(task)
+
+        Path(cwd, ".inuse").unlink(missing_ok=True)
+        task.lines.append(
+            f"{name} stopped in {time.perf_counter() - started:.2f}s ({len(containers)} container(s) removed).\n"
+        )
+        return 0
+
+    return _script
+
+
+def _restart_script(stack: stack_service.StackInfo) -> ScriptFn:
+    """Build the script that restarts a stack's containers with compose."""
+    async def _script(task: process_service.TaskState) -> int:
+        task.lines.append(f"Restarting {stack.name}...\n")
+        env_args = ["--env-file", ".env.template"] if stack.mode == "pass" else []
+        return await process_service.run_subprocess(
+            _compose_args(*env_args, "restart", host=stack.host), stack.path, task,
+        )
+
+    return _script
+
+
+async def start_stack(name: str) -> process_service.TaskState:
+    """Start a stack (equivalent to mgmt.sh use <name>)."""
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        return await _error_task(f'Stack "{name}" not found.')
+
+    return await process_service.run_script(_start_script(stack), name, f"start {name}")
+
+
+async def stop_stack(name: str, native: bool = NATIVE_STOP) -> process_service.TaskState:
+    """Stop a stack (equivalent to mgmt.sh stop <name>), optionally through the Docker API."""
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        return await _error_task(f'Stack "{name}" not found.')
+
+    script = _native_stop_script(stack) if native else _stop_script(stack)
+    return await process_service.run_script(script, name, f"stop {name}")
+
+
+async def restart_stack(name: str, native: bool = NATIVE_STOP) -> process_service.TaskState:
+    """Restart a stack's containers, optionally through the Docker API."""
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        return await _error_task(f'Stack "{name}" not found.')
+
+    script = _native_stop_script(stack, restart=True) if native else _restart_script(stack)
+    return await process_service.run_script(script, name, f"restart {name}")
 
 
 async def update_configs() -> process_service.TaskState:
-    """Git pull latest stack definitions."""
-    git_dir = Path(DOCKER_APPS_PATH) / ".git"
-    if not git_dir.is_dir():
+    """Git pull latest stack definitions (every host's stacks tree that is a git checkout)."""
+    trees = list(dict.fromkeys(
+        e.apps_path for e in DOCKER_ENDPOINTS if (Path(e.apps_path) / ".git").is_dir()
+    ))
+    if not trees:
         return await _error_task(
-            f"No git repository found at {DOCKER_APPS_PATH}.\n"
+            f"No git repository found at {DOCKER_ENDPOINTS[0].apps_path}.\n"
             "Mount a git-cloned repo as your DOCKER_APPS_PATH volume."
         )
 
-    async def _script(task: process_service.TaskState) -> int:
-        git_config_file = Path(DOCKER_APPS_PATH) / ".git" / "config"
+    async def _pull(tree: str, task: process_service.TaskState) -> int:
+        git_config_file = Path(tree) / ".git" / "config"
         remote_url = ""
         try:
             for line in git_config_file.read_text().splitlines():
@@ -173,7 +401,7 @@ async def update_configs() -> process_service.TaskState:
         except Exception:
             pass
 
-        git_cmd = ["git", "-C", DOCKER_APPS_PATH]
+        git_cmd = ["git", "-C", tree]
 
         if remote_url.startswith("git@") or remote_url.startswith("ssh://"):
             task.lines.append(
@@ -184,10 +412,10 @@ async def update_configs() -> process_service.TaskState:
                 "-c", "url.https://github.com/.insteadOf=ssh://git@github.com/",
             ])
 
-        task.lines.append("Running git pull...\n")
+        task.lines.append(f"Running git pull in {tree}...\n" if len(trees) > 1 else "Running git pull...\n")
         code = await process_service.run_subprocess(
             [*git_cmd, "pull", "--ff-only"],
-            DOCKER_APPS_PATH, task,
+            tree, task,
         )
         if code == 0:
             task.lines.append("Update complete.\n")
@@ -195,6 +423,22 @@ async def update_configs() -> process_service.TaskState:
             task.lines.append("Git pull failed.\n")
         return code
 
+    async def _script(task: process_service.TaskState) -> int:
+        codes = [await _pull(tree, task) for tree in trees]
+
+        task.lines.append("\nValidating stack definitions...\n")
+        with task.span("preflight") as sp:
+            stacks = await asyncio.to_thread(stack_service.list_stacks)
+            verdicts, ran = await preflight.validate_all(stacks, prune=True)
+            invalid = [(n, v) for n, v in verdicts.items() if v.valid is False]
+            sp.end("failed" if invalid else "ok", f"{ran} changed, {len(invalid)} invalid")
+        task.lines.append(
+            f"  {len(stacks)} stack(s), {ran} changed and re-validated, {len(invalid)} invalid.\n"
+        )
+        for n, v in invalid:
+            task.lines.append(f"  ✗ {n}: {v.error}\n")
+        return next((c for c in codes if c != 0), 0)
+
     return await process_service.run_script(_script, "__update__", "git pull")
 
 
@@ -213,9 +457,9 @@ async def pull_images() -> process_service.TaskState:
         for s in active:
             task.lines.append(f"  {s.name}... ")
             code = await process_service.run_subprocess(
-                _compose_args("pull", "-q"),
-                _stack_dir(s.name), task,
-                suppress_env_warnings=True,
+                _compose_args("pull", "-q", host=s.host),
+                s.path, task,
+                suppress_env_warnings=True, scope=s.name,
             )
             if code == 0:
                 task.lines.append(f"  {s.name} done\n")
@@ -238,45 +482,42 @@ async def upgrade_all() -> process_service.TaskState:
         if not active:
             task.lines.append("No active stacks to upgrade.\n")
             return 0
+        active, invalid = await _skip_invalid(active, task)
 
         needs_pass = any(s.mode == "pass" for s in active)
         if needs_pass:
-            task.lines.append("Checking pass-cli session...\n")
-            code = await process_service.run_subprocess(
-                ["pass-cli", "test"], DOCKER_APPS_PATH, task,
-            )
-            if code != 0:
+            if not await _check_pass_session(DOCKER_APPS_PATH, task):
                 task.lines.append("Error: pass-cli session required but not active. Aborting.\n")
                 return 1
             task.lines.append("pass-cli session active.\n\n")
 
         success = 0
-        failed = 0
-        failed_names: list[str] = []
+        failed = len(invalid)
+        failed_names: list[str] = list(invalid)
 
         task.lines.append("Upgrading active stacks...\n")
         task.lines.append("=========================\n\n")
 
         for s in active:
-            cwd = _stack_dir(s.name)
+            cwd = s.path
             task.lines.append(f"[{s.name}] Upgrading...\n")
 
             if s.mode == "pass":
                 template = Path(cwd) / ".env.template"
-                if not await _validate_secrets(template, cwd, task):
+                if not await _validate_secrets(template, cwd, task, scope=s.name):
                     task.lines.append(f"[{s.name}] Secret validation failed. Skipping.\n\n")
                     failed += 1
                     failed_names.append(s.name)
                     continue
 
                 code = await process_service.run_subprocess(
-                    _pass_compose_args("up", "-d", "--remove-orphans"),
-                    cwd, task,
+                    _pass_compose_args("up", "-d", "--remove-orphans", host=s.host),
+                    cwd, task, scope=s.name,
                 )
             else:
                 code = await process_service.run_subprocess(
-                    _compose_args("up", "-d", "--remove-orphans"),
-                    cwd, task,
+                    _compose_args("up", "-d", "--remove-orphans", host=s.host),
+                    cwd, task, scope=s.name,
                 )
 
             if code == 0:
@@ -298,23 +539,18 @@ async def upgrade_all() -> process_service.TaskState:
     return await process_service.run_script(_script, "__upgrade__", "upgrade all")
 
 
-async def upgrade_stack(name: str) -> process_service.TaskState:
-    """Upgrade a single stack (pull + recreate all services)."""
-    stack = stack_service.get_stack(name)
-    if stack is None:
-        return await _error_task(f'Stack "{name}" not found.')
-
-    cwd = _stack_dir(name)
+def _upgrade_script(stack: stack_service.StackInfo) -> ScriptFn:
+    """Build the script that upgrades a stack (pull + recreate all services)."""
+    name = stack.name
+    cwd = stack.path
 
     async def _script(task: process_service.TaskState) -> int:
         task.lines.append(f"[{name}] Upgrading stack...\n")
+        if not await _preflight(stack, task):
+            return 1
 
         if stack.mode == "pass":
-            task.lines.append("Checking pass-cli session...\n")
-            code = await process_service.run_subprocess(
-                ["pass-cli", "test"], cwd, task,
-            )
-            if code != 0:
+            if not await _check_pass_session(cwd, task):
                 task.lines.append("Error: pass-cli session not active.\n")
                 return 1
 
@@ -323,63 +559,164 @@ async def upgrade_stack(name: str) -> process_service.TaskState:
                 task.lines.append(f"Secret validation failed for {name}. Aborting.\n")
                 return 1
 
-            task.lines.append(f"Pulling images...\n")
-            await process_service.run_subprocess(
-                _pass_compose_args("pull"), cwd, task,
-                suppress_env_warnings=True,
-            )
+            await _pull(stack, task)
 
             task.lines.append(f"Recreating containers...\n")
             code = await process_service.run_subprocess(
-                _pass_compose_args("up", "-d", "--remove-orphans"), cwd, task,
+                _pass_compose_args("up", "-d", "--remove-orphans", host=stack.host), cwd, task,
             )
         else:
-            task.lines.append(f"Pulling images...\n")
-            await process_service.run_subprocess(
-                _compose_args("pull"), cwd, task,
-                suppress_env_warnings=True,
-            )
+            await _pull(stack, task)
 
             task.lines.append(f"Recreating containers...\n")
             code = await process_service.run_subprocess(
-                _compose_args("up", "-d", "--remove-orphans"), cwd, task,
+                _compose_args("up", "-d", "--remove-orphans", host=stack.host), cwd, task,
             )
 
         if code == 0:
             task.lines.append("Cleaning up old images...\n")
             await process_service.run_subprocess(
-                ["docker", "image", "prune", "-f"], cwd, task,
+                _prune_args(stack.host), cwd, task,
             )
             task.lines.append(f"[{name}] Upgrade complete.\n")
         else:
             task.lines.append(f"[{name}] Upgrade failed.\n")
         return code
 
-    return await process_service.run_script(_script, name, f"upgrade {name}")
+    return _script
+
 
+async def _roll_service(
+    stack: stack_service.StackInfo, project: str, service: str, task: process_service.TaskState,
+) -> int:
+    """Recreate one service, wait for it to become healthy and roll back to the previous image if it doesn't."""
+    compose = _pass_compose_args if stack.mode == "pass" else _compose_args
+    cwd = stack.path
+    previous = await asyncio.to_thread(docker_service.service_containers, stack.host, project, service)
 
-async def upgrade_service(stack_name: str, service_name: str) -> process_service.TaskState:
-    """Upgrade a single service within a stack (pull + recreate)."""
+    since = time.time()
+    task.lines.append(f"Recreating {service}...\n")
+    code = await process_service.run_subprocess(
+        compose("up", "-d", "--no-deps", service, host=stack.host), cwd, task, scope=stack.name,
+    )
+    if code == 0:
+        with task.span(f"health {service}", scope=stack.name) as sp:
+            ok, detail = await asyncio.to_thread(
+                docker_service.wait_healthy, stack.host, project, service, since, ROLLING_HEALTH_TIMEOUT,
+            )
+            sp.end("ok" if ok else "failed", detail)
+        task.lines.append(f"  {service}: {detail}\n")
+        if ok:
+            return 0
+
+    if not previous:
+        task.lines.append(f"  {service} had no previous container; nothing to roll back to.\n")
+        return 1
+
+    task.lines.append(f"Rolling back {service} to its previous image...\n")
+    with task.span(f"rollback {service}", scope=stack.name) as sp:
+        try:
+            for c in previous:
+                # Digest-pinned references still resolve to the previous image
+                if c.image_id and c.image_ref and "@" not in c.image_ref:
+                    await asyncio.to_thread(docker_service.tag_image, stack.host, c.image_id, c.image_ref)
+        except Exception as exc:
+            task.lines.append(f"  Could not restore image tag: {exc}\n")
+            sp.end("error", str(exc))
+            return 1
+        rollback = await process_service.run_subprocess(
+            compose("up", "-d", "--no-deps", service, host=stack.host), cwd, task, scope=stack.name,
+        )
+        sp.result(rollback)
+    task.lines.append(
+        f"  {service} rolled back.\n" if rollback == 0 else f"  Rollback of {service} failed.\n"
+    )
+    return 1
+
+
+def _rolling_upgrade_script(stack: stack_service.StackInfo, services: list[str] | None = None) -> ScriptFn:
+    """Build a health-gated rolling upgrade: pull everything, then recreate one service
+    at a time in dependency order, continuing only once it is healthy.
+
+    A service that fails its health check is rolled back to the image it ran before
+    and the remaining services are left untouched.
+    """
+    name = stack.name
+    cwd = stack.path
+
+    async def _script(task: process_service.TaskState) -> int:
+        task.lines.append(f"[{name}] Rolling upgrade...\n")
+        if not await _preflight(stack, task):
+            return 1
+
+        if stack.mode == "pass":
+            if not await _check_pass_session(cwd, task):
+                task.lines.append("Error: pass-cli session not active.\n")
+                return 1
+
+            template = Path(cwd) / ".env.template"
+            if not await _validate_secrets(template, cwd, task):
+                task.lines.append(f"Secret validation failed for {name}. Aborting.\n")
+                return 1
+
+        order = services or stack_service.service_order(stack)
+        project = stack.project
+        compose = _pass_compose_args if stack.mode == "pass" else _compose_args
+
+        code = await _pull(stack, task, *(services or []))
+        if code != 0:
+            task.lines.append(f"[{name}] Pull failed; no container was recreated.\n")
+            return code
+
+        for i, service in enumerate(order):
+            if await _roll_service(stack, project, service, task) != 0:
+                remaining = order[i + 1:]
+                if remaining:
+                    task.lines.append(f"Not upgraded: {', '.join(remaining)}\n")
+                task.lines.append(f"[{name}] Rolling upgrade failed at {service}.\n")
+                return 1
+
+        task.lines.append("Cleaning up old images...\n")
+        await process_service.run_subprocess(_prune_args(stack.host), cwd, task)
+        task.lines.append(f"[{name}] Upgrade complete ({len(order)} service(s) healthy).\n")
+        return 0
+
+    return _script
+
+
+async def upgrade_stack(name: str, rolling: bool = ROLLING_UPGRADE) -> process_service.TaskState:
+    """Upgrade a single stack (pull + recreate all services, or a rolling upgrade)."""
+    stack = stack_service.get_stack(name)
+    if stack is None:
+        return await _error_task(f'Stack "{name}" not found.')
+
+    if rolling:
+        return await process_service.run_script(_rolling_upgrade_script(stack), name, f"rolling upgrade {name}")
+    return await process_service.run_script(_upgrade_script(stack), name, f"upgrade {name}")
+
+
+async def upgrade_service(
+    stack_name: str, service_name: str, rolling: bool = ROLLING_UPGRADE,
+) -> process_service.TaskState:
+    """Upgrade a single service within a stack (pull + recreate, health-gated if rolling)."""
     stack = stack_service.get_stack(stack_name)
     if stack is None:
         return await _error_task(f'Stack "{stack_name}" not found.')
 
-    cwd = _stack_dir(stack_name)
+    if rolling:
+        return await process_service.run_script(
+            _rolling_upgrade_script(stack, [service_name]), stack_name,
+            f"rolling upgrade {stack_name}/{service_name}",
+        )
+
+    cwd = stack.path
 
     async def _script(task: process_service.TaskState) -> int:
         task.lines.append(f"[{stack_name}] Upgrading service '{service_name}'...\n")
+        if not await _preflight(stack, task):
+            return 1
 
-        task.lines.append(f"Pulling image for {service_name}...\n")
-        if stack.mode == "pass":
-            code = await process_service.run_subprocess(
-                _pass_compose_args("pull", service_name), cwd, task,
-                suppress_env_warnings=True,
-            )
-        else:
-            code = await process_service.run_subprocess(
-                _compose_args("pull", service_name), cwd, task,
-                suppress_env_warnings=True,
-            )
+        code = await _pull(stack, task, service_name)
         if code != 0:
             task.lines.append(f"Pull failed for {service_name}.\n")
             return code
@@ -387,17 +724,17 @@ async def upgrade_service(stack_name: str, service_name: str) -> process_service
         task.lines.append(f"Recreating {service_name}...\n")
         if stack.mode == "pass":
             code = await process_service.run_subprocess(
-                _pass_compose_args("up", "-d", service_name), cwd, task,
+                _pass_compose_args("up", "-d", service_name, host=stack.host), cwd, task,
             )
         else:
             code = await process_service.run_subprocess(
-                _compose_args("up", "-d", service_name), cwd, task,
+                _compose_args("up", "-d", service_name, host=stack.host), cwd, task,
             )
 
         if code == 0:
             task.lines.append("Cleaning up old images...\n")
             await process_service.run_subprocess(
-                ["docker", "image", "prune", "-f"], cwd, task,
+                _prune_args(stack.host), cwd, task,
             )
             task.lines.append(f"[{stack_name}/{service_name}] Upgrade complete.\n")
         else:
@@ -407,14 +744,88 @@ async def upgrade_service(stack_name: str, service_name: str) -> process_service
     return await process_service.run_script(_script, stack_name, f"upgrade {stack_name}/{service_name}")
 
 
+async def upgrade_locked(
+    stack: stack_service.StackInfo, task: process_service.TaskState, rolling: bool = ROLLING_UPGRADE,
+) -> int:
+    """Upgrade a stack inside a larger task, under the stack's lock, output prefixed with its name."""
+    script = _rolling_upgrade_script(stack) if rolling else _upgrade_script(stack)
+    return await process_service.run_locked(script, stack.name, process_service.subtask(task, stack.name))
+
+
+BULK_ACTIONS: dict[str, Callable[[stack_service.StackInfo], ScriptFn]] = {
+    "start": _start_script,
+    "stop": _native_stop_script if NATIVE_STOP else _stop_script,
+    "restart": partial(_native_stop_script, restart=True) if NATIVE_STOP else _restart_script,
+    "upgrade": _rolling_upgrade_script if ROLLING_UPGRADE else _upgrade_script,
+    "rolling-upgrade": _rolling_upgrade_script,
+}
+# Bulk actions that bring stacks up and so pre-flight their compose config first
+# (stop and restart don't, like their single-stack versions)
+_PREFLIGHT_ACTIONS = {"start", "upgrade", "rolling-upgrade"}
+
+
+async def bulk_action(action: str, stacks: list[stack_service.StackInfo]) -> process_service.TaskState:
+    """Run one action on several stacks concurrently, into a single prefixed output.
+
+    At most BULK_CONCURRENCY stacks run at once; each still takes its own stack lock.
+    """
+    make_script = BULK_ACTIONS[action]
+
+    async def _script(task: process_service.TaskState) -> int:
+        task.lines.append(
+            f"Running {action} on {len(stacks)} stack(s), up to {BULK_CONCURRENCY} at a time...\n\n"
+        )
+        runnable, invalid = stacks, []
+        if action in _PREFLIGHT_ACTIONS:
+            runnable, invalid = await _skip_invalid(stacks, task)
+        sem = asyncio.Semaphore(BULK_CONCURRENCY)
+
+        async def _one(stack: stack_service.StackInfo) -> int:
+            async with sem:
+                sub = process_service.subtask(task, stack.name)
+                code = await process_service.run_locked(make_script(stack), stack.name, sub)
+                sub.lines.append("OK\n" if code == 0 else f"FAILED (exit {code})\n")
+                return code
+
+        codes = await asyncio.gather(*(_one(s) for s in runnable))
+        failed_names = invalid + [s.name for s, code in zip(runnable, codes) if code != 0]
+
+        task.lines.append("\n=========================\n")
+        task.lines.append(
+            f"Bulk {action} summary: {len(stacks) - len(failed_names)} succeeded, "
+            f"{len(failed_names)} failed\n"
+        )
+        for n in failed_names:
+            task.lines.append(f"  Failed: {n}\n")
+        return 1 if failed_names else 0
+
+    return await process_service.run_script(_script, "__bulk__", f"{action} {len(stacks)} stacks")
+
+
 async def cleanup() -> process_service.TaskState:
     """Remove unused Docker resources (images + containers, but NOT volumes)."""
-    return await process_service.run_command(
-        ["docker", "system", "prune", "--all", "--force"],
-        stack_name="__cleanup__",
-        cwd=DOCKER_APPS_PATH,
-        label="docker system prune",
-    )
+    if len(DOCKER_ENDPOINTS) == 1:
+        return await process_service.run_command(
+            ["docker", *_host_flags(None), "system", "prune", "--all", "--force"],
+            stack_name="__cleanup__",
+            cwd=DOCKER_APPS_PATH,
+            label="docker system prune",
+        )
+
+    async def _script(task: process_service.TaskState) -> int:
+        failed = 0
+        for e in DOCKER_ENDPOINTS:
+            task.lines.append(f"[{e.name}] Pruning unused resources...\n")
+            code = await process_service.run_subprocess(
+                ["docker", *_host_flags(e.name), "system", "prune", "--all", "--force"],
+                DOCKER_APPS_PATH, task, scope=e.name,
+            )
+            if code != 0:
+                task.lines.append(f"[{e.name}] FAILED\n")
+                failed += 1
+        return 1 if failed else 0
+
+    return await process_service.run_script(_script, "__cleanup__", "docker system prune")
 
 
 async def _error_task(message: str) -> process_service.TaskState:
@@ -425,6 +836,7 @@ async def _error_task(message: str) -> process_service.TaskState:
         stack_name="__error__",
     )
     ts.lines.append(f"{message}\n")
+    ts.finished_at = ts.created_at
     ts.done = True
     ts.exit_code = 1
     process_service._tasks[ts.task_id] = ts
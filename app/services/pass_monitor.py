@@ -0,0 +1,138 @@
+"""Background pass-cli session monitor.
+
+Probes ``pass-cli test`` on a schedule and caches the result, so status requests
+never spawn a subprocess. Probes back off while the session is inactive and are
+triggered immediately after a login or a failed check inside an operation.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from app.config import PASS_CHECK_INTERVAL, PASS_CHECK_MAX_INTERVAL, PASS_STATE_TTL
+from app.services import docker_service
+
+# Seconds an inactive verdict is trusted by recheck() without probing again
+_RECHECK_AFTER = 5.0
+
+
+@dataclass
+class SessionState:
+    active: bool = False
+    checked_at: float | None = None  # time.monotonic() of last probe
+    failures: int = 0  # consecutive inactive probes, drives the backoff
+
+    def age(self) -> float | None:
+        return None if self.checked_at is None else time.monotonic() - self.checked_at
+
+
+_state = SessionState()
+_wake: asyncio.Event | None = None
+_loop_task: asyncio.Task | None = None
+_probe_task: asyncio.Task | None = None
+
+
+def _record(active: bool) -> None:
+    _state.active = active
+    _state.checked_at = time.monotonic()
+    _state.failures = 0 if active else _state.failures + 1
+
+
+def record_success() -> None:
+    """Record a successful ``pass-cli test`` run by an operation."""
+    _record(True)
+
+
+def next_delay() -> float:
+    """Seconds until the next scheduled probe (exponential backoff while inactive)."""
+    if _state.active or _state.failures == 0:
+        return PASS_CHECK_INTERVAL
+    return min(PASS_CHECK_INTERVAL * 2 ** (_state.failures - 1), PASS_CHECK_MAX_INTERVAL)
+
+
+async def refresh() -> bool:
+    """Probe pass-cli now and update the cached state."""
+    active = await docker_service.check_pass_cli()
+    _record(active)
+    return active
+
+
+def request_refresh() -> None:
+    """Schedule a probe as soon as possible without waiting for it."""
+    global _probe_task
+    if _loop_task is not None and not _loop_task.done():
+        _wake.set()
+    elif _probe_task is None or _probe_task.done():
+        _probe_task = asyncio.create_task(refresh())
+
+
+def is_active() -> bool:
+    """Return the cached session state; never blocks on a subprocess."""
+    age = _state.age()
+    if age is None or age > PASS_STATE_TTL:
+        request_refresh()
+    return _state.active
+
+
+def known_inactive() -> bool:
+    """True if a recent probe (within one check interval) found no active session."""
+    age = _state.age()
+    return age is not None and age < PASS_CHECK_INTERVAL and not _state.active
+
+
+async def recheck() -> bool:
+    """Probe again before acting on a cached inactive verdict; True if the session is active.
+
+    Concurrent callers share one probe, and a verdict under _RECHECK_AFTER
+    seconds old is trusted as is.
+    """
+    global _probe_task
+    age = _state.age()
+    if age is not None and age < _RECHECK_AFTER:
+        return _state.active
+    if _probe_task is None or _probe_task.done():
+        _probe_task = asyncio.create_task(refresh())
+    try:
+        return await asyncio.shield(_probe_task)
+    except Exception:
+        return False
+
+
+def state() -> dict:
+    age = _state.age()
+    return {
+        "active": _state.active,
+        "checked_ago": round(age, 1) if age is not None else None,
+        "next_check_in": round(next_delay(), 1),
+    }
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await refresh()
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=next_delay())
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+def start() -> None:
+    global _wake, _loop_task
+    _wake = asyncio.Event()
+    _loop_task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _loop_task
+    if _loop_task is not None:
+        _loop_task.cancel()
+        try:
+            await _loop_task
+        except asyncio.CancelledError:
+            pass
+        _loop_task = None
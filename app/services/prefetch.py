@@ -0,0 +1,311 @@
+"""Background image pre-fetch for active stacks.
+
+During the off-peak PREFETCH_WINDOWS, pulls the images of active stacks ahead
+of time so that an upgrade's own pull finds them current and is quick. Each ref is first
+compared with the registry's current digest and only pulled when the local
+copy is missing or outdated. Pulls run PREFETCH_CONCURRENCY at a time and a
+pass stops starting new pulls once PREFETCH_BUDGET_MB of new images were
+pulled or its window closes.
+
+A stack whose refs were all local and current at the last pass is "ready"
+and the dashboard marks it, until its compose file or env files change or the
+result is a day old. Stacks with services whose image can't be resolved
+(${VAR} or build-only) are never ready. This is only a hint: upgrades and
+"Pull images" always pull, since a new tag may have been pushed since the
+pass.
+
+With SHARED_STATE_DIR, one worker at a time runs a pass and stores its state
+and results in the shared state database, where the other workers load them
+from, so every worker shows the same badges.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from datetime import time as dtime
+from pathlib import Path
+
+from app.config import (
+    PREFETCH_BUDGET_MB,
+    PREFETCH_CONCURRENCY,
+    PREFETCH_INTERVAL,
+    PREFETCH_WINDOWS,
+)
+from app.metrics import SHARED_STATE_ERRORS
+from app.services import docker_service, shared_state, stack_service
+
+# How long a stack stays marked ready after the pass that found its images current
+_READY_MAX_AGE = 24 * 3600
+# How often the scheduler checks whether a pass is due
+_TICK = 60
+_LOCK = "__prefetch__"
+_RESULT = "prefetch"
+# Seconds between checks for results of a pass another worker ran
+_REFRESH_INTERVAL = 2.0
+
+
+def parse_windows(value: str) -> list[tuple[dtime, dtime]]:
+    """Parse "HH:MM-HH:MM,..." into (start, end) pairs; a window may wrap past midnight."""
+    windows = []
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        try:
+            start, end = (dtime.fromisoformat(t.strip()) for t in part.split("-"))
+        except ValueError:
+            raise SystemExit(f"Invalid PREFETCH_WINDOWS entry {part!r}, expected HH:MM-HH:MM")
+        windows.append((start, end))
+    return windows
+
+
+WINDOWS = parse_windows(PREFETCH_WINDOWS)
+
+
+def in_window(now: datetime | None = None) -> bool:
+    t = (now or datetime.now()).time()
+    for start, end in WINDOWS:
+        if (start <= t < end) if start <= end else (t >= start or t < end):
+            return True
+    return False
+
+
+@dataclass
+class StackPrefetch:
+    checked_at: float  # wall-clock time of the pass
+    files_mtime: tuple[float, ...]  # compose file, .env, .env.template
+    refs: dict[str, str] = field(default_factory=dict)  # ref -> "current" | "pulled" | "failed" | ...
+    unresolved: list[str] = field(default_factory=list)  # services whose image couldn't be checked
+    pulled_bytes: int = 0
+
+    @property
+    def ready(self) -> bool:
+        return (
+            bool(self.refs) and not self.unresolved
+            and all(v in ("current", "pulled") for v in self.refs.values())
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "checked_at": self.checked_at,
+            "ready": self.ready,
+            "refs": self.refs,
+            "unresolved": self.unresolved,
+            "pulled_bytes": self.pulled_bytes,
+        }
+
+
+@dataclass
+class PassState:
+    started_at: float | None = None
+    finished_at: float | None = None
+    running: bool = False
+    pulled_bytes: int = 0
+    pulls: int = 0
+    stopped: str = ""  # why the last pass ended early: "budget" or "window"
+
+
+_stacks: dict[str, StackPrefetch] = {}
+_pass = PassState()
+_prefetching = False  # this worker is running a pass
+_synced_at = 0.0  # updated_at of the shared results last stored or loaded
+_checked_at = 0.0
+_loop_task: asyncio.Task | None = None
+_pass_task: asyncio.Task | None = None
+
+
+def _files_mtime(stack: stack_service.StackInfo) -> tuple[float, ...]:
+    mtimes = []
+    for name in (stack.compose_file, ".env", ".env.template"):
+        try:
+            mtimes.append((Path(stack.path) / name).stat().st_mtime)
+        except OSError:
+            mtimes.append(0.0)
+    return tuple(mtimes)
+
+
+def is_ready(stack: stack_service.StackInfo) -> bool:
+    """True if all the stack's images were pre-pulled and its compose/env files are unchanged since."""
+    rec = _stacks.get(stack.name)
+    return (
+        rec is not None and rec.ready
+        and time.time() - rec.checked_at < _READY_MAX_AGE
+        and rec.files_mtime == _files_mtime(stack)
+    )
+
+
+def _budget_left() -> bool:
+    return PREFETCH_BUDGET_MB <= 0 or _pass.pulled_bytes < PREFETCH_BUDGET_MB * 2**20
+
+
+async def _prefetch_stack(
+    stack: stack_service.StackInfo, sem: asyncio.Semaphore, respect_window: bool,
+) -> None:
+    refs, unresolved = stack_service.image_refs(stack)
+    rec = StackPrefetch(checked_at=time.time(), files_mtime=_files_mtime(stack), unresolved=unresolved)
+    for ref in refs:
+        async with sem:
+            try:
+                local_id, current = await asyncio.to_thread(docker_service.image_status, stack.host, ref)
+            except Exception:
+                rec.refs[ref] = "failed"
+                continue
+            if current:
+                rec.refs[ref] = "current"
+                continue
+            if current is None:
+                # Registry unreachable: keep the local image, but don't claim it is current
+                rec.refs[ref] = "unknown"
+                continue
+            if not _budget_left():
+                rec.refs[ref] = "skipped"
+                _pass.stopped = "budget"
+                continue
+            if respect_window and not in_window():
+                rec.refs[ref] = "skipped"
+                _pass.stopped = "window"
+                continue
+            try:
+                new_id, size = await asyncio.to_thread(docker_service.pull_image, stack.host, ref)
+            except Exception:
+                rec.refs[ref] = "failed"
+                continue
+            _pass.pulls += 1
+            if new_id != local_id:
+                rec.pulled_bytes += size
+                _pass.pulled_bytes += size
+            rec.refs[ref] = "pulled"
+    _stacks[stack.name] = rec
+
+
+async def _publish() -> None:
+    """Store this worker's pass state and results for the other workers."""
+    global _synced_at
+    if not shared_state.enabled():
+        return
+    now = time.time()
+    data = {"pass": asdict(_pass), "stacks": {name: asdict(rec) for name, rec in _stacks.items()}}
+    try:
+        await asyncio.to_thread(shared_state.save_result, _RESULT, now, data)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("write")
+        return
+    _synced_at = now
+
+
+async def refresh(force: bool = False) -> None:
+    """Load the results of a pass another worker ran, checking at most every _REFRESH_INTERVAL."""
+    global _pass, _stacks, _synced_at, _checked_at
+    if not shared_state.enabled() or _prefetching:
+        return
+    now = time.monotonic()
+    if not force and now - _checked_at < _REFRESH_INTERVAL:
+        return
+    _checked_at = now
+    try:
+        stored = await asyncio.to_thread(shared_state.load_result, _RESULT, _synced_at)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("read")
+        return
+    if stored is None or _prefetching:
+        return
+    _synced_at, data = stored
+    _pass = PassState(**data["pass"])
+    _stacks = {
+        name: StackPrefetch(**{**rec, "files_mtime": tuple(rec["files_mtime"])})
+        for name, rec in data["stacks"].items()
+    }
+
+
+def _running() -> bool:
+    # a pass stored as running whose worker died no longer holds the lock
+    return _prefetching or (_pass.running and shared_state.is_locked(_LOCK))
+
+
+async def run_pass(respect_window: bool = True, claim: shared_state.StackLock | None = None) -> None:
+    """Check and pre-pull the images of every active stack.
+
+    `claim` is the pass lock if the caller already took it; otherwise the pass
+    is skipped while another one runs.
+    """
+    global _pass, _prefetching
+    # With several workers only one of them runs a pass at a time
+    claim = claim or shared_state.try_lock(_LOCK)
+    if claim is None or _prefetching:
+        if claim is not None:
+            claim.release()
+        return
+    try:
+        await refresh(force=True)
+        _prefetching = True
+        _pass = PassState(started_at=time.time(), running=True)
+        await _publish()
+        stacks = [s for s in await asyncio.to_thread(stack_service.list_stacks) if s.active]
+        sem = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        await asyncio.gather(*(_prefetch_stack(s, sem, respect_window) for s in stacks))
+        for name in set(_stacks) - {s.name for s in stacks}:
+            del _stacks[name]
+    finally:
+        if _prefetching:
+            _pass.running = False
+            _pass.finished_at = time.time()
+            _prefetching = False
+            await _publish()
+        claim.release()
+
+
+def request_pass() -> bool:
+    """Start a pass now, outside the windows; False if one is already running (in any worker)."""
+    global _pass_task
+    if _running() or (_pass_task is not None and not _pass_task.done()):
+        return False
+    claim = shared_state.try_lock(_LOCK)
+    if claim is None:
+        return False
+    _pass_task = asyncio.create_task(run_pass(respect_window=False, claim=claim))
+    return True
+
+
+def state() -> dict:
+    return {
+        "windows": [f"{s:%H:%M}-{e:%H:%M}" for s, e in WINDOWS],
+        "in_window": in_window(),
+        "running": _running(),
+        "last_pass": {
+            "started_at": _pass.started_at,
+            "finished_at": _pass.finished_at,
+            "pulls": _pass.pulls,
+            "pulled_bytes": _pass.pulled_bytes,
+            "stopped": _pass.stopped or None,
+        },
+        "stacks": {name: rec.to_dict() for name, rec in sorted(_stacks.items())},
+    }
+
+
+async def _run() -> None:
+    last = 0.0
+    while True:
+        if in_window() and time.time() - last >= PREFETCH_INTERVAL:
+            last = time.time()
+            try:
+                await run_pass()
+            except Exception:
+                pass
+        await asyncio.sleep(_TICK)
+
+
+def start() -> None:
+    global _loop_task
+    if WINDOWS:
+        _loop_task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _loop_task, _pass_task
+    for task in (_loop_task, _pass_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+    _loop_task = _pass_task = None
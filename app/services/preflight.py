@@ -0,0 +1,128 @@
+"""Pre-flight validation of stack definitions with ``docker compose config -q``.
+
+Verdicts are cached per stack, keyed on a hash of the compose file and the
+stack's env files (.env, .env.template), so a stack is only validated again
+after one of them changes. Operations check the verdict before the pass-cli
+session check and pulls, and bulk operations leave invalid stacks out upfront.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from app.config import PREFLIGHT_CONCURRENCY
+from app.metrics import SUBPROCESS_SECONDS
+from app.services import capabilities, stack_service
+
+# Seconds `compose config` may take for one stack
+_TIMEOUT = 30.0
+_ENV_FILES = (".env", ".env.template")
+
+
+@dataclass
+class Verdict:
+    valid: bool | None  # None: could not be checked (compose missing, timeout)
+    error: str
+    digest: str
+    checked_at: float
+    seconds: float
+
+    def to_dict(self) -> dict:
+        return {
+            "valid": self.valid,
+            "error": self.error or None,
+            "checked_at": self.checked_at,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+_verdicts: dict[str, Verdict] = {}
+
+
+def _digest(stack: stack_service.StackInfo) -> str:
+    h = hashlib.sha256()
+    for name in (stack.compose_file, *_ENV_FILES):
+        h.update(name.encode() + b"\0")
+        try:
+            h.update((Path(stack.path) / name).read_bytes())
+        except OSError:
+            h.update(b"\1missing")
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _config_args(stack: stack_service.StackInfo) -> list[str]:
+    # pass:// references stay unresolved: only structure and interpolation are checked
+    env_args = ["--env-file", ".env.template"] if stack.mode == "pass" else []
+    return [*capabilities.compose_cmd(), *env_args, "config", "-q"]
+
+
+async def _run_config(stack: stack_service.StackInfo) -> tuple[bool | None, str]:
+    try:
+        with SUBPROCESS_SECONDS.time("compose-config"):
+            proc = await asyncio.create_subprocess_exec(
+                *_config_args(stack),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=stack.path,
+            )
+            try:
+                _, err = await asyncio.wait_for(proc.communicate(), _TIMEOUT)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return None, f"compose config timed out after {_TIMEOUT:g}s"
+    except OSError as e:
+        return None, str(e)
+    if proc.returncode == 0:
+        return True, ""
+    lines = [l.strip() for l in err.decode("utf-8", errors="replace").splitlines() if l.strip()]
+    return False, lines[-1] if lines else f"compose config exited with {proc.returncode}"
+
+
+async def validate(stack: stack_service.StackInfo) -> tuple[Verdict, bool]:
+    """Return (verdict, whether it came from the cache)."""
+    digest = await asyncio.to_thread(_digest, stack)
+    cached = _verdicts.get(stack.name)
+    if cached is not None and cached.digest == digest:
+        return cached, True
+    start = time.perf_counter()
+    valid, error = await _run_config(stack)
+    verdict = Verdict(valid, error, digest, time.time(), time.perf_counter() - start)
+    if valid is not None:
+        _verdicts[stack.name] = verdict
+    return verdict, False
+
+
+async def validate_all(
+    stacks: list[stack_service.StackInfo], prune: bool = False,
+) -> tuple[dict[str, Verdict], int]:
+    """Validate stacks concurrently (PREFLIGHT_CONCURRENCY at a time).
+
+    Returns ({name: verdict}, number of stacks that actually ran compose config).
+    With `prune`, `stacks` is the whole inventory and other verdicts are dropped.
+    """
+    sem = asyncio.Semaphore(PREFLIGHT_CONCURRENCY)
+
+    async def _one(stack: stack_service.StackInfo) -> tuple[Verdict, bool]:
+        async with sem:
+            return await validate(stack)
+
+    results = await asyncio.gather(*(_one(s) for s in stacks))
+    if prune:
+        for name in set(_verdicts) - {s.name for s in stacks}:
+            _verdicts.pop(name, None)
+    return {s.name: v for s, (v, _) in zip(stacks, results)}, sum(1 for _, cached in results if not cached)
+
+
+def verdict(name: str) -> dict | None:
+    """The stack's last cached verdict, or None if it wasn't validated yet."""
+    v = _verdicts.get(name)
+    return v.to_dict() if v else None
+
+
+def state() -> dict:
+    return {name: v.to_dict() for name, v in sorted(_verdicts.items())}
@@ -4,8 +4,13 @@ import asyncio
 import re
 import time
 import uuid
-from dataclasses import dataclass, field
-from typing import Callable, Awaitable
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Awaitable, Iterator
+
+from app import metrics
+from app.metrics import SHARED_STATE_ERRORS, STACK_BUSY_REJECTED, SUBPROCESS_SECONDS
+from app.services import shared_state
 
 ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
 # Docker Compose warnings about unset env vars (expected for pass mode stacks)
@@ -21,6 +26,43 @@ _tasks: dict[str, "TaskState"] = {}
 _TASK_MAX_AGE = 3600  # 1 hour
 _TASK_MAX_COUNT = 200
 
+# Shared state (SHARED_STATE_DIR): how often local tasks are written out, and
+# the last written (lines, spans, ended spans, done) per task
+_FLUSH_INTERVAL = 0.05
+_PRUNE_INTERVAL = 60
+_flushed: dict[str, tuple[int, int, int, bool]] = {}
+_flush_task: asyncio.Task | None = None
+
+
+@dataclass
+class Span:
+    """One timed step of a task (e.g. pass-cli test, compose pull)."""
+    name: str
+    scope: str  # stack the step belongs to
+    started_at: float = field(default_factory=time.time)
+    ended_at: float | None = None
+    outcome: str = "running"  # running | ok | failed | error | skipped
+    detail: str = ""
+
+    def end(self, outcome: str = "ok", detail: str | None = None) -> None:
+        self.ended_at = time.time()
+        self.outcome = outcome
+        if detail is not None:
+            self.detail = detail
+
+    def result(self, code: int) -> None:
+        """End the span from a process exit code."""
+        self.end("ok" if code == 0 else "failed", None if code == 0 else f"exit {code}")
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.ended_at is None else self.ended_at - self.started_at
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["duration"] = round(self.duration, 3) if self.duration is not None else None
+        return d
+
 
 @dataclass
 class TaskState:
@@ -31,6 +73,59 @@ class TaskState:
     done: bool = False
     exit_code: int | None = None
     created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    spans: list[Span] = field(default_factory=list)
+
+    @contextmanager
+    def span(self, name: str, scope: str | None = None) -> Iterator[Span]:
+        """Record a step; ends as "ok" unless the block ends it or raises."""
+        sp = Span(name=name, scope=scope or self.stack_name)
+        self.spans.append(sp)
+        try:
+            yield sp
+        except BaseException as exc:
+            sp.end("error", str(exc))
+            raise
+        if sp.ended_at is None:
+            sp.end()
+
+    def to_dict(self) -> dict:
+        end = self.finished_at if self.done else None
+        return {
+            "task_id": self.task_id,
+            "command": self.command,
+            "stack_name": self.stack_name,
+            "done": self.done,
+            "exit_code": self.exit_code,
+            "created_at": self.created_at,
+            "finished_at": end,
+            "duration": round(end - self.created_at, 3) if end else None,
+            "lines": len(self.lines),
+            "spans": [sp.to_dict() for sp in self.spans],
+        }
+
+
+class PrefixedLines(list):
+    """Stand-in for TaskState.lines that forwards each line to another list with a prefix."""
+
+    def __init__(self, target: list[str], prefix: str) -> None:
+        super().__init__()
+        self._target = target
+        self._prefix = prefix
+
+    def append(self, text: str) -> None:
+        self._target.append(text if text.startswith(self._prefix) else self._prefix + text)
+
+
+def subtask(parent: TaskState, stack_name: str) -> TaskState:
+    """Return a TaskState view whose output lands in parent, prefixed with [stack_name]."""
+    return TaskState(
+        task_id=parent.task_id,
+        command=parent.command,
+        stack_name=stack_name,
+        lines=PrefixedLines(parent.lines, f"[{stack_name}] "),
+        spans=parent.spans,
+    )
 
 
 def _get_lock(stack_name: str) -> asyncio.Lock:
@@ -39,6 +134,27 @@ def _get_lock(stack_name: str) -> asyncio.Lock:
     return _stack_locks[stack_name]
 
 
+def _claim(stack_name: str) -> shared_state.StackLock | None:
+    """Take the stack's cross-worker lock, or None if the stack is busy in any worker."""
+    claim = None if _get_lock(stack_name).locked() else shared_state.try_lock(stack_name)
+    if claim is None:
+        STACK_BUSY_REJECTED.inc()
+    return claim
+
+
+@asynccontextmanager
+async def _held(lock: asyncio.Lock, claim: shared_state.StackLock):
+    """Hold lock (free, as the stack was claimed); releases the cross-worker claim with it."""
+    try:
+        await lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+    finally:
+        claim.release()
+
+
 def _cleanup_tasks() -> None:
     """Remove old completed tasks to prevent memory leaks."""
     now = time.time()
@@ -48,6 +164,7 @@ def _cleanup_tasks() -> None:
     ]
     for tid in to_remove:
         del _tasks[tid]
+        _flushed.pop(tid, None)
 
     # If still too many, remove oldest completed tasks
     if len(_tasks) > _TASK_MAX_COUNT:
@@ -58,6 +175,7 @@ def _cleanup_tasks() -> None:
         excess = len(_tasks) - _TASK_MAX_COUNT
         for tid, _ in completed[:excess]:
             del _tasks[tid]
+            _flushed.pop(tid, None)
 
 
 def _busy_task(stack_name: str, label: str) -> TaskState:
@@ -68,54 +186,259 @@ def _busy_task(stack_name: str, label: str) -> TaskState:
         stack_name=stack_name,
     )
     ts.lines.append(f"Operation '{stack_name}' is already running.\n")
+    ts.finished_at = ts.created_at
     ts.done = True
     ts.exit_code = 1
     _tasks[ts.task_id] = ts
     return ts
 
 
+_COMPOSE_KINDS = ("pull", "up", "down")
+
+
+def command_kind(args: list[str]) -> str:
+    """Classify a command line for metrics: pull, up, down, prune, pass-cli, git or other."""
+    if not args:
+        return "other"
+    if args[0] == "git":
+        return "git"
+    if "prune" in args:
+        return "prune"
+    # pass-cli run ... -- docker compose <cmd>: classify by the wrapped compose command
+    for kind in _COMPOSE_KINDS:
+        if kind in args:
+            return kind
+    if args[0] == "pass-cli":
+        return "pass-cli"
+    return "other"
+
+
+def step_name(args: list[str]) -> str:
+    """Human-readable span name for a command line, e.g. "compose pull" or "pass-cli test"."""
+    kind = command_kind(args)
+    if kind in _COMPOSE_KINDS:
+        return f"compose {kind}"
+    if kind == "pass-cli" and len(args) > 1:
+        return f"pass-cli {args[1]}"
+    if kind == "git":
+        return "git pull" if "pull" in args else "git"
+    if kind == "prune":
+        return "image prune" if "image" in args else "system prune"
+    return args[0] if args else kind
+
+
+def _collect_task_metrics():
+    running = sum(1 for t in _tasks.values() if not t.done)
+    buffered = sum(len(line) for t in _tasks.values() for line in t.lines)
+    yield ("stack_manager_tasks", "gauge", "Tasks in the in-memory task store.", {"state": "running"}, running)
+    yield ("stack_manager_tasks", "gauge", "Tasks in the in-memory task store.", {"state": "done"}, len(_tasks) - running)
+    yield ("stack_manager_task_output_bytes", "gauge", "Output characters buffered across all tasks.", {}, buffered)
+    yield ("stack_manager_stack_locks_held", "gauge", "Per-stack locks currently held.", {},
+           sum(1 for lock in _stack_locks.values() if lock.locked()))
+
+
+metrics.register_collector(_collect_task_metrics)
+
+
 def get_task(task_id: str) -> TaskState | None:
+    """Return a task started by this worker."""
     return _tasks.get(task_id)
 
 
+def local_tasks() -> list[TaskState]:
+    """Tasks started by this worker that are still kept in memory."""
+    return list(_tasks.values())
+
+
+async def find_task(task_id: str) -> TaskState | None:
+    """Return a task started by any worker (a snapshot if another worker owns it)."""
+    ts = _tasks.get(task_id)
+    if ts is not None or not shared_state.enabled():
+        return ts
+    rec, lines = await asyncio.to_thread(shared_state.read_since, task_id, 0)
+    return None if rec is None else task_from_record(rec, lines)
+
+
+_SPAN_FIELDS = ("name", "scope", "started_at", "ended_at", "outcome", "detail")
+
+
+def task_from_record(rec: dict, lines: list[str]) -> TaskState:
+    return TaskState(
+        task_id=rec["task_id"],
+        command=rec["command"],
+        stack_name=rec["stack_name"],
+        lines=lines,
+        done=rec["done"],
+        exit_code=rec["exit_code"],
+        created_at=rec["created_at"],
+        finished_at=rec["finished_at"],
+        spans=[Span(**{k: sp[k] for k in _SPAN_FIELDS}) for sp in rec["spans"]],
+    )
+
+
 def is_stack_busy(stack_name: str) -> bool:
     lock = _stack_locks.get(stack_name)
-    return lock is not None and lock.locked()
+    if lock is not None and lock.locked():
+        return True
+    return shared_state.is_locked(stack_name)
+
+
+# --- Shared state flushing ----------------------------------------------------------
+
+def _pending_writes() -> list[tuple[tuple, dict, int, list[str]]]:
+    """Snapshot (on the event loop) what changed in local tasks since the last flush."""
+    batch = []
+    for ts in list(_tasks.values()):
+        sig = (len(ts.lines), len(ts.spans), sum(sp.ended_at is not None for sp in ts.spans), ts.done)
+        prev = _flushed.get(ts.task_id)
+        if sig == prev:
+            continue
+        start = prev[0] if prev else 0
+        record = {
+            "task_id": ts.task_id,
+            "command": ts.command,
+            "stack_name": ts.stack_name,
+            "done": ts.done,
+            "exit_code": ts.exit_code,
+            "created_at": ts.created_at,
+            "finished_at": ts.finished_at,
+            "lines": sig[0],
+            "spans": [sp.to_dict() for sp in ts.spans],
+        }
+        batch.append((sig, record, start, ts.lines[start:sig[0]]))
+    return batch
+
+
+async def flush() -> None:
+    """Write new output and state of this worker's tasks to the shared store."""
+    batch = _pending_writes()
+    if not batch:
+        return
+
+    def _write() -> None:
+        for _, record, start, lines in batch:
+            shared_state.save_task(record, start, lines)
+
+    try:
+        await asyncio.to_thread(_write)
+    except Exception:
+        SHARED_STATE_ERRORS.inc("write")
+        return
+    for sig, record, _, _ in batch:
+        _flushed[record["task_id"]] = sig
+
+
+async def _flush_loop() -> None:
+    last_prune = 0.0
+    while True:
+        await asyncio.sleep(_FLUSH_INTERVAL)
+        await flush()
+        now = time.time()
+        if now - last_prune > _PRUNE_INTERVAL:
+            last_prune = now
+            try:
+                await asyncio.to_thread(shared_state.prune, now - _TASK_MAX_AGE, _TASK_MAX_COUNT)
+            except Exception:
+                SHARED_STATE_ERRORS.inc("prune")
+
+
+def start() -> None:
+    global _flush_task
+    if shared_state.enabled():
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop() -> None:
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+        await flush()
 
 
 async def run_subprocess(
-    args: list[str], cwd: str, task: TaskState, *, suppress_env_warnings: bool = False,
+    args: list[str], cwd: str, task: TaskState, *,
+    suppress_env_warnings: bool = False, scope: str | None = None,
+) -> int:
+    """Run a subprocess, streaming output into an existing TaskState. Returns exit code.
+
+    The run is recorded as a span on the task (scope defaults to the task's stack).
+    """
+    with task.span(step_name(args), scope=scope) as sp:
+        code = await _run_subprocess(args, cwd, task, suppress_env_warnings)
+        sp.result(code)
+    return code
+
+
+async def _run_subprocess(
+    args: list[str], cwd: str, task: TaskState, suppress_env_warnings: bool,
 ) -> int:
-    """Run a subprocess, streaming output into an existing TaskState. Returns exit code."""
     try:
-        proc = await asyncio.create_subprocess_exec(
-            *args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-            cwd=cwd,
-        )
-        while True:
-            line = await proc.stdout.readline()
-            if not line:
-                break
-            text = ANSI_RE.sub("", line.decode("utf-8", errors="replace"))
-            if suppress_env_warnings and _BLANK_STRING_RE.match(text.strip()):
-                continue
-            task.lines.append(text)
-        await proc.wait()
+        with SUBPROCESS_SECONDS.time(command_kind(args)):
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=cwd,
+            )
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                text = ANSI_RE.sub("", line.decode("utf-8", errors="replace"))
+                if suppress_env_warnings and _BLANK_STRING_RE.match(text.strip()):
+                    continue
+                task.lines.append(text)
+            await proc.wait()
         return proc.returncode
     except Exception as exc:
         task.lines.append(f"Error: {exc}\n")
         return 1
 
 
-async def run_command(args: list[str], stack_name: str, cwd: str, label: str = "") -> TaskState:
-    """Run a single command asynchronously, streaming output into a TaskState."""
+async def run_locked(
+    script_fn: Callable[[TaskState], Awaitable[int]],
+    stack_name: str,
+    task: TaskState,
+) -> int:
+    """Run script_fn into an existing TaskState while holding the stack's lock.
+
+    Used to run per-stack steps inside a larger task; fails fast if the stack is busy.
+    """
+    claim = _claim(stack_name)
+    if claim is None:
+        task.lines.append(f"Operation '{stack_name}' is already running.\n")
+        return 1
+
+    async with _held(_get_lock(stack_name), claim):
+        try:
+            return await script_fn(task)
+        except Exception as exc:
+            task.lines.append(f"Error: {exc}\n")
+            return 1
+
+
+async def run_command(
+    args: list[str],
+    stack_name: str,
+    cwd: str,
+    label: str = "",
+    on_done: Callable[[TaskState], object] | None = None,
+) -> TaskState:
+    """Run a single command asynchronously, streaming output into a TaskState.
+
+    on_done, if given, is called with the finished TaskState.
+    """
     _cleanup_tasks()
 
-    lock = _get_lock(stack_name)
-    if lock.locked():
+    claim = _claim(stack_name)
+    if claim is None:
         return _busy_task(stack_name, label or " ".join(args))
+    lock = _get_lock(stack_name)
 
     task_id = str(uuid.uuid4())
     ts = TaskState(
@@ -126,9 +449,12 @@ async def run_command(args: list[str], stack_name: str, cwd: str, label: str = "
     _tasks[task_id] = ts
 
     async def _run():
-        async with lock:
+        async with _held(lock, claim):
             ts.exit_code = await run_subprocess(args, cwd, ts)
+            ts.finished_at = time.time()
             ts.done = True
+        if on_done is not None:
+            on_done(ts)
 
     asyncio.create_task(_run())
     await asyncio.sleep(0.05)
@@ -146,9 +472,10 @@ async def run_script(
     """
     _cleanup_tasks()
 
-    lock = _get_lock(stack_name)
-    if lock.locked():
+    claim = _claim(stack_name)
+    if claim is None:
         return _busy_task(stack_name, label)
+    lock = _get_lock(stack_name)
 
     task_id = str(uuid.uuid4())
     ts = TaskState(
@@ -159,13 +486,14 @@ async def run_script(
     _tasks[task_id] = ts
 
     async def _run():
-        async with lock:
+        async with _held(lock, claim):
             try:
                 ts.exit_code = await script_fn(ts)
             except Exception as exc:
                 ts.lines.append(f"Error: {exc}\n")
                 ts.exit_code = 1
             finally:
+                ts.finished_at = time.time()
                 ts.done = True
 
     asyncio.create_task(_run())
@@ -0,0 +1,266 @@
+"""Task and lock state shared between uvicorn workers on one host.
+
+Enabled by SHARED_STATE_DIR. Task records and output lines live in a SQLite
+database in WAL mode (readers never block the writer), written only by the
+worker that owns the task, next to the latest results of background jobs
+that only one worker runs at a time. Per-stack locks are ``flock`` locks on files in the
+same directory, released by the kernel if a worker dies.
+
+Without SHARED_STATE_DIR every function is a cheap no-op and state stays in
+process memory, as with a single worker.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from app.config import SHARED_STATE_DIR
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id     TEXT PRIMARY KEY,
+    command     TEXT NOT NULL,
+    stack_name  TEXT NOT NULL,
+    pid         INTEGER NOT NULL,
+    done        INTEGER NOT NULL DEFAULT 0,
+    exit_code   INTEGER,
+    created_at  REAL NOT NULL,
+    finished_at REAL,
+    lines       INTEGER NOT NULL DEFAULT 0,
+    spans       TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS task_lines (
+    task_id TEXT NOT NULL,
+    seq     INTEGER NOT NULL,
+    text    TEXT NOT NULL,
+    PRIMARY KEY (task_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at);
+CREATE TABLE IF NOT EXISTS results (
+    name       TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    data       TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return bool(SHARED_STATE_DIR)
+
+
+def _conn() -> sqlite3.Connection:
+    """Per-thread connection (writes come from a worker thread, reads from others)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        root = Path(SHARED_STATE_DIR)
+        (root / "locks").mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(root / "state.db", timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+# --- Tasks ------------------------------------------------------------------------
+
+def save_task(record: dict, start: int, new_lines: list[str]) -> None:
+    """Upsert a task record and append its output lines from index `start`."""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """INSERT INTO tasks (task_id, command, stack_name, pid, done, exit_code,
+                                  created_at, finished_at, lines, spans)
+               VALUES (:task_id, :command, :stack_name, :pid, :done, :exit_code,
+                       :created_at, :finished_at, :lines, :spans)
+               ON CONFLICT (task_id) DO UPDATE SET
+                   done = excluded.done, exit_code = excluded.exit_code,
+                   finished_at = excluded.finished_at, lines = excluded.lines,
+                   spans = excluded.spans""",
+            {**record, "pid": os.getpid(), "spans": json.dumps(record["spans"])},
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO task_lines (task_id, seq, text) VALUES (?, ?, ?)",
+            ((record["task_id"], start + i, text) for i, text in enumerate(new_lines)),
+        )
+
+
+def _record(row: sqlite3.Row | tuple | None) -> dict | None:
+    if row is None:
+        return None
+    keys = ("task_id", "command", "stack_name", "pid", "done", "exit_code",
+            "created_at", "finished_at", "lines", "spans")
+    rec = dict(zip(keys, row))
+    rec["done"] = bool(rec["done"])
+    rec["spans"] = json.loads(rec["spans"])
+    return rec
+
+
+def load_task(task_id: str) -> dict | None:
+    row = _conn().execute(
+        "SELECT task_id, command, stack_name, pid, done, exit_code, created_at, finished_at,"
+        " lines, spans FROM tasks WHERE task_id = ?", (task_id,),
+    ).fetchone()
+    return _record(row)
+
+
+def read_since(task_id: str, start: int) -> tuple[dict | None, list[str]]:
+    """Return (task record, output lines from index `start`) as one consistent snapshot."""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN")
+        rec = load_task(task_id)
+        lines = [r[0] for r in conn.execute(
+            "SELECT text FROM task_lines WHERE task_id = ? AND seq >= ? ORDER BY seq",
+            (task_id, start),
+        )] if rec else []
+    return rec, lines
+
+
+def read_lines(task_id: str, start: int, limit: int) -> list[str]:
+    """Up to `limit` output lines of a task from index `start`."""
+    return [r[0] for r in _conn().execute(
+        "SELECT text FROM task_lines WHERE task_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+        (task_id, start, limit),
+    )]
+
+
+def tasks_between(since: float, until: float) -> list[dict]:
+    """Records of the tasks created in [since, until), oldest first."""
+    rows = _conn().execute(
+        "SELECT task_id, command, stack_name, pid, done, exit_code, created_at, finished_at,"
+        " lines, spans FROM tasks WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+        (since, until),
+    ).fetchall()
+    return [_record(r) for r in rows]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _start_time(pid: int) -> str | None:
+    """The process's start time in clock ticks since boot (/proc/<pid>/stat field 22), if known."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return None
+    return stat.rpartition(")")[2].split()[19]
+
+
+def owner_alive(rec: dict) -> bool:
+    """Whether the worker that owns an unfinished task is still running."""
+    return _pid_alive(rec["pid"])
+
+
+def prune(before: float, keep: int) -> None:
+    """Drop finished tasks created before `before`, and all but the newest `keep` finished ones."""
+    conn = _conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        expired = [r[0] for r in conn.execute(
+            """SELECT task_id FROM tasks WHERE done AND (created_at < ? OR task_id NOT IN (
+                   SELECT task_id FROM tasks WHERE done ORDER BY created_at DESC LIMIT ?))""",
+            (before, keep),
+        )]
+        conn.executemany("DELETE FROM task_lines WHERE task_id = ?", ((t,) for t in expired))
+        conn.executemany("DELETE FROM tasks WHERE task_id = ?", ((t,) for t in expired))
+
+
+# --- Results ----------------------------------------------------------------------
+
+def save_result(name: str, updated_at: float, data: dict) -> None:
+    """Store the latest result of a background job (e.g. a disk usage pass) for every worker."""
+    _conn().execute(
+        "INSERT OR REPLACE INTO results (name, updated_at, data) VALUES (?, ?, ?)",
+        (name, updated_at, json.dumps(data)),
+    )
+
+
+def load_result(name: str, newer_than: float = 0.0) -> tuple[float, dict] | None:
+    """(updated_at, data) of a stored result, or None if there is none newer than `newer_than`."""
+    row = _conn().execute(
+        "SELECT updated_at, data FROM results WHERE name = ? AND updated_at > ?", (name, newer_than),
+    ).fetchone()
+    return None if row is None else (row[0], json.loads(row[1]))
+
+
+def load_results(prefix: str) -> dict[str, dict]:
+    """{name: data} of the stored results whose name starts with `prefix`."""
+    rows = _conn().execute(
+        "SELECT name, data FROM results WHERE substr(name, 1, ?) = ?", (len(prefix), prefix),
+    ).fetchall()
+    return {name: json.loads(data) for name, data in rows}
+
+
+# --- Stack locks ------------------------------------------------------------------
+
+class StackLock:
+    """A held ``flock`` on <SHARED_STATE_DIR>/locks/<name>.lock.
+
+    While held, the file contains the holder's pid and start time, so
+    is_locked() can check it without taking the lock.
+    """
+
+    __slots__ = ("_fd",)
+
+    def __init__(self, fd: int | None) -> None:
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.ftruncate(self._fd, 0)
+            os.close(self._fd)  # closing the descriptor drops the flock
+            self._fd = None
+
+
+def _lock_path(name: str) -> Path:
+    return Path(SHARED_STATE_DIR) / "locks" / f"{name}.lock"
+
+
+def try_lock(name: str) -> StackLock | None:
+    """Take the cross-worker lock for a stack without waiting; None if another holder has it."""
+    if not enabled():
+        return StackLock(None)
+    _conn()  # ensures the locks directory exists
+    fd = os.open(_lock_path(name), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, f"{os.getpid()} {_start_time(os.getpid()) or ''}".encode(), 0)
+    return StackLock(fd)
+
+
+def is_locked(name: str) -> bool:
+    """Whether any worker (including this one) holds the stack's lock.
+
+    Reads the holder's pid from the lock file instead of probing the lock, so
+    it never makes a concurrent try_lock fail. A worker that died holding the
+    lock left its pid behind, but the kernel released the lock: that pid is
+    no longer running, or was reused by a process started at another time.
+    """
+    if not enabled():
+        return False
+    try:
+        pid, _, started = _lock_path(name).read_text().strip().partition(" ")
+    except OSError:
+        return False
+    if not pid.isdigit() or not _pid_alive(int(pid)):
+        return False
+    return not started or _start_time(int(pid)) in (started, None)
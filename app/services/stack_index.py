@@ -0,0 +1,194 @@
+"""Enriched stack data and a precomputed index for filtered / paginated queries."""
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import json
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+
+from app.config import HOST_STATUS_TIMEOUT, PRIMARY_HOST, STACK_INDEX_TTL
+from app.services import disk_usage, docker_service, preflight, prefetch, process_service, stack_service
+
+# Sort: running first, then partial, then stopped, then alphabetical
+STATE_ORDER = {"running": 0, "partial": 1, "stopped": 2, "unknown": 3}
+
+SORT_KEYS = ("state", "name")
+FIELDS = (
+    "name", "host", "mode", "active", "is_self", "busy", "prefetched", "services", "service_map", "status",
+    "disk", "config",
+)
+
+
+async def build_stack_data() -> list[dict]:
+    """Build enriched stack data with container statuses (also refreshes the index).
+
+    Statuses are collected from all hosts concurrently; stacks on an unreachable
+    host get an "unknown" status flagged ``unreachable``.
+    """
+    stacks, statuses, _, _ = await asyncio.gather(
+        asyncio.to_thread(stack_service.list_stacks),
+        docker_service.collect_statuses(),
+        disk_usage.refresh(),
+        prefetch.refresh(),
+    )
+
+    result = [_stack_dict(s, statuses.get(s.host)) for s in stacks]
+    result.sort(key=_state_key)
+    _set_index(StackIndex.build(result))
+    return result
+
+
+async def stack_data(stack: stack_service.StackInfo) -> dict:
+    """Enriched data for one stack, querying only its compose project's containers."""
+    try:
+        index = await asyncio.wait_for(
+            asyncio.to_thread(docker_service.get_project_containers, stack.host, stack.project),
+            HOST_STATUS_TIMEOUT,
+        )
+    except Exception:
+        index = None
+    await asyncio.gather(disk_usage.refresh(), prefetch.refresh())
+    return _stack_dict(stack, index)
+
+
+def _stack_dict(s: stack_service.StackInfo, index: docker_service.ContainerIndex | None) -> dict:
+    return {
+        "name": s.name,
+        "host": s.host,
+        "remote": s.host != PRIMARY_HOST,
+        "mode": s.mode,
+        "active": s.active,
+        "is_self": s.is_self,
+        "busy": process_service.is_stack_busy(s.name),
+        "prefetched": prefetch.is_ready(s),
+        "services": s.services,
+        "service_map": s.service_map,
+        "status": docker_service.get_stack_status(s.project, s.service_map, index),
+        "disk": disk_usage.stack_usage(s.name),
+        "config": preflight.verdict(s.name),
+    }
+
+
+def _state_key(stack: dict) -> tuple[int, str]:
+    return (STATE_ORDER.get(stack["status"]["state"], 9), stack["name"])
+
+
+@dataclass
+class StackIndex:
+    built_at: float
+    stacks: dict[str, dict] = field(default_factory=dict)
+    names: list[str] = field(default_factory=list)  # sorted by name
+    state_keys: list[tuple[int, str]] = field(default_factory=list)  # sorted by (state rank, name)
+    by_state: dict[str, set[str]] = field(default_factory=dict)
+    by_mode: dict[str, set[str]] = field(default_factory=dict)
+    by_active: dict[bool, set[str]] = field(default_factory=dict)
+    by_host: dict[str, set[str]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, stacks: list[dict]) -> StackIndex:
+        idx = cls(built_at=time.monotonic())
+        for s in stacks:
+            name = s["name"]
+            idx.stacks[name] = s
+            idx.by_state.setdefault(s["status"]["state"], set()).add(name)
+            idx.by_mode.setdefault(s["mode"], set()).add(name)
+            idx.by_active.setdefault(bool(s["active"]), set()).add(name)
+            idx.by_host.setdefault(s["host"], set()).add(name)
+        idx.names = sorted(idx.stacks)
+        idx.state_keys = sorted(_state_key(s) for s in stacks)
+        return idx
+
+    def _prefix_range(self, prefix: str) -> set[str]:
+        lo = bisect_left(self.names, prefix)
+        hi = bisect_left(self.names, prefix + "\U0010ffff")
+        return set(self.names[lo:hi])
+
+    def match(
+        self,
+        states: list[str] | None = None,
+        modes: list[str] | None = None,
+        active: bool | None = None,
+        prefix: str | None = None,
+        hosts: list[str] | None = None,
+    ) -> set[str] | None:
+        """Return the set of matching names, or None when no filter is applied."""
+        candidates: set[str] | None = None
+
+        def _narrow(found: set[str]) -> None:
+            nonlocal candidates
+            candidates = found if candidates is None else candidates & found
+
+        if states:
+            _narrow(set().union(*(self.by_state.get(s, set()) for s in states)))
+        if modes:
+            _narrow(set().union(*(self.by_mode.get(m, set()) for m in modes)))
+        if active is not None:
+            _narrow(self.by_active.get(active, set()))
+        if hosts:
+            _narrow(set().union(*(self.by_host.get(h, set()) for h in hosts)))
+        if prefix:
+            _narrow(self._prefix_range(prefix))
+        return candidates
+
+    def sort_key(self, name: str, sort: str) -> tuple:
+        if sort == "name":
+            return (name,)
+        return _state_key(self.stacks[name])
+
+    def page(
+        self,
+        candidates: set[str] | None,
+        sort: str = "state",
+        after: tuple | None = None,
+        limit: int = 100,
+    ) -> tuple[list[dict], int, tuple | None]:
+        """Return (items, total_matches, last_key_if_more)."""
+        if candidates is None:
+            keys = [(n,) for n in self.names] if sort == "name" else self.state_keys
+        else:
+            keys = sorted(self.sort_key(n, sort) for n in candidates)
+
+        start = bisect_right(keys, after) if after is not None else 0
+        window = keys[start:start + limit]
+        items = [self.stacks[k[-1]] for k in window]
+        more = start + limit < len(keys)
+        return items, len(keys), (window[-1] if more and window else None)
+
+
+_index: StackIndex | None = None
+
+
+def _set_index(idx: StackIndex) -> None:
+    global _index
+    _index = idx
+
+
+async def get_index(max_age: float = STACK_INDEX_TTL) -> StackIndex:
+    """Return the current index, rebuilding it if older than max_age seconds."""
+    if _index is None or time.monotonic() - _index.built_at > max_age:
+        await build_stack_data()
+    return _index
+
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    raw = json.dumps({"s": sort, "k": list(key)}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple | None:
+    """Decode a cursor produced by encode_cursor; returns None if invalid or for another sort."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("s") != sort or not isinstance(data.get("k"), list):
+        return None
+    key = tuple(data["k"])
+    expected = (str,) if sort == "name" else (int, str)
+    if len(key) != len(expected) or not all(type(v) is t for v, t in zip(key, expected)):
+        return None
+    return key
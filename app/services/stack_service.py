@@ -1,11 +1,18 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
 import yaml
 
-from app.config import DOCKER_APPS_PATH, SELF_STACK_NAME
+from app.metrics import LIST_STACKS_SECONDS
+from app.config import COMPOSE_PARSE_WORKERS, DOCKER_ENDPOINTS, PRIMARY_HOST, SELF_STACK_NAME, DockerEndpoint
+from app.services import compose_parse
 
 COMPOSE_FILENAMES = ("docker-compose.yml", "docker-compose.yaml")
 
@@ -19,8 +26,10 @@ class StackInfo:
     compose_file: str = ""
     services: list[str] = field(default_factory=list)
     service_map: dict[str, str] = field(default_factory=dict)  # container_name -> service_name
+    project: str = ""  # compose project name (com.docker.compose.project label)
     pass_refs: list[str] = field(default_factory=list)
     is_self: bool = False
+    host: str = PRIMARY_HOST  # DockerEndpoint.name the stack runs on
 
 
 def _find_compose_file(stack_dir: Path) -> Path | None:
@@ -31,21 +40,71 @@ def _find_compose_file(stack_dir: Path) -> Path | None:
     return None
 
 
-def _parse_services(compose_path: Path) -> tuple[list[str], dict[str, str]]:
-    """Parse compose file, return (container_names, {container_name: service_name})."""
+# compose file path -> ((mtime_ns, size), parsed services)
+_parse_cache: dict[str, tuple[tuple[int, int], compose_parse.ParsedServices]] = {}
+_parse_pool: ProcessPoolExecutor | None = None
+_parse_pool_lock = threading.Lock()
+# Changed files needed before parsing is spread across the pool. Starting the
+# workers costs a few hundred ms, which libyaml parses well over a thousand files in.
+_PARALLEL_MIN = 1000 if compose_parse.Loader is not yaml.SafeLoader else 64
+
+
+def _parse_compose_files(paths: list[Path]) -> list[compose_parse.ParsedServices]:
+    """Parsed services of each compose file, in order.
+
+    Files with an unchanged mtime and size come from the cache. When many
+    changed at once (cold start, a git pull), they are parsed in a process pool.
+    """
+    results: list[compose_parse.ParsedServices] = [([], {}, "")] * len(paths)
+    misses = []
+    for i, path in enumerate(paths):
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        key = (st.st_mtime_ns, st.st_size)
+        cached = _parse_cache.get(str(path))
+        if cached is not None and cached[0] == key:
+            results[i] = cached[1]
+        else:
+            misses.append((i, str(path), key))
+
+    if misses:
+        parsed = _parse_batch([path for _, path, _ in misses])
+        for (i, path, key), result in zip(misses, parsed):
+            _parse_cache[path] = (key, result)
+            results[i] = result
+    return results
+
+
+def _parse_batch(paths: list[str]) -> list[compose_parse.ParsedServices]:
+    global _parse_pool
+    if COMPOSE_PARSE_WORKERS < 2 or len(paths) < _PARALLEL_MIN:
+        return compose_parse.parse_many(paths)
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # forkserver: workers don't inherit the server's threads and only import compose_parse
+            _parse_pool = ProcessPoolExecutor(
+                COMPOSE_PARSE_WORKERS, mp_context=multiprocessing.get_context("forkserver"),
+            )
+        pool = _parse_pool
+    size = -(-len(paths) // (COMPOSE_PARSE_WORKERS * 4))
+    chunks = [paths[i:i + size] for i in range(0, len(paths), size)]
     try:
-        data = yaml.safe_load(compose_path.read_text())
-        if not data or "services" not in data:
-            return [], {}
-        services = []
-        service_map = {}
-        for svc_name, svc_conf in data["services"].items():
-            container_name = svc_conf.get("container_name", svc_name)
-            services.append(container_name)
-            service_map[container_name] = svc_name
-        return services, service_map
+        return [r for chunk in pool.map(compose_parse.parse_many, chunks) for r in chunk]
     except Exception:
-        return [], {}
+        with _parse_pool_lock:
+            _parse_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        return compose_parse.parse_many(paths)
+
+
+_PROJECT_INVALID_RE = re.compile(r"[^a-z0-9_-]")
+
+
+def project_name(name: str) -> str:
+    """Normalize a name the way compose does for project names."""
+    return _PROJECT_INVALID_RE.sub("", name.lower()).lstrip("_-")
 
 
 def _parse_pass_refs(template_path: Path) -> list[str]:
@@ -64,20 +123,176 @@ def _parse_pass_refs(template_path: Path) -> list[str]:
     return refs
 
 
+def active_profiles(stack: StackInfo) -> set[str]:
+    """Compose profiles enabled for the stack: COMPOSE_PROFILES from its .env, else the environment."""
+    value = os.environ.get("COMPOSE_PROFILES", "")
+    try:
+        for line in (Path(stack.path) / ".env").read_text().splitlines():
+            key, sep, val = line.strip().partition("=")
+            if sep and key.strip() == "COMPOSE_PROFILES":
+                value = val.strip().strip("'\"")
+    except OSError:
+        pass
+    return {p.strip() for p in value.split(",") if p.strip()}
+
+
+def service_order(stack: StackInfo) -> list[str]:
+    """Service names in dependency order (depends_on first), alphabetical among peers.
+
+    Services gated behind a compose profile that isn't active are left out, as
+    `compose up` would. Services in a dependency cycle are appended in
+    alphabetical order.
+    """
+    services = _load_compose(stack).get("services") or {}
+    active = active_profiles(stack)
+
+    def enabled(svc: str) -> bool:
+        conf = services.get(svc)
+        profiles = conf.get("profiles") if isinstance(conf, dict) else None
+        return not profiles or "*" in active or bool(active.intersection(profiles))
+
+    deps = {svc: d for svc, d in _dependencies(stack).items() if enabled(svc)}
+    order: list[str] = []
+    ready = sorted(svc for svc, d in deps.items() if not d)
+    while ready:
+        svc = ready.pop(0)
+        order.append(svc)
+        for other in sorted(deps):
+            if svc in deps[other]:
+                deps[other].discard(svc)
+                if not deps[other] and other not in order and other not in ready:
+                    ready.append(other)
+        ready.sort()
+    order.extend(sorted(svc for svc in deps if svc not in order))
+    return order
+
+
+def service_levels(stack: StackInfo) -> list[list[str]]:
+    """Services grouped by dependency depth: each level only depends on earlier levels.
+
+    Services in a dependency cycle form one last level.
+    """
+    deps = _dependencies(stack)
+    levels: list[list[str]] = []
+    done: set[str] = set()
+    while len(done) < len(deps):
+        level = sorted(svc for svc, d in deps.items() if svc not in done and d <= done)
+        if not level:
+            level = sorted(svc for svc in deps if svc not in done)
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+def _dependencies(stack: StackInfo) -> dict[str, set[str]]:
+    """{service: services it depends_on} (unknown names dropped)."""
+    services = _load_compose(stack).get("services") or {}
+    deps: dict[str, set[str]] = {}
+    for svc, conf in services.items():
+        raw = (conf or {}).get("depends_on") or []
+        deps[svc] = {d for d in (raw if isinstance(raw, (list, dict)) else []) if d in services}
+    return deps
+
+
+def image_refs(stack: StackInfo) -> tuple[list[str], list[str]]:
+    """Return (image references, services whose image can't be resolved from the compose file).
+
+    A service is unresolved if its image uses ${VAR} interpolation or it has
+    no image (build-only), so its image can't be checked against a registry.
+    """
+    services = _load_compose(stack).get("services") or {}
+    refs = set()
+    unresolved = []
+    for svc, conf in services.items():
+        image = conf.get("image") if isinstance(conf, dict) else None
+        if isinstance(image, str) and image and "$" not in image:
+            refs.add(image)
+        else:
+            unresolved.append(str(svc))
+    return sorted(refs), sorted(unresolved)
+
+
+def bind_mounts(stack: StackInfo) -> list[Path]:
+    """Host paths bind-mounted by the stack's services (relative ones resolved against the stack dir).
+
+    Sources using ${VAR} interpolation are skipped; paths nested inside another
+    mounted path are dropped so nothing is counted twice.
+    """
+    base = Path(stack.path)
+    sources = set()
+    for conf in (_load_compose(stack).get("services") or {}).values():
+        if not isinstance(conf, dict):
+            continue
+        for vol in conf.get("volumes") or []:
+            if isinstance(vol, str):
+                src = vol.split(":", 1)[0] if ":" in vol else ""
+                if not src.startswith((".", "/", "~")):
+                    continue  # named volume or anonymous volume
+            elif isinstance(vol, dict) and vol.get("type") == "bind":
+                src = str(vol.get("source") or "")
+            else:
+                continue
+            if not src or "$" in src:
+                continue
+            sources.add(Path(os.path.normpath(base / Path(src).expanduser())))
+    roots = sorted(sources)
+    return [p for p in roots if p != Path("/") and not any(r in p.parents for r in roots)]
+
+
+def _load_compose(stack: StackInfo) -> dict:
+    try:
+        data = yaml.load((Path(stack.path) / stack.compose_file).read_text(), Loader=compose_parse.Loader)
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# host -> names of its stacks hidden by a same-named stack of an earlier host, from the last scan
+_shadowed: dict[str, list[str]] = {}
+
+
 def list_stacks() -> list[StackInfo]:
-    apps_dir = Path(DOCKER_APPS_PATH)
+    """Scan every host's stacks tree. Names are unique: the first host listing a name wins.
+
+    The stacks that lost are reported by shadowed_stacks().
+    """
+    global _shadowed
+    with LIST_STACKS_SECONDS.time():
+        stacks: dict[str, StackInfo] = {}
+        shadowed: dict[str, list[str]] = {}
+        scanned = []
+        for endpoint in DOCKER_ENDPOINTS:
+            for s in _scan_stacks(endpoint):
+                scanned.append(str(Path(s.path) / s.compose_file))
+                if stacks.setdefault(s.name, s) is not s:
+                    shadowed.setdefault(s.host, []).append(s.name)
+        _shadowed = shadowed
+        for path in _parse_cache.keys() - set(scanned):
+            _parse_cache.pop(path, None)
+        return sorted(stacks.values(), key=lambda s: s.name)
+
+
+def shadowed_stacks() -> dict[str, list[str]]:
+    """{host: stack names hidden by an earlier host's stack of the same name}, from the last scan."""
+    return _shadowed
+
+
+def _scan_stacks(endpoint: DockerEndpoint) -> list[StackInfo]:
+    apps_dir = Path(endpoint.apps_path)
     if not apps_dir.is_dir():
         return []
 
-    stacks = []
+    found = []
     for entry in sorted(apps_dir.iterdir()):
         if not entry.is_dir() or entry.name.startswith("."):
             continue
-
         compose = _find_compose_file(entry)
-        if compose is None:
-            continue
+        if compose is not None:
+            found.append((entry, compose))
 
+    stacks = []
+    parsed = _parse_compose_files([compose for _, compose in found])
+    for (entry, compose), (services, service_map, name) in zip(found, parsed):
         template = entry / ".env.template"
         env_file = entry / ".env"
         inuse = entry / ".inuse"
@@ -92,17 +307,18 @@ def list_stacks() -> list[StackInfo]:
             mode = "none"
             pass_refs = []
 
-        services, service_map = _parse_services(compose)
         stacks.append(StackInfo(
             name=entry.name,
             path=str(entry),
             mode=mode,
             active=inuse.is_file(),
             compose_file=compose.name,
-            services=services,
-            service_map=service_map,
+            services=list(services),
+            service_map=dict(service_map),
+            project=project_name(name or entry.name),
             pass_refs=pass_refs,
-            is_self=(entry.name == SELF_STACK_NAME),
+            is_self=(entry.name == SELF_STACK_NAME and endpoint.name == PRIMARY_HOST),
+            host=endpoint.name,
         ))
 
     return stacks
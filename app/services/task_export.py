@@ -0,0 +1,247 @@
+"""Export of task output, with metadata and step timings, as gzip-compressed text.
+
+The file is generated while it is sent: output is read a page of lines at a
+time (from the task in memory, or from the shared state database for tasks of
+other workers and older ones it still keeps) and compressed in a worker
+thread, so memory use doesn't grow with the output and the event loop stays
+free for live streams. A running task is exported up to the line it reached
+when the export gets there.
+
+Tasks only stay in memory and in the shared state database for an hour. With
+TASK_ARCHIVE_DIR set, each worker also writes its finished tasks there as one
+.log.gz file each (named <created ms>_<task id>_<stack>.log.gz) and deletes
+them after TASK_ARCHIVE_DAYS; exports include archived tasks no longer in the
+history. Every task is its own gzip member, so archived files are sent as they
+are.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Union
+
+from app.config import TASK_ARCHIVE_DAYS, TASK_ARCHIVE_DIR
+from app.services import process_service, shared_state
+
+# Output lines read and compressed at a time
+_PAGE = 1000
+# Bytes of an archived file sent at a time
+_CHUNK = 256 * 1024
+# Seconds between archive passes (finished local tasks written, expired files deleted)
+_ARCHIVE_INTERVAL = 30
+
+# A task to export: (task, whether its output is read from the shared state database),
+# or the path of an archived task
+Source = Union[tuple[process_service.TaskState, bool], Path]
+
+_archived: set[str] = set()  # ids of local tasks already written to the archive
+_archive_task: asyncio.Task | None = None
+
+
+def _time(ts: float | None) -> str:
+    return datetime.fromtimestamp(ts).isoformat(sep=" ", timespec="seconds") if ts else "-"
+
+
+def _header(task: process_service.TaskState) -> str:
+    duration = f"{task.finished_at - task.created_at:.1f}s" if task.done and task.finished_at else "-"
+    lines = [
+        f"=== Task {task.task_id} ===\n",
+        f"Command:   {task.command}\n",
+        f"Stack:     {task.stack_name}\n",
+        f"Created:   {_time(task.created_at)}\n",
+        f"Finished:  {_time(task.finished_at) if task.done else 'still running at export time'}\n",
+        f"Duration:  {duration}\n",
+        f"Exit code: {task.exit_code if task.done else '-'}\n",
+    ]
+    if task.spans:
+        lines.append("Steps:\n")
+        for sp in list(task.spans):
+            took = f"{sp.duration:.1f}s" if sp.duration is not None else "-"
+            detail = f"  ({sp.detail})" if sp.detail else ""
+            lines.append(
+                f"  {_time(sp.started_at)}  {took:>8}  {sp.outcome:<8} {sp.scope}: {sp.name}{detail}\n"
+            )
+    lines.append("Output:\n")
+    return "".join(lines)
+
+
+async def _pages(task: process_service.TaskState, stored: bool) -> AsyncIterator[list[str]]:
+    start = 0
+    while True:
+        if stored:
+            page = await asyncio.to_thread(shared_state.read_lines, task.task_id, start, _PAGE)
+        else:
+            page = task.lines[start:start + _PAGE]
+        if not page:
+            return
+        yield page
+        start += len(page)
+
+
+# --- Archive ---------------------------------------------------------------------
+
+def _archive_name(task: process_service.TaskState) -> str:
+    return f"{int(task.created_at * 1000)}_{task.task_id}_{task.stack_name or ''}.log.gz"
+
+
+def _parse_archive_name(name: str) -> tuple[float, str, str] | None:
+    """(created_at, task id, stack) of an archive file name, or None if it isn't one."""
+    if not name.endswith(".log.gz"):
+        return None
+    parts = name[:-len(".log.gz")].split("_", 2)
+    if len(parts) != 3 or not parts[0].isdigit():
+        return None
+    return int(parts[0]) / 1000, parts[1], parts[2]
+
+
+def _archive_files() -> list[tuple[float, str, str, Path]]:
+    """(created_at, task id, stack, path) of every archived task."""
+    try:
+        entries = list(os.scandir(TASK_ARCHIVE_DIR))
+    except OSError:
+        return []
+    found = []
+    for entry in entries:
+        parsed = _parse_archive_name(entry.name)
+        if parsed is not None:
+            found.append((*parsed, Path(entry.path)))
+    return found
+
+
+def _write_archive(task: process_service.TaskState, header: str, lines: list[str]) -> None:
+    path = Path(TASK_ARCHIVE_DIR) / _archive_name(task)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(tmp, "wb") as f:
+        f.write(compressor.compress(header.encode()))
+        for start in range(0, len(lines), _PAGE):
+            f.write(compressor.compress("".join(lines[start:start + _PAGE]).encode()))
+        f.write(compressor.flush())
+    os.replace(tmp, path)
+
+
+def _expire_archive(before: float) -> None:
+    for created_at, _, _, path in _archive_files():
+        if created_at < before:
+            path.unlink(missing_ok=True)
+
+
+async def archive() -> None:
+    """Write this worker's newly finished tasks to the archive and delete expired files."""
+    if not TASK_ARCHIVE_DIR:
+        return
+    tasks = process_service.local_tasks()
+    for task in tasks:
+        if task.done and task.task_id not in _archived:
+            await asyncio.to_thread(_write_archive, task, _header(task), list(task.lines))
+            _archived.add(task.task_id)
+    _archived.intersection_update(t.task_id for t in tasks)
+    await asyncio.to_thread(_expire_archive, time.time() - TASK_ARCHIVE_DAYS * 86400)
+
+
+async def _archive_loop() -> None:
+    while True:
+        await asyncio.sleep(_ARCHIVE_INTERVAL)
+        try:
+            await archive()
+        except Exception:
+            pass
+
+
+def start() -> None:
+    global _archive_task
+    if TASK_ARCHIVE_DIR:
+        os.makedirs(TASK_ARCHIVE_DIR, exist_ok=True)
+        _archive_task = asyncio.create_task(_archive_loop())
+
+
+async def stop() -> None:
+    global _archive_task
+    if _archive_task is not None:
+        _archive_task.cancel()
+        try:
+            await _archive_task
+        except asyncio.CancelledError:
+            pass
+        _archive_task = None
+        try:
+            await archive()
+        except Exception:
+            pass
+
+
+# --- Export ----------------------------------------------------------------------
+
+async def find(task_id: str) -> Source | None:
+    """The task from memory, the shared state database or the archive, or None."""
+    task = process_service.get_task(task_id)
+    if task is not None:
+        return task, False
+    if shared_state.enabled():
+        rec = await asyncio.to_thread(shared_state.load_task, task_id)
+        if rec is not None:
+            return process_service.task_from_record(rec, []), True
+    if TASK_ARCHIVE_DIR:
+        for _, archived_id, _, path in await asyncio.to_thread(_archive_files):
+            if archived_id == task_id:
+                return path
+    return None
+
+
+async def between(since: float, until: float, stack: str | None = None) -> list[Source]:
+    """Tasks created in [since, until) known to this worker, the shared state or the archive, oldest first."""
+    found: dict[str, tuple[float, Source]] = {
+        t.task_id: (t.created_at, (t, False)) for t in process_service.local_tasks()
+        if since <= t.created_at < until and (stack is None or t.stack_name == stack)
+    }
+    if shared_state.enabled():
+        for rec in await asyncio.to_thread(shared_state.tasks_between, since, until):
+            if rec["task_id"] not in found and (stack is None or rec["stack_name"] == stack):
+                found[rec["task_id"]] = (rec["created_at"], (process_service.task_from_record(rec, []), True))
+    if TASK_ARCHIVE_DIR:
+        for created_at, task_id, task_stack, path in await asyncio.to_thread(_archive_files):
+            if (since <= created_at < until and task_id not in found
+                    and (stack is None or task_stack == stack)):
+                found[task_id] = (created_at, path)
+    return [source for _, source in sorted(found.values(), key=lambda f: f[0])]
+
+
+async def _member(source: Source, first: bool) -> AsyncIterator[bytes]:
+    """One gzip member with the task's header and output."""
+    if isinstance(source, Path):
+        try:
+            f = await asyncio.to_thread(open, source, "rb")
+        except OSError:
+            return  # expired since it was listed
+        try:
+            if not first:
+                yield zlib.compress(b"\n", wbits=31)
+            while chunk := await asyncio.to_thread(f.read, _CHUNK):
+                yield chunk
+        finally:
+            f.close()
+        return
+    task, stored = source
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    text = ("" if first else "\n") + _header(task)
+    async for page in _pages(task, stored):
+        data = await asyncio.to_thread(compressor.compress, (text + "".join(page)).encode())
+        text = ""
+        if data:
+            yield data
+    if text:
+        yield await asyncio.to_thread(compressor.compress, text.encode())
+    yield compressor.flush()
+
+
+async def stream(sources: list[Source]) -> AsyncIterator[bytes]:
+    """Yield one gzip file holding the header and output of each task (a gzip member per task)."""
+    for i, source in enumerate(sources):
+        async for data in _member(source, i == 0):
+            yield data
+    if not sources:
+        yield zlib.compress(b"No tasks in this time range.\n", wbits=31)
@@ -174,6 +174,24 @@ function connectStream(taskId) {
         pre.scrollTop = pre.scrollHeight;
     });
 
+    // Step timings, sent once before "done"
+    source.addEventListener("summary", function (e) {
+        var spans;
+        try { spans = JSON.parse(e.data); } catch (err) { return; }
+        if (!spans.length) return;
+        var text = "\n── Step timings ──\n";
+        spans.forEach(function (s) {
+            var label = (s.scope && s.scope.indexOf("__") !== 0 ? s.scope + ": " : "") + s.name;
+            var secs = s.duration === null ? "-" : s.duration.toFixed(1) + "s";
+            text += "  " + label.padEnd(36) + secs.padStart(8) + "  " + s.outcome + (s.detail ? " (" + s.detail + ")" : "") + "\n";
+        });
+        var span = document.createElement("span");
+        span.className = "output-summary";
+        span.textContent = text;
+        pre.appendChild(span);
+        pre.scrollTop = pre.scrollHeight;
+    });
+
     source.addEventListener("done", function (e) {
         source.close();
         var code = parseInt(e.data);
@@ -192,7 +210,17 @@ function connectStream(taskId) {
         updateStatus();
     });
 
-    source.addEventListener("error", function () {
+    source.addEventListener("open", function () {
+        if (status && status.textContent === "reconnecting...") status.textContent = "running";
+    });
+
+    source.addEventListener("error", function (e) {
+        // Dropped connection: the browser reconnects with Last-Event-ID and the
+        // stream resumes from the last line received (on any worker)
+        if (e.data === undefined && source.readyState === EventSource.CONNECTING) {
+            if (status) status.textContent = "reconnecting...";
+            return;
+        }
         source.close();
         if (status) {
             status.removeAttribute("aria-busy");
@@ -269,9 +297,11 @@ function showPassLogin() {
 
 // Container logs viewer
 var currentLogsContainer = "";
+var currentLogsHost = "";
 
-function showLogs(containerName) {
+function showLogs(containerName, host) {
     currentLogsContainer = containerName;
+    currentLogsHost = host || "";
     var title = document.getElementById("logs-title");
     var pre = document.getElementById("logs-pre");
     if (title) title.textContent = containerName + " — Logs";
@@ -285,6 +315,7 @@ function closeLogsModal() {
     var modal = document.getElementById("logs-modal");
     if (modal) modal.close();
     currentLogsContainer = "";
+    currentLogsHost = "";
 }
 
 function reloadLogs() {
@@ -294,7 +325,8 @@ function reloadLogs() {
     var pre = document.getElementById("logs-pre");
     if (pre) pre.innerHTML = '<span aria-busy="true">Loading...</span>';
 
-    fetch("/api/containers/" + encodeURIComponent(currentLogsContainer) + "/logs?lines=" + tail)
+    fetch("/api/containers/" + encodeURIComponent(currentLogsContainer) + "/logs?lines=" + tail +
+          (currentLogsHost ? "&host=" + encodeURIComponent(currentLogsHost) : ""))
         .then(function (r) { return r.json(); })
         .then(function (data) {
             if (pre) {
@@ -0,0 +1,143 @@
+"""Fingerprinted, precompressed static assets.
+
+At startup every file under app/static is read once, named after a hash of
+its content (``app.js`` -> ``app.3f2a9c1b0d4e.js``) and compressed in advance
+with gzip and, when the optional ``brotli`` package is installed, brotli.
+Templates link assets through ``static_url("app.js")``, so a changed file gets
+a new URL and the fingerprinted one can be cached as immutable. The plain
+names are still served, revalidated with an ETag.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+
+_IMMUTABLE = "public, max-age=31536000, immutable"
+_REVALIDATE = "no-cache"
+# Variants not at least this much smaller than the original aren't kept
+_MIN_SAVING = 0.9
+
+
+@dataclass
+class Asset:
+    name: str  # path relative to the static dir
+    fingerprinted: str
+    content_type: str
+    etag: str
+    bodies: dict[str, bytes] = field(default_factory=dict)  # content-coding ("identity", "br", "gzip") -> body
+
+
+_assets: dict[str, Asset] = {}  # plain and fingerprinted name -> asset
+
+
+def _fingerprint(name: str, digest: str) -> str:
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot and "/" not in suffix else f"{name}.{digest}"
+
+
+def build(directory: Path = STATIC_DIR) -> None:
+    """Hash and compress every asset under directory (run once at startup)."""
+    assets: dict[str, Asset] = {}
+    for path in sorted(p for p in directory.rglob("*") if p.is_file()):
+        name = path.relative_to(directory).as_posix()
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        asset = Asset(name, _fingerprint(name, digest), content_type, f'"{digest}"', {"identity": data})
+        variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(data, quality=11)
+        for coding, body in variants.items():
+            if len(body) < len(data) * _MIN_SAVING:
+                asset.bodies[coding] = body
+        assets[name] = assets[asset.fingerprinted] = asset
+    _assets.clear()
+    _assets.update(assets)
+
+
+def url(name: str) -> str:
+    """URL of an asset under its fingerprinted name (plain name if it isn't known)."""
+    if not _assets:
+        build()
+    asset = _assets.get(name)
+    return f"/static/{asset.fingerprinted if asset else name}"
+
+
+def _coding(asset: Asset, accept_encoding: str) -> str:
+    offered = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[coding.strip().lower()] = q
+    for coding in ("br", "gzip"):
+        if coding in asset.bodies and offered.get(coding, offered.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
+
+
+class StaticAssets:
+    """ASGI app serving the built assets (mounted at /static)."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not _assets:
+            build()
+        if scope["method"] not in ("GET", "HEAD"):
+            await PlainTextResponse("Method Not Allowed", 405, {"Allow": "GET, HEAD"})(scope, receive, send)
+            return
+        name = scope["path"].removeprefix(scope.get("root_path", "")).lstrip("/")
+        asset = _assets.get(name)
+        if asset is None:
+            await PlainTextResponse("Not Found", 404)(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        headers = {
+            "Cache-Control": _IMMUTABLE if name == asset.fingerprinted else _REVALIDATE,
+            "ETag": asset.etag,
+            "Vary": "Accept-Encoding",
+        }
+        if request_headers.get("if-none-match") == asset.etag:
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+        coding = _coding(asset, request_headers.get("accept-encoding", ""))
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        body = asset.bodies[coding]
+        response = Response(b"" if scope["method"] == "HEAD" else body, headers=headers,
+                            media_type=asset.content_type)
+        response.headers["Content-Length"] = str(len(body))
+        await response(scope, receive, send)
+
+
+def state() -> dict:
+    return {
+        "brotli": brotli is not None,
+        "assets": {
+            a.name: {
+                "url": f"/static/{a.fingerprinted}",
+                "sizes": {coding: len(body) for coding, body in a.bodies.items()},
+            }
+            for key, a in sorted(_assets.items()) if key == a.name
+        },
+    }
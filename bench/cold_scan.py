@@ -0,0 +1,113 @@
+"""Benchmark cold stack inventory scans (compose parsing) against a synthetic tree.
+
+Each mode runs list_stacks() in a fresh interpreter, so nothing is cached:
+
+    python -m bench.cold_scan --stacks 300 --services 6 --workers 4
+
+Modes:
+  pure     pure-Python yaml.SafeLoader, parsed serially (the old scan path)
+  c        libyaml CSafeLoader, serially
+  c+pool   CSafeLoader spread across a COMPOSE_PARSE_WORKERS process pool,
+           whatever the number of files (the app only uses it above a threshold)
+Each child also times a second, warm scan served from the mtime cache.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.synthetic import generate_tree
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODES = ("pure", "c", "c+pool")
+
+
+def child(mode: str) -> None:
+    import yaml
+
+    from app.services import compose_parse, stack_service
+
+    if mode == "pure":
+        compose_parse.Loader = yaml.SafeLoader
+    if mode == "c+pool":
+        stack_service._PARALLEL_MIN = 0
+    start = time.perf_counter()
+    stacks = stack_service.list_stacks()
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    stack_service.list_stacks()
+    warm = time.perf_counter() - start
+    print(json.dumps({
+        "stacks": len(stacks),
+        "services": sum(len(s.services) for s in stacks),
+        "cold_ms": round(cold * 1000, 3),
+        "warm_ms": round(warm * 1000, 3),
+    }))
+
+
+def parent(args) -> None:
+    import yaml
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="stack-manager-scan-") as tmp:
+        generate_tree(Path(tmp), args.stacks, args.services)
+        for mode in MODES:
+            if mode != "pure" and not yaml.__with_libyaml__:
+                print(f"[bench] skipping {mode}: PyYAML was built without libyaml", file=sys.stderr)
+                continue
+            env = {
+                **os.environ,
+                "DOCKER_APPS_PATH": tmp,
+                "COMPOSE_PARSE_WORKERS": str(args.workers if mode == "c+pool" else 0),
+                "PYTHONPATH": str(ROOT),
+            }
+            runs = []
+            for _ in range(args.repeat):
+                out = subprocess.run(
+                    [sys.executable, "-m", "bench.cold_scan", "--child", mode],
+                    env=env, cwd=ROOT, capture_output=True, text=True,
+                )
+                if out.returncode != 0:
+                    sys.stderr.write(out.stderr)
+                    raise SystemExit(f"cold scan failed in mode {mode}")
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            results[mode] = {
+                "stacks": runs[0]["stacks"],
+                "services": runs[0]["services"],
+                "cold_ms": round(statistics.median(r["cold_ms"] for r in runs), 3),
+                "warm_ms": round(statistics.median(r["warm_ms"] for r in runs), 3),
+            }
+            print(f"[bench] {mode}: cold {results[mode]['cold_ms']} ms, "
+                  f"warm {results[mode]['warm_ms']} ms", file=sys.stderr)
+
+    print(json.dumps({
+        "params": {
+            "stacks": args.stacks, "services": args.services,
+            "workers": args.workers, "repeat": args.repeat, "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="stack-manager cold scan benchmark")
+    parser.add_argument("--stacks", type=int, default=300, help="Stacks in the synthetic tree")
+    parser.add_argument("--services", type=int, default=6, help="Services per stack")
+    parser.add_argument("--workers", type=int, default=max(min(os.cpu_count() or 1, 8), 2),
+                        help="COMPOSE_PARSE_WORKERS for the c+pool mode")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode (the median is reported)")
+    parser.add_argument("--child", metavar="MODE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    child(args.child) if args.child else parent(args)
+
+
+if __name__ == "__main__":
+    main()
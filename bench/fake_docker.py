@@ -0,0 +1,254 @@
+"""Stand-in Docker Engine API served on a unix socket.
+
+Implements the subset of endpoints stack-manager uses (version, container list /
+inspect / logs, image inspect, system df) over an in-memory inventory, with a
+configurable per-request latency and an extra delay for ``/system/df``, which
+is slow on real hosts with many images and volumes. Run standalone with:
+
+    python -m bench.fake_docker --socket /tmp/fake-docker.sock --stacks 100 --services 4
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+from bench.synthetic import FakeContainer, generate_tree
+
+API_VERSION = "1.44"
+_VERSION_PREFIX_RE = re.compile(r"^/v\d+\.\d+")
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class Inventory:
+    """Containers and images the fake daemon reports."""
+
+    def __init__(self, containers: list[FakeContainer]) -> None:
+        self.containers: dict[str, dict] = {}
+        self.by_name: dict[str, str] = {}
+        self.images: dict[str, dict] = {}
+        for c in containers:
+            self.add(c)
+
+    def add(self, c: FakeContainer) -> None:
+        image_id = "sha256:" + _digest(c.image)
+        self.images[image_id] = {"Id": image_id, "RepoTags": [c.image], "Size": 50_000_000}
+        cid = _digest(c.name)
+        state = {
+            "Status": c.status,
+            "Running": c.status == "running",
+            "StartedAt": "2026-01-01T00:00:00.000000000Z",
+        }
+        if c.health:
+            state["Health"] = {"Status": c.health}
+        self.containers[cid] = {
+            "Id": cid,
+            "Name": "/" + c.name,
+            "Image": image_id,
+            "Config": {"Image": c.image, "Labels": c.labels, "Tty": True},
+            "State": state,
+        }
+        self.by_name[c.name] = cid
+
+    def find_container(self, ref: str) -> dict | None:
+        cid = self.by_name.get(ref, ref)
+        return self.containers.get(cid)
+
+    def find_image(self, ref: str) -> dict | None:
+        if ref in self.images:
+            return self.images[ref]
+        if "sha256:" + ref in self.images:
+            return self.images["sha256:" + ref]
+        for img in self.images.values():
+            if ref in img["RepoTags"]:
+                return img
+        return None
+
+
+def _matches(attrs: dict, filters: dict) -> bool:
+    labels = attrs["Config"]["Labels"]
+    for f in filters.get("label", []):
+        key, _, value = f.partition("=")
+        if key not in labels or (value and labels[key] != value):
+            return False
+    names = filters.get("name", [])
+    if names and not any(n in attrs["Name"] for n in names):
+        return False
+    return True
+
+
+def _summary(attrs: dict) -> dict:
+    return {
+        "Id": attrs["Id"],
+        "Names": [attrs["Name"]],
+        "Image": attrs["Config"]["Image"],
+        "ImageID": attrs["Image"],
+        "Labels": attrs["Config"]["Labels"],
+        "State": attrs["State"]["Status"],
+        "Status": attrs["State"]["Status"],
+    }
+
+
+def make_handler(inventory: Inventory, latency: float, log_lines: int, df_latency: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self) -> str:
+            return "unix"
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, obj, status: int = 200) -> None:
+            self._send(status, json.dumps(obj).encode())
+
+        def _not_found(self, what: str) -> None:
+            self._json({"message": f"No such {what}"}, 404)
+
+        def do_HEAD(self) -> None:
+            self._send(200, b"", "text/plain")
+
+        def do_GET(self) -> None:
+            if latency:
+                time.sleep(latency)
+            url = urlparse(self.path)
+            path = _VERSION_PREFIX_RE.sub("", unquote(url.path))
+            query = parse_qs(url.query)
+
+            if path in ("/_ping", "/version"):
+                if path == "/_ping":
+                    return self._send(200, b"OK", "text/plain")
+                return self._json({"ApiVersion": API_VERSION, "Version": "fake", "MinAPIVersion": "1.24"})
+
+            if path == "/containers/json":
+                show_all = query.get("all", ["0"])[0] in ("1", "true", "True")
+                filters = json.loads(query.get("filters", ["{}"])[0] or "{}")
+                return self._json([
+                    _summary(a) for a in inventory.containers.values()
+                    if (show_all or a["State"]["Running"]) and _matches(a, filters)
+                ])
+
+            m = re.match(r"^/containers/([^/]+)/(json|logs)$", path)
+            if m:
+                attrs = inventory.find_container(m.group(1))
+                if attrs is None:
+                    return self._not_found("container")
+                if m.group(2) == "json":
+                    return self._json(attrs)
+                tail = query.get("tail", ["all"])[0]
+                n = log_lines if tail == "all" else min(int(tail), log_lines)
+                body = "".join(
+                    f"2026-01-01T00:00:{i % 60:02d}.000000000Z {attrs['Name'][1:]} log line {i}\n"
+                    for i in range(n)
+                ).encode()
+                return self._send(200, body, "application/vnd.docker.raw-stream")
+
+            if path == "/system/df":
+                if df_latency:
+                    time.sleep(df_latency)
+                return self._json({
+                    "Images": [{"Id": i["Id"], "Size": i["Size"]} for i in inventory.images.values()],
+                    "Containers": [
+                        {"Id": a["Id"], "Labels": a["Config"]["Labels"], "ImageID": a["Image"], "SizeRw": 1_000_000}
+                        for a in inventory.containers.values()
+                    ],
+                    "Volumes": [],
+                })
+
+            m = re.match(r"^/images/(.+)/json$", path)
+            if m:
+                img = inventory.find_image(m.group(1))
+                return self._json(img) if img else self._not_found("image")
+
+            self._not_found("endpoint")
+
+    return Handler
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+class FakeDockerDaemon:
+    """Serve an Inventory on a unix socket in a background thread."""
+
+    def __init__(
+        self,
+        socket_path: str | Path,
+        containers: list[FakeContainer],
+        *,
+        latency: float = 0.0,
+        log_lines: int = 10_000,
+        df_latency: float = 0.0,
+    ) -> None:
+        self.socket_path = str(socket_path)
+        self.inventory = Inventory(containers)
+        self._server = _UnixHTTPServer(
+            self.socket_path, make_handler(self.inventory, latency, log_lines, df_latency),
+        )
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"unix://{self.socket_path}"
+
+    def start(self) -> FakeDockerDaemon:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> FakeDockerDaemon:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", required=True, help="Unix socket path to listen on")
+    parser.add_argument("--apps", help="Also write the synthetic stacks tree here")
+    parser.add_argument("--stacks", type=int, default=100)
+    parser.add_argument("--services", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--df-latency", type=float, default=0.0, help="Seconds added to /system/df")
+    args = parser.parse_args()
+
+    apps = Path(args.apps) if args.apps else Path(args.socket).with_suffix(".apps")
+    containers = generate_tree(apps, args.stacks, args.services)
+    daemon = FakeDockerDaemon(args.socket, containers, latency=args.latency, df_latency=args.df_latency)
+    print(f"Serving {len(containers)} containers on {daemon.base_url} (stacks tree: {apps})")
+    daemon._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Benchmark stack-manager endpoints against a synthetic stacks tree and a fake Docker daemon.
+
+Each scale runs in a fresh interpreter (app.config is read at import time):
+
+    python -m bench.run --scales 50,200,500 --services 4 --output bench-results.json
+
+Results are JSON so runs from different commits can be diffed or plotted.
+With --hosts K the stacks are split across K fake daemons, each with its own
+tree, configured through DOCKER_ENDPOINTS (--slow-host delays the last one).
+Each scale also times one disk usage pass; --df-latency makes the daemons'
+/system/df that slow, to check passes still complete on hosts where it is.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from contextlib import ExitStack
+
+from bench.fake_docker import FakeDockerDaemon
+from bench.synthetic import generate_tree
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def summarize(samples: list[float]) -> dict:
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(pct(0.50) * 1000, 3),
+        "p90_ms": round(pct(0.90) * 1000, 3),
+        "p99_ms": round(pct(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def serve_app(socket_path: str):
+    """Start the app under uvicorn on a unix socket in the current event loop."""
+    import uvicorn
+
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, uds=socket_path, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def time_endpoint(client, path: str, requests: int) -> dict:
+    start = time.perf_counter()
+    r = await client.get(path)
+    cold = time.perf_counter() - start
+    r.raise_for_status()
+    size = len(r.content)
+
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        r = await client.get(path)
+        samples.append(time.perf_counter() - start)
+        r.raise_for_status()
+    return {"cold_ms": round(cold * 1000, 3), "bytes": size, **summarize(samples)}
+
+
+async def time_sse(client, lines: int) -> dict:
+    """Stream a finished task of `lines` lines and report throughput."""
+    from app.services import process_service
+
+    ts = process_service.TaskState(task_id="bench-sse", command="bench", stack_name="__bench__")
+    ts.lines.extend(f"benchmark output line {i}\n" for i in range(lines))
+    ts.done = True
+    ts.exit_code = 0
+    process_service._tasks[ts.task_id] = ts
+
+    received = 0
+    start = time.perf_counter()
+    async with client.stream("GET", f"/api/stream/{ts.task_id}") as r:
+        async for line in r.aiter_lines():
+            if line.startswith("event: output"):
+                received += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "lines": received,
+        "seconds": round(elapsed, 4),
+        "lines_per_sec": round(received / elapsed, 1) if elapsed else None,
+    }
+
+
+async def time_disk_usage() -> dict:
+    """Run one disk usage pass and report its duration and per-host errors."""
+    from app.services import disk_usage
+
+    start = time.perf_counter()
+    await disk_usage.run_pass()
+    state = disk_usage.state()
+    return {
+        "seconds": round(time.perf_counter() - start, 3),
+        "stacks_measured": sum(1 for s in state["stacks"].values() if s["images"] is not None),
+        "errors": state["last_pass"]["errors"],
+    }
+
+
+async def run_scale(args) -> dict:
+    import httpx
+
+    from app.services import stack_service
+
+    any_container = next(iter(json.loads(os.environ.get("BENCH_CONTAINERS", "[]"))), None)
+    sock = os.path.join(os.environ["BENCH_TMP"], "app.sock")
+    server, task = await serve_app(sock)
+    transport = httpx.AsyncHTTPTransport(uds=sock)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            endpoints = {}
+            for path in ("/api/stacks", "/api/v1/stacks?limit=1000", "/api/status", "/api/hosts"):
+                endpoints[path] = await time_endpoint(client, path, args.requests)
+            if any_container:
+                for n in (100, 1000):
+                    path = f"/api/containers/{any_container}/logs?lines={n}"
+                    endpoints[f"/api/containers/{{name}}/logs?lines={n}"] = await time_endpoint(
+                        client, path, args.requests,
+                    )
+            sse = await time_sse(client, args.sse_lines)
+            disk = await time_disk_usage()
+
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                stack_service.list_stacks()
+            list_stacks_ms = (time.perf_counter() - start) / args.requests * 1000
+    finally:
+        server.should_exit = True
+        await task
+
+    return {
+        "stacks": args.stacks,
+        "services": args.services,
+        "hosts": args.hosts,
+        "latency_ms": args.latency * 1000,
+        "list_stacks_mean_ms": round(list_stacks_ms, 3),
+        "endpoints": endpoints,
+        "sse": sse,
+        "disk_usage": disk,
+    }
+
+
+def child(args) -> None:
+    """Run one scale; expects DOCKER_APPS_PATH / DOCKER_HOST or DOCKER_ENDPOINTS set by the parent."""
+    result = asyncio.run(run_scale(args))
+    print(json.dumps(result))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _start_hosts(stack: ExitStack, tmp: str, stacks: int, args) -> tuple[dict, list]:
+    """Start the fake daemon(s) for one scale; returns (env, containers)."""
+    if args.hosts <= 1:
+        apps = Path(tmp) / "apps"
+        containers = generate_tree(apps, stacks, args.services)
+        daemon = stack.enter_context(FakeDockerDaemon(
+            Path(tmp) / "docker.sock", containers, latency=args.latency, df_latency=args.df_latency,
+        ))
+        return {"DOCKER_APPS_PATH": str(apps), "DOCKER_HOST": daemon.base_url}, containers
+
+    endpoints, all_containers = [], []
+    for h in range(args.hosts):
+        name = f"host{h}"
+        apps = Path(tmp) / f"apps-{name}"
+        per_host = stacks // args.hosts + (h < stacks % args.hosts)
+        containers = generate_tree(apps, per_host, args.services, seed=42 + h, prefix=name)
+        latency = args.slow_host if args.slow_host and h == args.hosts - 1 else args.latency
+        daemon = stack.enter_context(FakeDockerDaemon(
+            Path(tmp) / f"{name}.sock", containers, latency=latency, df_latency=args.df_latency,
+        ))
+        endpoints.append(f"{name}={daemon.base_url},{apps}")
+        all_containers.extend(containers)
+    return {"DOCKER_ENDPOINTS": ";".join(endpoints)}, all_containers
+
+
+def parent(args) -> None:
+    results = []
+    for stacks in (int(s) for s in args.scales.split(",")):
+        with tempfile.TemporaryDirectory(prefix="stack-manager-bench-") as tmp, ExitStack() as daemons:
+            host_env, containers = _start_hosts(daemons, tmp, stacks, args)
+            env = {
+                **os.environ,
+                **host_env,
+                "BENCH_TMP": tmp,
+                "BENCH_CONTAINERS": json.dumps([c.name for c in containers[:1]]),
+                "PYTHONPATH": str(ROOT),
+            }
+            cmd = [
+                sys.executable, "-m", "bench.run", "--child",
+                "--stacks", str(stacks), "--services", str(args.services), "--hosts", str(args.hosts),
+                "--latency", str(args.latency), "--requests", str(args.requests),
+                "--sse-lines", str(args.sse_lines),
+            ]
+            print(f"[bench] {stacks} stacks x {args.services} services on {args.hosts} host(s) "
+                  f"({len(containers)} containers)...", file=sys.stderr)
+            out = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True)
+            if out.returncode != 0:
+                sys.stderr.write(out.stderr)
+                raise SystemExit(f"benchmark failed at {stacks} stacks")
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "params": {
+                "services": args.services,
+                "hosts": args.hosts,
+                "slow_host": args.slow_host,
+                "latency": args.latency,
+                "df_latency": args.df_latency,
+                "requests": args.requests,
+                "sse_lines": args.sse_lines,
+            },
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"[bench] wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="stack-manager benchmark harness")
+    parser.add_argument("--scales", default="50,200,500", help="Comma-separated stack counts")
+    parser.add_argument("--stacks", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--services", type=int, default=4, help="Services per stack")
+    parser.add_argument("--hosts", type=int, default=1, help="Fake Docker hosts the stacks are split across")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake daemon latency per request (s)")
+    parser.add_argument("--slow-host", type=float, default=0.0, help="Latency per request (s) of the last host")
+    parser.add_argument("--df-latency", type=float, default=0.0, help="Fake daemon latency of /system/df (s)")
+    parser.add_argument("--requests", type=int, default=20, help="Timed requests per endpoint")
+    parser.add_argument("--sse-lines", type=int, default=20_000, help="Lines in the SSE throughput task")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    child(args) if args.child else parent(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Load-test /api/stream/{task_id} with many concurrent SSE clients.
+
+Starts a server process running the app, which launches fake long-running tasks
+through process_service.run_command (a stub command printing timestamped lines
+at a fixed rate). Then attaches many concurrent clients and reports:
+
+- end-to-end line latency (emit -> client receive)
+- event loop lag inside the server
+- server CPU and RSS, total and per connection
+
+    python -m bench.sse_load --tasks 1 --clients 300 --rate 20 --duration 20
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.run import ROOT, _git_commit, summarize
+
+# Stub task: print "ts=<epoch> seq=<n> <padding>" lines at `rate` per second for `duration` seconds
+EMITTER = """
+import sys, time
+rate, duration, size = float(sys.argv[1]), float(sys.argv[2]), int(sys.argv[3])
+pad = "x" * max(size - 40, 0)
+start = time.time()
+n = 0
+while time.time() - start < duration:
+    print(f"ts={time.time():.6f} seq={n} {pad}", flush=True)
+    n += 1
+    time.sleep(max(start + n / rate - time.time(), 0))
+"""
+
+
+# --- Server side ------------------------------------------------------------------
+
+async def _loop_lag_sampler(samples: list[float], interval: float = 0.05) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(time.perf_counter() - start - interval, 0.0))
+
+
+async def _serve(args) -> None:
+    import uvicorn
+
+    from app.main import app
+    from app.services import process_service
+
+    lag: list[float] = []
+    server = uvicorn.Server(uvicorn.Config(app, uds=args.socket, log_level="warning", lifespan="on"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    task_ids = []
+    for i in range(args.tasks):
+        ts = await process_service.run_command(
+            [sys.executable, "-u", "-c", EMITTER, str(args.rate), str(args.duration), str(args.line_bytes)],
+            stack_name=f"__load{i}__",
+            cwd=os.environ["DOCKER_APPS_PATH"],
+            label=f"load task {i}",
+        )
+        task_ids.append(ts.task_id)
+
+    sampler = asyncio.create_task(_loop_lag_sampler(lag))
+    Path(args.ready_file).write_text(json.dumps({"task_ids": task_ids}))
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, lambda: setattr(server, "should_exit", True))
+    await serve_task
+    sampler.cancel()
+    Path(args.stats_file).write_text(json.dumps({"loop_lag": summarize(lag or [0.0])}))
+
+
+# --- Client side ------------------------------------------------------------------
+
+def _proc_sample(pid: int) -> tuple[float, int]:
+    """Return (cpu_seconds, rss_bytes) for a process, from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+async def _client(client, task_id: str, latencies: list[float], counts: list[int], connected: asyncio.Event) -> None:
+    joined = time.time()
+    received = 0
+    async with client.stream("GET", f"/api/stream/{task_id}") as r:
+        connected.set()
+        async for line in r.aiter_lines():
+            if not line.startswith("data: ts="):
+                continue
+            now = time.time()
+            emitted = float(line[9:].split(" ", 1)[0])
+            received += 1
+            # Backlog replayed on connect is not latency; only count lines emitted after joining
+            if emitted >= joined:
+                latencies.append(now - emitted)
+    counts.append(received)
+
+
+async def _drive(args, pid: int, task_ids: list[str]) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.clients + 10, max_keepalive_connections=args.clients + 10)
+    transport = httpx.AsyncHTTPTransport(uds=args.socket, limits=limits)
+    latencies: list[float] = []
+    counts: list[int] = []
+
+    cpu0, rss0 = _proc_sample(pid)
+    t0 = time.perf_counter()
+    rss_peak = rss0
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+        events = []
+        clients = []
+        for i in range(args.clients):
+            ev = asyncio.Event()
+            events.append(ev)
+            clients.append(asyncio.create_task(
+                _client(client, task_ids[i % len(task_ids)], latencies, counts, ev)
+            ))
+            if args.ramp:
+                await asyncio.sleep(args.ramp / args.clients)
+        await asyncio.gather(*(e.wait() for e in events))
+        connect_time = time.perf_counter() - t0
+
+        pending = set(clients)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=0.5)
+            rss_peak = max(rss_peak, _proc_sample(pid)[1])
+        for c in clients:
+            c.result()
+
+    elapsed = time.perf_counter() - t0
+    cpu1, _ = _proc_sample(pid)
+    cpu = cpu1 - cpu0
+    return {
+        "connect_all_seconds": round(connect_time, 3),
+        "run_seconds": round(elapsed, 3),
+        "lines_received": sum(counts),
+        "line_latency": summarize(latencies or [0.0]),
+        "server_cpu_seconds": round(cpu, 3),
+        "server_cpu_percent": round(cpu / elapsed * 100, 1),
+        "server_cpu_ms_per_connection_second": round(cpu / elapsed / args.clients * 1000, 3),
+        "server_rss_baseline_mb": round(rss0 / 2**20, 1),
+        "server_rss_peak_mb": round(rss_peak / 2**20, 1),
+        "server_rss_kb_per_connection": round((rss_peak - rss0) / args.clients / 1024, 1),
+    }
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="stack-manager-sse-") as tmp:
+        apps = Path(tmp) / "apps"
+        apps.mkdir()
+        args.socket = str(Path(tmp) / "app.sock")
+        ready = Path(tmp) / "ready.json"
+        stats = Path(tmp) / "stats.json"
+        env = {**os.environ, "DOCKER_APPS_PATH": str(apps), "PYTHONPATH": str(ROOT)}
+        cmd = [
+            sys.executable, "-m", "bench.sse_load", "--server",
+            "--socket", args.socket, "--ready-file", str(ready), "--stats-file", str(stats),
+            "--tasks", str(args.tasks), "--rate", str(args.rate),
+            "--duration", str(args.duration), "--line-bytes", str(args.line_bytes),
+        ]
+        proc = subprocess.Popen(cmd, env=env, cwd=ROOT)
+        try:
+            deadline = time.time() + 30
+            while not ready.exists():
+                if proc.poll() is not None or time.time() > deadline:
+                    raise SystemExit("server failed to start")
+                time.sleep(0.05)
+            task_ids = json.loads(ready.read_text())["task_ids"]
+            result = asyncio.run(_drive(args, proc.pid, task_ids))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+        if stats.exists():
+            result.update(json.loads(stats.read_text()))
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "params": {
+                "tasks": args.tasks,
+                "clients": args.clients,
+                "rate": args.rate,
+                "duration": args.duration,
+                "line_bytes": args.line_bytes,
+                "ramp": args.ramp,
+            },
+        },
+        "result": result,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SSE load test for /api/stream/{task_id}")
+    parser.add_argument("--tasks", type=int, default=1, help="Concurrent fake tasks (clients spread round-robin)")
+    parser.add_argument("--clients", type=int, default=200, help="Concurrent SSE clients")
+    parser.add_argument("--rate", type=float, default=20, help="Lines per second per task")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds each task keeps emitting")
+    parser.add_argument("--line-bytes", type=int, default=80, help="Approximate bytes per output line")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which clients connect")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--server", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--socket", help=argparse.SUPPRESS)
+    parser.add_argument("--ready-file", help=argparse.SUPPRESS)
+    parser.add_argument("--stats-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.server:
+        asyncio.run(_serve(args))
+        return
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Generate a synthetic DOCKER_APPS_PATH tree and the matching container inventory."""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass, field
+from pathlib import Path
+
+MODES = ("pass", "legacy", "none")
+
+
+@dataclass
+class FakeContainer:
+    name: str
+    project: str
+    service: str
+    image: str
+    status: str = "running"
+    health: str | None = None  # healthy / unhealthy / starting, None = no healthcheck
+    labels: dict[str, str] = field(default_factory=dict)
+
+
+def generate_tree(
+    root: Path,
+    stacks: int,
+    services: int,
+    *,
+    active_ratio: float = 0.7,
+    seed: int = 42,
+    prefix: str = "stack",
+) -> list[FakeContainer]:
+    """Write `stacks` compose projects with `services` services each under root.
+
+    Modes rotate through pass/legacy/none; about half the services set container_name.
+    Returns the containers a daemon would report for the active stacks.
+    """
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    containers: list[FakeContainer] = []
+
+    for i in range(stacks):
+        name = f"{prefix}-{i:04d}"
+        d = root / name
+        d.mkdir(exist_ok=True)
+        mode = MODES[i % len(MODES)]
+        active = rng.random() < active_ratio
+
+        lines = ["services:"]
+        for j in range(services):
+            svc = f"svc{j}"
+            image = f"registry.example.com/{name}/{svc}:latest"
+            lines.append(f"  {svc}:")
+            lines.append(f"    image: {image}")
+            if j % 2 == 0:
+                container_name = f"{name}-{svc}"
+                lines.append(f"    container_name: {container_name}")
+            else:
+                container_name = f"{name}-{svc}-1"
+            if j > 0:
+                lines.append("    depends_on:")
+                lines.append("      - svc0")
+            lines.append("    environment:")
+            lines.append(f"      APP_NAME: {name}")
+            lines.append(f"      APP_PORT: \"{8000 + j}\"")
+
+            if active:
+                health = rng.choice((None, None, "healthy", "healthy", "unhealthy"))
+                containers.append(FakeContainer(
+                    name=container_name,
+                    project=name,
+                    service=svc,
+                    image=image,
+                    status="running" if rng.random() > 0.05 else "exited",
+                    health=health,
+                    labels={
+                        "com.docker.compose.project": name,
+                        "com.docker.compose.service": svc,
+                        "com.docker.compose.container-number": "1",
+                    },
+                ))
+
+        (d / "docker-compose.yml").write_text("\n".join(lines) + "\n")
+        if mode == "pass":
+            (d / ".env.template").write_text(
+                f"APP_NAME={name}\nDB_PASSWORD=pass://vault/{name}/db-password\n"
+            )
+        elif mode == "legacy":
+            (d / ".env").write_text(f"APP_NAME={name}\n")
+        if active:
+            (d / ".inuse").touch()
+
+    return containers